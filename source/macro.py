@@ -4,16 +4,25 @@
 Diablo 4 宏程序 - 主程序
 """
 
+import argparse
+import asyncio
+import bisect
+import csv
+import itertools
+import json
 import time
 import threading
 import xml.etree.ElementTree as ET
 import keyboard
 import mouse
 import re
-import sys
 import os
+import hashlib
+import io
+import marshal
+from array import array
 from collections import deque
-from typing import Dict, List, Optional, Callable, Any
+from typing import Dict, List, Optional, Callable, Any, Generator, Iterable, Iterator, Sequence, Tuple
 
 # 彩色输出支持
 try:
@@ -33,6 +42,16 @@ try:
 except ImportError:
     WINDOW_DETECTION_AVAILABLE = False
 
+# Windows 控制台事件和文件变化通知（空闲时阻塞等待，不轮询）
+try:
+    import win32api
+    import win32con
+    import win32event
+    import win32file
+    WIN32_EVENTS_AVAILABLE = True
+except ImportError:
+    WIN32_EVENTS_AVAILABLE = False
+
 
 # 程序配置常量
 class Config:
@@ -50,20 +69,60 @@ class Config:
     HOTKEY_PAUSE = 'F10'
     HOTKEY_RELOAD = 'F11'
     HOTKEY_EXIT = 'F12'
+    HOTKEY_TRACE = 'F9'                # 打印定时统计（漂移、抖动）和延迟追踪报告（追踪需启用）
+    HOTKEY_RECORD = 'F8'               # 开始/结束录制
 
     # 按键输入缓冲配置
     INPUT_BUFFER_ENABLED = True        # 启用按键输入缓冲
-    INPUT_BUFFER_SIZE = 3              # 最大缓冲队列长度
-    RAPID_PRESS_THRESHOLD = 0.2        # 连按时间阈值（秒），在此时间内的重复按键才会缓冲
+    INPUT_BUFFER_SIZE = 3              # 最大缓冲队列长度（写满时淘汰最早的低优先级请求）
+    INPUT_BUFFER_EXPIRY = 0.5          # 缓冲的请求超过此时间（秒）仍未执行则丢弃（宏可用"缓冲时限"覆盖）
+    RAPID_PRESS_THRESHOLD = 0.2        # 连按时间阈值（秒），"自动"策略下在此时间内的重复按键才会缓冲（宏可用"连按阈值"覆盖）
+
+    # 执行通道
+    DEFAULT_CHANNEL = 'main'           # 未配置"通道"的宏共用的执行通道（同一通道内新宏中断旧宏）
   
     # 时间间隔常量（秒）  
     KEY_PRESS_INTERVAL = 0.01          # 按键后等待时间
-    DELAY_CHECK_INTERVAL = 0.05        # 延迟可中断检查间隔
+    INPUT_RATE_BUDGET = 200            # 每秒注入的输入事件上限（加载和 --check 时超出则警告；连续按键约为 200）
     DEFAULT_DELAY_FALLBACK = 0.1       # 延迟解析失败时的默认值
     ESC_DOUBLE_CLICK_INTERVAL = 0.5    # Esc 双击间隔
     CONTROL_KEY_DEBOUNCE = 0.1         # 控制热键防抖间隔
     THREAD_JOIN_TIMEOUT = 1.0          # 线程join超时时间
-    WINDOW_FOCUS_CHECK_INTERVAL = 0.1  # 窗口焦点检查间隔
+    WINDOW_FOCUS_CHECK_INTERVAL = 0.1  # 窗口焦点检查间隔（只在有宏执行时检查）
+    HOTKEY_REPEAT_WINDOW = 1.0         # 同一键在此时间内再次按下视为系统自动重复（Windows 重复延迟最长 1 秒）
+
+    # 定时调度（秒）
+    TIMING_SLEEP_MARGIN = 0.016        # 事件等待提前结束的余量（Windows 默认计时精度约 15.6ms）
+    TIMING_SLEEP_STEP = 0.001          # 精细睡眠阶段的步长
+    TIMING_SPIN_THRESHOLD = 0.002      # 剩余时间低于此值时改为自旋等待
+    TIMING_RESYNC_THRESHOLD = 0.05     # 滞后超过此值时重新对齐时间线（避免补发突发按键）
+    STOP_LATENCY_BOUND = 0.005         # 停止请求到宏结束的保证上限（含 TIMING_SLEEP_STEP 与线程唤醒）
+
+    # 输入注入后端：'batched' 将同时发生的事件合并为一次调用，'keyboard' 逐个注入
+    INPUT_BACKEND = 'batched'
+
+    # 宏执行器：'thread' 在一个常驻线程上复用所有通道，'asyncio' 每个宏是事件循环中的一个任务
+    EXECUTOR = 'thread'
+
+    # 延迟追踪：记录触发、开始、每个动作的计划/实际时间、停止请求/停止时间
+    TRACE_ENABLED = False
+    TRACE_CAPACITY = 1 << 16           # 环形缓冲区容量（事件数），写满后覆盖最早的事件
+    TRACE_EXPORT_FILE = ''             # 退出或打印报告时导出的文件（.json / .csv），空表示不导出
+
+    # 输入录制：录下的按键/鼠标事件转换为文本格式宏，追加到 RECORD_FILE
+    RECORD_FILE = 'recorded_macros.txt'
+    RECORD_CAPACITY = 1 << 16          # 预分配的事件缓冲区容量，写满后丢弃之后的事件
+    RECORD_QUANTUM = 0.01              # 延迟和按住时长的量化步长（秒）
+    RECORD_TAP_THRESHOLD = 0.15        # 按下到松开短于此值且中间没有其他事件时记为"按下"，否则为 hold
+    RECORD_IDLE_GAP = 1.0              # 超过此值的空闲间隔截短为此值
+
+    # 配置缓存：解析并编译后的宏保存在 <配置文件>.cache，内容未变化时跳过解析
+    CONFIG_CACHE_ENABLED = True
+
+    # 配置文件监视：保存后自动增量重载（秒）
+    CONFIG_WATCH_ENABLED = False
+    CONFIG_WATCH_INTERVAL = 0.25       # 轮询文件修改时间的间隔（没有 pywin32 文件变化通知时）
+    CONFIG_WATCH_DEBOUNCE = 0.5        # 文件保持不变这么久之后才重载（合并连续写入）
 
     # 安全保护
     FORCE_RELEASE_MODIFIER_KEYS = ['shift', 'ctrl', 'alt', 'win']  # 强制释放的修饰键
@@ -93,6 +152,10 @@ class LanguageMapping:
         '触发键': 'trigger_key', '循环': 'loop', '重复': 'repeat', '动作': 'actions',
         '重置按键': 'reset_keys', '附加按键': 'additional_keys', '默认延迟': 'default_delay',
         '跳过窗口检测': 'skip_window_check', '忽略窗口检测': 'skip_window_check',
+        '通道': 'channel', '独占': 'exclusive',
+        '优先级': 'priority', '缓冲': 'buffer', '缓冲时限': 'buffer_expiry', '连按阈值': 'rapid_threshold',
+        # 缓冲策略
+        '自动': 'auto', '中断': 'preempt', '排队': 'queue', '忽略': 'ignore',
         '结束按键': 'finish_actions', '完成按键': 'finish_actions',
         '结束动作': 'finish_actions', '完成动作': 'finish_actions',
         '起始动作': 'start_actions', '开始动作': 'start_actions',
@@ -128,6 +191,13 @@ class LanguageMapping:
     # XML 格式的重复模式映射（数字 -> 英文）
     XML_REPEAT_MODE = {'0': 'once', '1': 'loop', '2': 'hold'}
 
+    # XML 格式的鼠标事件（按下与松开分别记录）-> (动作类型, 按钮)
+    XML_MOUSE_EVENTS = {
+        'LeftDown': ('mousedown', 'left'), 'LeftUp': ('mouseup', 'left'),
+        'RightDown': ('mousedown', 'right'), 'RightUp': ('mouseup', 'right'),
+        'MiddleDown': ('mousedown', 'middle'), 'MiddleUp': ('mouseup', 'middle'),
+    }
+
     # 鼠标动作映射（用于动作解析）
     MOUSE_ACTIONS = {
         # 单击
@@ -153,10 +223,18 @@ class LanguageMapping:
         'warn_config_format': '[!] 警告: 配置行格式错误（缺少\'=\'）: {0}',
         'warn_unknown_config': '[!] 警告: 未知的配置项 \'{0}\' 在宏 \'{1}\'',
         'warn_parse_failed': '[!] 警告: 解析配置行失败: {0}',
+        'warn_action_syntax': '[!] 警告: 第 {0} 行第 {1} 列: {2}',
+        'err_unknown_token': '无法识别的内容 \'{0}\'',
+        'err_missing_args': '动作 \'{0}\' 缺少参数',
         'warn_error': '   错误: {0}',
         'warn_duplicate_key': '[!] 警告: 触发键 \'{0}\' 重复!',
         'warn_key_override': '   宏 \'{0}\' 将被覆盖为 \'{1}\'',
         'warn_buffer_full': '[!] 按键缓冲队列已满 ({0})，跳过宏: {1}',
+        'warn_unknown_hotkey': '[!] 警告: 无法识别的热键 \'{0}\'',
+        'warn_unknown_key': '[!] 警告: 宏 \'{0}\' 中的按键 \'{1}\' 无法识别，执行时将跳过',
+        'warn_invalid_macro': '[!] 警告: 宏 \'{0}\' 的定义无效，已跳过: {1}',
+        'warn_repeat_count': '[!] 警告: 宏 \'{0}\' 的重复次数 {1} 无效，按 1 次执行',
+        'warn_unknown_scan_code': '[!] 警告: 未知的扫描码 {0}（宏 \'{1}\'），已跳过',
 
         # 解析和加载信息
         'unnamed_macro': '未命名宏',
@@ -201,11 +279,37 @@ class LanguageMapping:
         'pause_on': '已暂停',
         'pause_off': '已恢复',
         'config_reloaded': '配置已重载',
+        'config_reload_diff': '新增 {0} | 修改 {1} | 删除 {2} | 未变 {3}',
+        'config_watching': '正在监视配置文件: {0}',
         'emergency_stopped': '急停',
         'app_start': '宏程序已启动',
         'app_hints': '[{0} 暂停 | {1} 重载 | {2} 退出 | ESC×2 急停]',
         'app_exiting': '退出...',
         'app_stopped': '程序已停止',
+        'trace_title': '延迟追踪（毫秒 p50 / p95 / p99）',
+        'trace_row': '  {0}: 触发→开始 {1} | 动作误差 {2} | 停止 {3}',
+        'trace_empty': '没有追踪数据',
+        'trace_disabled': '延迟追踪未启用（使用 --trace 启动）',
+        'trace_exported': '追踪报告已导出: {0}',
+        'hook_stats': '热键回调: {0} 次，最长 {1:.2f} ms',
+        'drift_title': '定时统计（每次等待的滞后，毫秒）',
+        'drift_row': '  {0}: {1} 次等待 | 平均 {2:.3f} | 抖动 {3:.3f} | 最大 {4:.3f} | 最近 {5:.3f} | 重新对齐 {6} 次',
+        'warn_watch_fallback': '[!] 警告: 无法监听配置文件变化通知，改为轮询: {0}',
+        'optimize_title': '宏优化（动作数 优化前→优化后 | 每次触发的周期）',
+        'optimize_row': '  {0}: {1} → {2} 个动作 | {3:.0f}ms → {4:.0f}ms{5}',
+        'optimize_repeat': ' | 重复 {0} 次',
+        'timing_title': '定时分析（输入速率预算 {0:g} 事件/秒）',
+        'timing_row': '  {0} [{1}]: 周期 {2:.0f}ms | {3} 个事件 | {4} 事件/秒 | 最长等待 {5:.0f}ms | 停止 ≤{6:g}ms（单步 {7} 个事件）{8}',
+        'timing_unbounded': '无上限',
+        'timing_over': '  ← 超出预算',
+        'timing_ok': '全部 {0} 个宏都在输入速率预算内',
+        'timing_over_count': '{0} 个宏超出输入速率预算',
+        'load_rate': '最高输入速率 {0} 事件/秒（{1}）',
+        'warn_input_rate': '[!] 警告: 宏 \'{0}\' 每秒注入 {1} 个输入事件，超过预算 {2:g}',
+        'record_start': '开始录制（按 {0} 结束）',
+        'record_saved': '录制完成: {0} 个事件 -> {1} 个动作，已追加到 {2}',
+        'record_empty': '没有录制到事件',
+        'warn_record_skipped': '[!] 警告: 以下按键无法写入文本格式，已跳过: {0}',
 
         # 配置文件相关
         'config_not_found': '配置文件不存在: {0}',
@@ -310,70 +414,1300 @@ class Logger:
 log = Logger
 
 
+# ========================================
+# 窗口焦点跟踪
+# ========================================
+class WindowSource:
+    """前台窗口信息来源（可替换的后端）"""
+
+    def get_foreground_title(self) -> str:
+        """返回当前前台窗口标题"""
+        raise NotImplementedError
+
+
+class Win32WindowSource(WindowSource):
+    """通过 pywin32 读取前台窗口"""
+
+    def get_foreground_title(self) -> str:
+        try:
+            hwnd = win32gui.GetForegroundWindow()
+            return win32gui.GetWindowText(hwnd)
+        except Exception:
+            return ""
+
+
 class WindowMonitor:
-    """窗口焦点监控器 - 用于检测游戏窗口是否活动"""
+    """窗口焦点监控器 - 用于检测游戏窗口是否活动
 
-    def __init__(self, target_window_names: Optional[List[str]] = None):
+    后台线程每隔 Config.WINDOW_FOCUS_CHECK_INTERVAL 查询一次前台窗口，
+    结果缓存在 target_active 中，引擎读取它不需要任何系统调用。
+    目标窗口失去焦点时立即通知已注册的监听器。
+    set_tracking(False) 暂停定时查询（没有宏在执行时），跟踪线程阻塞等待，不产生唤醒。
+    """
+
+    def __init__(self, target_window_names: Optional[List[str]] = None,
+                 source: Optional[WindowSource] = None):
         """
         初始化窗口监控器
+
+        Args:
+            target_window_names: 目标窗口名称列表，None 或空列表表示不限制窗口
+            source: 前台窗口信息来源，默认使用 pywin32
         """
         self.target_window_names = target_window_names
+        if source is None and WINDOW_DETECTION_AVAILABLE:
+            source = Win32WindowSource()
+        self.source = source
+
         # 只有当提供了非空列表时才启用窗口检测
-        self.enabled = (WINDOW_DETECTION_AVAILABLE and
+        self.enabled = (source is not None and
                        target_window_names is not None and
                        len(target_window_names) > 0)
 
-        if not WINDOW_DETECTION_AVAILABLE and target_window_names:
+        if source is None and target_window_names:
             log.warning(_msg('warn_need_pywin32'))
 
+        self.target_active = True  # 缓存的焦点状态（未启用时始终为 True）
+        self._last_title: Optional[str] = None
+        self._focus_lost_listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()  # 跟踪线程和执行线程都可能调用 refresh()
+        self._stop_event = threading.Event()
+        self._tracking = threading.Event()  # 置位期间定时查询
+        self._tracking.set()
+        self._thread: Optional[threading.Thread] = None
+
+        if self.enabled:
+            self.refresh()
+            self.start()
+
     def get_active_window_title(self) -> str:
         """获取当前活动窗口标题"""
-        if not WINDOW_DETECTION_AVAILABLE:
-            return ""
-
-        try:
-            hwnd = win32gui.GetForegroundWindow()
-            return win32gui.GetWindowText(hwnd)
-        except Exception:
+        if self.source is None:
             return ""
+        return self.source.get_foreground_title()
 
     def is_target_window_active(self) -> bool:
-        """检查目标窗口是否处于激活状态"""
-        if not self.enabled:
-            return True  # 未启用时，始终返回 True（不限制）
+        """检查目标窗口是否处于激活状态（读取缓存）"""
+        return self.target_active
+
+    def add_focus_lost_listener(self, listener: Callable[[], None]) -> None:
+        """注册焦点丢失监听器（在跟踪线程中调用）"""
+        self._focus_lost_listeners.append(listener)
+
+    def refresh(self) -> bool:
+        """立即查询一次前台窗口并更新缓存"""
+        with self._lock:
+            title = self.get_active_window_title()
+            if title == self._last_title:
+                return self.target_active  # 标题未变，无需重新匹配
+            self._last_title = title
+
+            # 检查当前窗口标题是否包含目标窗口名称
+            was_active = self.target_active
+            self.target_active = any(target in title for target in self.target_window_names)
+
+        if was_active and not self.target_active:
+            for listener in self._focus_lost_listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    log.error(_msg('warn_error', e))
+        return self.target_active
+
+    def start(self) -> None:
+        """启动后台跟踪线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._track, name='WindowMonitor', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台跟踪线程"""
+        self._stop_event.set()
+        self._tracking.set()  # 唤醒暂停中的跟踪线程
+
+    def set_tracking(self, active: bool) -> None:
+        """恢复/暂停定时查询（恢复时立即查询一次）"""
+        if active:
+            self._tracking.set()
+        else:
+            self._tracking.clear()
+
+    def _track(self) -> None:
+        """跟踪线程主循环"""
+        while True:
+            self._tracking.wait()
+            if self._stop_event.is_set():
+                return
+            self.refresh()
+            if self._stop_event.wait(Config.WINDOW_FOCUS_CHECK_INTERVAL):
+                return
+
+
+# ========================================
+# 输入注入后端
+# ========================================
+class KeyResolver:
+    """按键名 -> 扫描码的解析缓存（进程内共享，重载配置后仍然有效）
+
+    keyboard 库每次收到按键名字符串都会重新拆分并查找系统按键表。
+    这里每个按键名只解析一次：加载配置时解析宏用到的所有按键，注入时只查一次字典，
+    再以扫描码调用 keyboard.send。组合键（ctrl+1）解析为各键的主扫描码，按顺序按下、逆序松开。
+    无法识别的按键解析为空元组并记入 unknown，加载时报告，注入时跳过。
+    """
+
+    _SPLIT_RE = re.compile(r'\+(?=.)')  # 末尾的 + 是按键本身（例如 "keypad +"）
+
+    def __init__(self):
+        self.codes: Dict[str, Tuple[int, ...]] = {}          # 按键名 -> 各键的主扫描码
+        self.alternatives: Dict[str, Tuple[int, ...]] = {}   # 单个按键名 -> 全部扫描码（热键绑定用）
+        self.unknown: set = set()
+
+    def resolve(self, name: str) -> Tuple[int, ...]:
+        """解析按键名（可以是组合键），无法识别时返回空元组"""
+        codes = self.codes.get(name)
+        if codes is None:
+            try:
+                codes = tuple(self.scan_codes(part.strip())[0] for part in self._SPLIT_RE.split(name))
+            except (ValueError, IndexError):
+                codes = ()
+            if not codes:
+                self.unknown.add(name)
+            self.codes[name] = codes
+        return codes
+
+    def scan_codes(self, key: str) -> Tuple[int, ...]:
+        """单个按键的全部扫描码，无法识别时抛出 ValueError"""
+        codes = self.alternatives.get(key)
+        if codes is None:
+            codes = self.alternatives[key] = tuple(keyboard.key_to_scan_codes(key))
+        return codes
+
+    def clear(self) -> None:
+        self.codes.clear()
+        self.alternatives.clear()
+        self.unknown.clear()
+
+
+key_resolver = KeyResolver()
+
+
+class InputBackend:
+    """输入注入后端接口
+
+    submit() 接收一组同时发生的事件 (类型, 按键名/鼠标按钮)，
+    其余方法是单个事件的快捷方式。子类至少实现 submit()。
+    """
+
+    # 事件类型
+    TAP = 0          # 按下并松开
+    DOWN = 1         # 按下
+    UP = 2           # 松开
+    CLICK = 3        # 鼠标单击
+    DOUBLECLICK = 4  # 鼠标双击
+    MOUSEDOWN = 5    # 鼠标按钮按下
+    MOUSEUP = 6      # 鼠标按钮松开
+
+    MOUSE_KINDS = (CLICK, DOUBLECLICK, MOUSEDOWN, MOUSEUP)
+
+    def submit(self, events: Sequence[Tuple[int, str]]) -> None:
+        """提交一组同时发生的事件"""
+        raise NotImplementedError
+
+    def tap(self, key: str) -> None:
+        self.submit(((self.TAP, key),))
+
+    def press(self, key: str) -> None:
+        self.submit(((self.DOWN, key),))
+
+    def release(self, key: str) -> None:
+        self.submit(((self.UP, key),))
+
+    def click(self, button: str) -> None:
+        self.submit(((self.CLICK, button),))
+
+    def double_click(self, button: str) -> None:
+        self.submit(((self.DOUBLECLICK, button),))
+
+    def mouse_down(self, button: str) -> None:
+        self.submit(((self.MOUSEDOWN, button),))
+
+    def mouse_up(self, button: str) -> None:
+        self.submit(((self.MOUSEUP, button),))
+
+    def tap_keys(self, keys: Sequence[str]) -> None:
+        """依次按下并松开多个键"""
+        self.submit([(self.TAP, key) for key in keys])
+
+    def press_keys(self, keys: Sequence[str]) -> None:
+        """同时按下多个键"""
+        self.submit([(self.DOWN, key) for key in keys])
+
+    def release_keys(self, keys: Sequence[str]) -> None:
+        """同时松开多个键"""
+        self.submit([(self.UP, key) for key in keys])
 
-        current_title = self.get_active_window_title()
 
-        # 检查当前窗口标题是否包含目标窗口名称
-        return any(target in current_title for target in self.target_window_names)
+class KeyboardMouseBackend(InputBackend):
+    """通过 keyboard / mouse 库逐个注入事件"""
+
+    def submit(self, events: Sequence[Tuple[int, str]]) -> None:
+        for kind, name in events:
+            self._inject(kind, name)
+
+    def tap(self, key: str) -> None:
+        self._inject(self.TAP, key)
+
+    def press(self, key: str) -> None:
+        self._inject(self.DOWN, key)
+
+    def release(self, key: str) -> None:
+        self._inject(self.UP, key)
+
+    def click(self, button: str) -> None:
+        mouse.click(button)
+
+    def double_click(self, button: str) -> None:
+        mouse.double_click(button)
+
+    def mouse_down(self, button: str) -> None:
+        mouse.press(button)
+
+    def mouse_up(self, button: str) -> None:
+        mouse.release(button)
+
+    def _inject(self, kind: int, name: str) -> None:
+        """注入单个事件"""
+        if kind == self.CLICK:
+            mouse.click(name)
+        elif kind == self.DOUBLECLICK:
+            mouse.double_click(name)
+        elif kind == self.MOUSEDOWN:
+            mouse.press(name)
+        elif kind == self.MOUSEUP:
+            mouse.release(name)
+        else:
+            # 以预解析的扫描码注入，未知按键（加载时已报告）跳过
+            codes = key_resolver.codes.get(name) or key_resolver.resolve(name)
+            if not codes:
+                return
+            if kind == self.TAP:
+                keyboard.send(codes)
+            elif kind == self.DOWN:
+                keyboard.send(codes, do_press=True, do_release=False)
+            else:
+                keyboard.send(codes, do_press=False, do_release=True)
+
+
+class BatchedBackend(KeyboardMouseBackend):
+    """批量注入后端 - 将一组连续的同类键盘事件合并为一次 keyboard.send 调用"""
+
+    def submit(self, events: Sequence[Tuple[int, str]]) -> None:
+        count = len(events)
+        if count == 1:
+            self._inject(*events[0])
+            return
+
+        i = 0
+        while i < count:
+            kind = events[i][0]
+            j = i + 1
+            while j < count and events[j][0] == kind:
+                j += 1
+            if kind in self.MOUSE_KINDS or j - i == 1:
+                for event in events[i:j]:
+                    self._inject(*event)
+            else:
+                self._send(kind, [name for _, name in events[i:j]])
+            i = j
+
+    def _send(self, kind: int, keys: List[str]) -> None:
+        """以预解析的扫描码步骤调用一次 keyboard.send（未知按键跳过）"""
+        codes = [c for c in map(key_resolver.resolve, keys) if c]
+        if kind == self.TAP and len(codes) > 1:
+            # 每个键（组合键）一个步骤：依次按下并松开
+            keyboard.send(tuple(tuple((c,) for c in combo) for combo in codes))
+        elif codes:
+            # 扁平的扫描码列表被解析为同一个步骤：一起按下（并松开）或一起松开
+            keyboard.send([c for combo in codes for c in combo], do_press=(kind != self.UP),
+                          do_release=(kind != self.DOWN))
+
+
+class RecordingBackend(InputBackend):
+    """内存记录后端 - 不注入任何输入，只记录事件（用于测试和基准）"""
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self.clock = clock
+        self.events: List[Tuple[float, int, str]] = []  # (时间, 类型, 名称)
+        self.batches: List[int] = []                     # 每次 submit 的事件数
+
+    def submit(self, events: Sequence[Tuple[int, str]]) -> None:
+        now = self.clock()
+        self.events.extend((now, kind, name) for kind, name in events)
+        self.batches.append(len(events))
+
+    def clear(self) -> None:
+        self.events.clear()
+        self.batches.clear()
+
+
+def create_input_backend(name: str = '') -> InputBackend:
+    """按名称创建输入注入后端（默认使用 Config.INPUT_BACKEND）"""
+    backends = {
+        'batched': BatchedBackend,
+        'keyboard': KeyboardMouseBackend,
+        'recording': RecordingBackend,
+    }
+    return backends.get(name or Config.INPUT_BACKEND, BatchedBackend)()
+
+
+# ========================================
+# 定时调度
+# ========================================
+class CancelToken(threading.Event):
+    """取消令牌 - 一次宏执行的停止信号
+
+    引擎中所有阻塞等待（延迟、按住、按键间隔）都在令牌上等待，
+    cancel() 会立即唤醒它们，停止延迟上限为 Config.TIMING_SLEEP_STEP。
+    多路复用的执行线程不在单个令牌上等待，取消时通过 wake 事件唤醒它
+    （也可以是任何有 set() 方法的对象，例如 LoopWake）。
+    """
+
+    def __init__(self, wake: Optional[Any] = None):
+        super().__init__()
+        self.requested_at = 0.0  # 首次取消请求的时间（perf_counter）
+        self.wake = wake
+
+    def cancel(self) -> None:
+        """请求取消"""
+        if not self.is_set():
+            self.requested_at = time.perf_counter()
+            self.set()
+            if self.wake is not None:
+                self.wake.set()
+
+
+class TimingStats:
+    """单个宏的定时统计 - 每次等待的滞后量（实际唤醒时间 - 截止时间）"""
+
+    __slots__ = ('count', 'total', 'total_sq', 'max_late', 'drift', 'resyncs')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.max_late = 0.0
+        self.drift = 0.0     # 最近一次等待的滞后（绝对截止时间下不会累积）
+        self.resyncs = 0     # 因严重滞后而重新对齐的次数
+
+    def record(self, lateness: float) -> None:
+        """记录一次等待的滞后量"""
+        self.count += 1
+        self.total += lateness
+        self.total_sq += lateness * lateness
+        if lateness > self.max_late:
+            self.max_late = lateness
+        self.drift = lateness
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def jitter(self) -> float:
+        """滞后量的标准差"""
+        if self.count < 2:
+            return 0.0
+        variance = self.total_sq / self.count - self.mean ** 2
+        return variance ** 0.5 if variance > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        """导出为毫秒单位的字典"""
+        return {
+            'waits': self.count,
+            'mean_ms': self.mean * 1000,
+            'jitter_ms': self.jitter * 1000,
+            'max_ms': self.max_late * 1000,
+            'drift_ms': self.drift * 1000,
+            'resyncs': self.resyncs,
+        }
+
+
+class TimingScheduler:
+    """基于绝对截止时间的调度器
+
+    每个动作的执行时间由单调时钟上的绝对截止时间决定，等待的误差不会累积。
+    等待分三个阶段：
+        1. 可中断的事件等待，直到距截止时间 TIMING_SLEEP_MARGIN
+        2. 以 TIMING_SLEEP_STEP 为步长的精细睡眠，直到距截止时间 TIMING_SPIN_THRESHOLD
+        3. 自旋到截止时间（每次循环 sleep(0) 让出 GIL）
+    阶段 1 在取消令牌上等待，会被立即唤醒；阶段 2 每步检查令牌，
+    因此取消后最迟 TIMING_SLEEP_STEP 返回；阶段 3 每次循环检查令牌。
+    """
+
+    def __init__(self, cancel_token: CancelToken,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.cancel_token = cancel_token
+        self.clock = clock
+        self.deadline = clock()
+        self.stats: Optional[TimingStats] = None
+        self.tracer: Optional['LatencyTracer'] = None  # 启用追踪时记录每次到达
+        self.trace_id = 0
+
+    def reset(self, stats: Optional[TimingStats] = None,
+              cancel_token: Optional[CancelToken] = None) -> None:
+        """以当前时间为起点开始新的时间线"""
+        self.deadline = self.clock()
+        self.stats = stats
+        if cancel_token is not None:
+            self.cancel_token = cancel_token
+
+    def advance(self, seconds: float) -> None:
+        """将下一个截止时间推后"""
+        self.deadline += seconds
+
+    def sleep(self, seconds: float) -> bool:
+        """从当前时间起等待指定时长（不属于时间线的单独等待）"""
+        self.deadline = self.clock() + seconds
+        return self.wait()
+
+    def wait(self) -> bool:
+        """等待到当前截止时间
+
+        Returns:
+            True 表示按时到达，False 表示等待被取消
+        """
+        remaining = self.deadline - self.clock()
+        if remaining > 0:
+            remaining = self.wait_until(self.deadline, self.cancel_token, self.clock)
+            if remaining is None:
+                return False
+        if self.cancel_token.is_set():
+            return False
+        self._record(-remaining)
+        return True
+
+    def arrive(self) -> None:
+        """记录到达截止时间（由外部完成等待后调用，例如多路复用的执行线程）"""
+        self._record(self.clock() - self.deadline)
+
+    def _record(self, lateness: float) -> None:
+        """记录滞后量，严重滞后时重新对齐时间线"""
+        tracer = self.tracer
+        if tracer is not None:
+            tracer.record(LatencyTracer.ACTION, self.trace_id, self.deadline + lateness, self.deadline)
+        stats = self.stats
+        if stats is not None:
+            stats.record(lateness)
+        if lateness > Config.TIMING_RESYNC_THRESHOLD:
+            # 严重滞后（例如线程被长时间挂起）：从当前时间重新开始，而不是连续补发
+            self.deadline += lateness
+            if stats is not None:
+                stats.resyncs += 1
+
+    @staticmethod
+    def wait_until(deadline: float, event: threading.Event,
+                   clock: Callable[[], float] = time.perf_counter) -> Optional[float]:
+        """三阶段等待到指定截止时间，事件置位时提前返回
+
+        Returns:
+            到达时的剩余时间（<= 0），被事件打断时返回 None
+        """
+        remaining = deadline - clock()
+        if remaining > Config.TIMING_SLEEP_MARGIN:
+            if event.wait(remaining - Config.TIMING_SLEEP_MARGIN):
+                return None
+            remaining = deadline - clock()
+
+        while remaining > Config.TIMING_SPIN_THRESHOLD:
+            if event.is_set():
+                return None
+            time.sleep(min(Config.TIMING_SLEEP_STEP, remaining - Config.TIMING_SPIN_THRESHOLD))
+            remaining = deadline - clock()
+
+        while remaining > 0:
+            if event.is_set():
+                return None
+            time.sleep(0)  # 让出 GIL，自旋期间热键回调线程仍可运行
+            remaining = deadline - clock()
+
+        return remaining
+
+
+class MacroChannel:
+    """执行通道 - 一条独立的宏时间线
+
+    每个通道有自己的取消令牌、调度器和按住的键，不同通道的宏可以同时运行，
+    互不中断；同一通道内新宏会中断旧宏。
+    """
+
+    def __init__(self, name: str, wake: Optional[threading.Event] = None):
+        self.name = name
+        self.wake = wake                      # 取消时唤醒多路复用的执行线程
+        self.cancel_token = CancelToken(wake)
+        self.scheduler = TimingScheduler(self.cancel_token)
+        self.pressed_keys: List[str] = []     # 本通道按下的键
+        self.pressed_buttons: List[str] = []  # 本通道按下的鼠标按钮
+        self.check_window = False             # 当前宏是否受窗口焦点限制
+        self.release_modifiers = False        # 中断后释放按键时是否同时强制释放修饰键
+        self.macro: Optional['Macro'] = None  # 正在执行的宏
+        self.steps: Optional[Iterator[None]] = None  # 执行线程推进的步进生成器
+
+    @property
+    def running(self) -> bool:
+        return self.macro is not None
+
+
+# ========================================
+# 延迟追踪
+# ========================================
+class LatencyTracer:
+    """延迟追踪 - 预分配的环形缓冲区，记录每个事件的单调时间戳（perf_counter）
+
+    事件种类及其参考时间：
+        HOOK   - 收到触发键事件
+        START  - 宏开始执行（与该宏之前最近一次 HOOK 配对）
+        ACTION - 到达动作的执行时间（参考时间为时间线上的计划时间）
+        STOP   - 被中断的宏结束（参考时间为停止请求时间）
+    每个槽位保存一个 (时间, 种类, 宏编号, 参考时间) 元组，写入只做一次取序号和一次列表赋值；
+    缓冲区写满后覆盖最早的事件。
+    未启用追踪时引擎中的 tracer 为 None，记录点只多一次判断。
+    """
+
+    HOOK = 1
+    START = 2
+    ACTION = 3
+    STOP = 4
+
+    # 动作误差直方图的上界（毫秒），最后一档为超过最大上界
+    HISTOGRAM_BOUNDS_MS = (0.1, 0.5, 1, 2, 5, 10, 20)
+
+    def __init__(self, capacity: int = 0, clock: Callable[[], float] = time.perf_counter):
+        self.capacity = capacity or Config.TRACE_CAPACITY
+        self.clock = clock
+        self.slots: List[Optional[Tuple[float, int, int, float]]] = [None] * self.capacity
+        self.names: List[str] = []          # 宏编号 -> 宏名称
+        self.ids: Dict[str, int] = {}       # 宏名称 -> 宏编号
+        self.lock = threading.Lock()        # 只用于登记新的宏名称
+        self._seq = itertools.count()       # next() 在 GIL 下是原子的，多个线程可以同时写入
+
+    def macro_id(self, name: str) -> int:
+        """宏名称对应的编号"""
+        macro_id = self.ids.get(name)
+        if macro_id is None:
+            with self.lock:
+                macro_id = self.ids.get(name)
+                if macro_id is None:
+                    macro_id = self.ids[name] = len(self.names)
+                    self.names.append(name)
+        return macro_id
+
+    def record(self, kind: int, macro_id: int, t: float, ref: float = 0.0) -> None:
+        """写入一个事件"""
+        self.slots[next(self._seq) % self.capacity] = (t, kind, macro_id, ref)
+
+    def clear(self) -> None:
+        """清空缓冲区"""
+        self.slots = [None] * self.capacity
+
+    def events(self) -> List[Tuple[float, int, int, float]]:
+        """按时间排序的事件 (时间, 种类, 宏编号, 参考时间)"""
+        return sorted(slot for slot in self.slots if slot is not None)
+
+    @staticmethod
+    def percentiles(values: List[float]) -> Dict[str, float]:
+        """样本数和 p50 / p95 / p99 / 最大值"""
+        values = sorted(values)
+        count = len(values)
+        if not count:
+            return {'count': 0}
+        return {
+            'count': count,
+            'p50': values[int(0.50 * (count - 1))],
+            'p95': values[int(0.95 * (count - 1))],
+            'p99': values[int(0.99 * (count - 1))],
+            'max': values[-1],
+        }
+
+    @classmethod
+    def histogram(cls, values: List[float]) -> Dict[str, int]:
+        """按 HISTOGRAM_BOUNDS_MS 分档计数"""
+        bounds = cls.HISTOGRAM_BOUNDS_MS
+        labels = [f'<{bound}ms' for bound in bounds] + [f'>={bounds[-1]}ms']
+        counts = [0] * len(labels)
+        for value in values:
+            counts[bisect.bisect_right(bounds, value)] += 1
+        return dict(zip(labels, counts))
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """每个宏的延迟统计（毫秒）：触发→开始、动作误差（含直方图）、停止延迟"""
+        samples: Dict[int, Tuple[List[float], List[float], List[float]]] = {}
+        last_hook: Dict[int, float] = {}
+        for t, kind, macro_id, ref in self.events():
+            hook_to_start, action_error, stop = samples.setdefault(macro_id, ([], [], []))
+            if kind == self.HOOK:
+                last_hook[macro_id] = t
+            elif kind == self.START:
+                hook = last_hook.pop(macro_id, None)
+                if hook is not None:
+                    hook_to_start.append((t - hook) * 1000)
+            elif kind == self.ACTION:
+                action_error.append((t - ref) * 1000)
+            elif kind == self.STOP and ref:
+                stop.append((t - ref) * 1000)
+
+        report = {}
+        for macro_id, (hook_to_start, action_error, stop) in samples.items():
+            errors = self.percentiles(action_error)
+            errors['histogram'] = self.histogram(action_error)
+            report[self.names[macro_id]] = {
+                'hook_to_start_ms': self.percentiles(hook_to_start),
+                'action_error_ms': errors,
+                'stop_ms': self.percentiles(stop),
+            }
+        return report
+
+    def export(self, path: str) -> None:
+        """导出报告：扩展名为 .csv 时每行一个指标，否则为 JSON"""
+        report = self.report()
+        if path.lower().endswith('.csv'):
+            labels = list(self.histogram([]))
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['macro', 'metric', 'count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'] + labels)
+                for name, metrics in report.items():
+                    for metric, stats in metrics.items():
+                        histogram = stats.get('histogram', {})
+                        writer.writerow([name, metric, stats['count']] +
+                                        [stats.get(key, '') for key in ('p50', 'p95', 'p99', 'max')] +
+                                        [histogram.get(label, '') for label in labels])
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'macros': report}, f, ensure_ascii=False, indent=2)
+
+
+# ========================================
+# 宏字节码编译
+# ========================================
+class OpCode:
+    """字节码操作码"""
+    PRESS = 1
+    HOLD = 2
+    DELAY = 3
+    CLICK = 4
+    DOUBLECLICK = 5
+    KEYDOWN = 6
+    KEYUP = 7
+
+    # 融合超级指令（动作 + 紧随其后的延迟）
+    PRESS_DELAY = 8
+    CLICK_DELAY = 9
+
+    # 同时发生的一组按键（例如 "按下 q,w,e"），一次提交给输入后端
+    PRESS_GROUP = 10
+
+    # 鼠标按钮按下 / 松开（XML 导入的 LeftDown / LeftUp 等）
+    MOUSEDOWN = 11
+    MOUSEUP = 12
+
+    # 动作类型 -> 操作码
+    FROM_ACTION = {
+        'press': PRESS, 'hold': HOLD, 'delay': DELAY,
+        'click': CLICK, 'doubleclick': DOUBLECLICK,
+        'keydown': KEYDOWN, 'keyup': KEYUP,
+        'mousedown': MOUSEDOWN, 'mouseup': MOUSEUP,
+    }
+
+    # 操作码 -> 动作类型名称
+    TO_ACTION = {op: name for name, op in FROM_ACTION.items()}
+
+    # 需要按键名 / 鼠标按钮 / 时长的基本操作码
+    KEY_OPS = frozenset((PRESS, HOLD, KEYDOWN, KEYUP))
+    BUTTON_OPS = frozenset((CLICK, DOUBLECLICK, MOUSEDOWN, MOUSEUP))
+    TIMED_OPS = frozenset((HOLD, DELAY))
+
+    # 可与后续延迟融合的操作码 -> 超级指令
+    FUSE_WITH_DELAY = {PRESS: PRESS_DELAY, CLICK: CLICK_DELAY}
+
+    # 操作码名称（用于反汇编输出）
+    NAMES = {
+        PRESS: 'PRESS', HOLD: 'HOLD', DELAY: 'DELAY',
+        CLICK: 'CLICK', DOUBLECLICK: 'DOUBLECLICK',
+        KEYDOWN: 'KEYDOWN', KEYUP: 'KEYUP',
+        PRESS_DELAY: 'PRESS_DELAY', CLICK_DELAY: 'CLICK_DELAY',
+        PRESS_GROUP: 'PRESS_GROUP',
+        MOUSEDOWN: 'MOUSEDOWN', MOUSEUP: 'MOUSEUP',
+    }
+
+
+class MacroProgram:
+    """编译后的宏程序 - 扁平的操作码数组 + 操作数表
+
+    第 pc 条指令由三个并行数组描述：
+        ops[pc]       操作码
+        args[pc]      names 表中的索引（按键名或鼠标按钮）；PRESS_GROUP 为 groups 表中的索引
+        durations[pc] 时长（秒），无时长的指令为 0
+    """
+
+    __slots__ = ('ops', 'args', 'durations', 'names', 'groups', 'action_count', 'repeat')
+
+    def __init__(self):
+        self.ops = array('B')
+        self.args = array('H')
+        self.durations = array('d')
+        self.names: List[str] = []
+        self.groups: List[Tuple[str, ...]] = []
+        self.action_count = 0  # 编译前的动作数（超级指令计为多个动作）
+        self.repeat = 1        # 每次执行把整个程序重复几遍（"重复 = N"）
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def disassemble(self) -> List[str]:
+        """反汇编为可读文本（调试用）"""
+        lines = []
+        for pc, op in enumerate(self.ops):
+            if op == OpCode.PRESS_GROUP:
+                name = ','.join(self.groups[self.args[pc]])
+            else:
+                name = self.names[self.args[pc]] if self.names else ''
+            duration = self.durations[pc]
+            detail = '' if op == OpCode.DELAY else f" {name}"
+            if duration:
+                detail += f" {duration * 1000:g}ms"
+            lines.append(f"{pc:4d}  {OpCode.NAMES.get(op, op)}{detail}")
+        return lines
+
+
+# ========================================
+# 宏模型
+# ========================================
+class Action:
+    """宏动作（不可变）- op 为 OpCode 中的基本操作码
+
+    key 用于键盘动作，button 用于鼠标动作，duration 用于按住和延迟；
+    group 标记同一行 "按下 q,w,e" 展开的一组同时发生的按键。
+    """
+
+    __slots__ = ('op', 'key', 'button', 'duration', 'group')
+
+    def __init__(self, op: int, key: Optional[str] = None, button: Optional[str] = None,
+                 duration: float = 0.0, group: Optional[int] = None):
+        if op not in OpCode.TO_ACTION:
+            raise ValueError(f'unknown action op: {op!r}')
+        if op in OpCode.KEY_OPS and not key:
+            raise ValueError(f'{OpCode.TO_ACTION[op]} requires a key')
+        if op in OpCode.BUTTON_OPS and not button:
+            button = 'left'
+        if duration < 0:
+            raise ValueError(f'negative duration: {duration!r}')
+        setattr_ = object.__setattr__
+        setattr_(self, 'op', op)
+        setattr_(self, 'key', key)
+        setattr_(self, 'button', button)
+        setattr_(self, 'duration', float(duration))
+        setattr_(self, 'group', group)
+
+    @classmethod
+    def from_dict(cls, action: Dict[str, Any]) -> 'Action':
+        """由解析器产生的动作字典构建"""
+        op = OpCode.FROM_ACTION.get(action.get('type'))
+        if op is None:
+            raise ValueError(f"unknown action type: {action.get('type')!r}")
+        return cls(op, action.get('key'), action.get('button'), action.get('duration', 0.0),
+                   action.get('group'))
+
+    @property
+    def type(self) -> str:
+        """动作类型名称（press / delay / ...）"""
+        return OpCode.TO_ACTION[self.op]
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Action):
+            return NotImplemented
+        return (self.op, self.key, self.button, self.duration, self.group) == \
+               (other.op, other.key, other.button, other.duration, other.group)
+
+    def __hash__(self) -> int:
+        return hash((self.op, self.key, self.button, self.duration, self.group))
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return Action, (self.op, self.key, self.button, self.duration, self.group)
+
+    def __repr__(self) -> str:
+        detail = self.key or self.button or ''
+        if self.op in OpCode.TIMED_OPS:
+            detail += f' {self.duration * 1000:g}ms'
+        return f'<Action {self.type} {detail.strip()}>'
+
+
+class Macro:
+    """宏（不可变）- 加载时构建一次，解析器、引擎和运行器都使用这个模型
+
+    start_actions / actions / finish_actions 为优化后的动作，
+    start_program / program / finish_program 为对应的编译结果，
+    optimization / timing 为加载时计算的优化效果和定时概况，
+    content_key 为构建时由内容计算一次的哈希（增量重载时比较）。
+    """
+
+    REPEAT_MODES = ('once', 'loop', 'hold')
+    BUFFER_POLICIES = ('auto', 'preempt', 'queue', 'ignore')
+
+    __slots__ = ('name', 'description', 'trigger_key', 'repeat_mode', 'repeat_count', 'reset_keys',
+                 'additional_keys', 'default_delay', 'skip_window_check', 'channel', 'exclusive',
+                 'priority', 'buffer_policy', 'buffer_expiry', 'rapid_threshold',
+                 'start_actions', 'actions', 'finish_actions',
+                 'start_program', 'program', 'finish_program', 'optimization', 'timing', 'content_key')
+
+    # 决定宏内容的字段，其余为编译产物
+    CONTENT_FIELDS = __slots__[:18]
+    # 构造参数（content_key 由内容计算，不单独保存）
+    FIELDS = __slots__[:-1]
+
+    def __init__(self, name: str, description: str = '', trigger_key: Optional[str] = None,
+                 repeat_mode: str = 'once', repeat_count: int = 1, reset_keys: bool = False,
+                 additional_keys: Sequence[str] = (), default_delay: float = 0.0,
+                 skip_window_check: bool = False, channel: Optional[str] = None, exclusive: bool = False,
+                 priority: int = 0, buffer_policy: str = 'auto', buffer_expiry: Optional[float] = None,
+                 rapid_threshold: Optional[float] = None,
+                 start_actions: Sequence[Action] = (), actions: Sequence[Action] = (),
+                 finish_actions: Sequence[Action] = (),
+                 start_program: Optional[MacroProgram] = None, program: Optional[MacroProgram] = None,
+                 finish_program: Optional[MacroProgram] = None,
+                 optimization: Optional[Dict[str, Any]] = None, timing: Optional[Dict[str, Any]] = None):
+        if repeat_mode not in self.REPEAT_MODES:
+            raise ValueError(f'unknown repeat mode: {repeat_mode!r}')
+        if buffer_policy not in self.BUFFER_POLICIES:
+            raise ValueError(f'unknown buffer policy: {buffer_policy!r}')
+        if repeat_count < 1:
+            raise ValueError(f'repeat count must be at least 1: {repeat_count!r}')
+        values = (name, description, trigger_key, repeat_mode, int(repeat_count), bool(reset_keys),
+                  tuple(additional_keys), float(default_delay or 0.0), bool(skip_window_check),
+                  channel or None, bool(exclusive), int(priority), buffer_policy, buffer_expiry,
+                  rapid_threshold, tuple(start_actions), tuple(actions), tuple(finish_actions),
+                  start_program, program, finish_program, optimization, timing)
+        setattr_ = object.__setattr__
+        for field, value in zip(self.FIELDS, values):
+            setattr_(self, field, value)
+        setattr_(self, 'content_key', hash(values[:len(self.CONTENT_FIELDS)]))
+
+    @property
+    def content(self) -> Tuple[Any, ...]:
+        """宏的可比较内容（不含编译产物）"""
+        return tuple(getattr(self, field) for field in self.CONTENT_FIELDS)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return Macro, tuple(getattr(self, field) for field in self.FIELDS)
+
+    def __repr__(self) -> str:
+        return f'<Macro {self.name!r} trigger={self.trigger_key!r} mode={self.repeat_mode}>'
+
+
+# ========================================
+# 宏优化与编译
+# ========================================
+class MacroOptimizer:
+    """宏优化器 - 解析之后、编译之前对动作列表做的等价变换
+
+    - 在动作之间插入默认延迟（同一行同时按下的一组按键之间不插入）
+    - 合并相邻的延迟，去掉时长为 0 的延迟
+    "重复 = N" 不复制动作列表，由编译结果的重复计数执行（MacroProgram.repeat）。
+    """
+
+    ACTION_KEYS = ('start_actions', 'actions', 'finish_actions')
+
+    def optimize_actions(self, actions: Sequence[Action],
+                         default_delay: float = 0.0) -> Tuple[Action, ...]:
+        """一遍扫描生成优化后的动作序列"""
+        DELAY = OpCode.DELAY
+        result: List[Action] = []
+        last = len(actions) - 1
+        for i, action in enumerate(actions):
+            if action.op == DELAY:
+                duration = action.duration
+                if duration <= 0:
+                    continue
+                if result and result[-1].op == DELAY:
+                    result[-1] = Action(DELAY, duration=result[-1].duration + duration)
+                else:
+                    result.append(action)
+                continue
+
+            result.append(action)
+            # 非延迟动作之后、下一个动作之前插入默认延迟（下一个已经是延迟时不插入）
+            if default_delay > 0 and i < last:
+                next_action = actions[i + 1]
+                group = action.group
+                if next_action.op != DELAY and (group is None or next_action.group != group):
+                    result.append(Action(DELAY, duration=default_delay))
+        return tuple(result)
+
+    @staticmethod
+    def cycle_time(actions: Sequence[Action]) -> float:
+        """动作序列执行一遍推进的时间线长度（秒），与 program_steps 的计时一致"""
+        total = 0.0
+        group = None
+        for action in actions:
+            op = action.op
+            if op in OpCode.TIMED_OPS:
+                total += action.duration
+            if op == OpCode.PRESS:
+                # 同一组按键一次提交，只有一个按键间隔
+                current = action.group
+                if current is None or current != group:
+                    total += Config.KEY_PRESS_INTERVAL
+                group = current
+            else:
+                group = None
+        return total
+
+    @staticmethod
+    def with_default_delays(actions: Sequence[Action], default_delay: float) -> List[Action]:
+        """未优化时的动作序列：每个非延迟动作之后（下一个不是延迟时）都插入默认延迟，不合并延迟"""
+        DELAY = OpCode.DELAY
+        result: List[Action] = []
+        last = len(actions) - 1
+        for i, action in enumerate(actions):
+            result.append(action)
+            if default_delay > 0 and action.op != DELAY and i < last and actions[i + 1].op != DELAY:
+                result.append(Action(DELAY, duration=default_delay))
+        return result
+
+    def optimize_macro(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """优化宏字段中的所有动作区域，并在 fields['optimization'] 中记录主动作区域的优化效果
+
+        优化前按未优化的方式计算（重复 N 次相当于 N 份动作列表，同一组按键之间也插入默认延迟），
+        优化后为实际执行的动作序列（只保存一份）；周期为每次触发执行一遍的时间线长度。
+        """
+        default_delay = fields.get('default_delay') or 0.0
+        repeat = max(1, fields.get('repeat_count', 1))
+        raw = self.with_default_delays(fields.get('actions', ()), default_delay)
+        for action_key in self.ACTION_KEYS:
+            actions = fields.get(action_key)
+            if actions:
+                fields[action_key] = self.optimize_actions(actions, default_delay)
+        optimized = fields.get('actions', ())
+        fields['optimization'] = {
+            'repeat': repeat,
+            'actions_before': len(raw) * repeat,
+            'actions_after': len(optimized),
+            'cycle_before_ms': self.cycle_time(raw) * repeat * 1000,
+            'cycle_after_ms': self.cycle_time(optimized) * repeat * 1000,
+        }
+        return fields
+
+
+class MacroCompiler:
+    """宏编译器 - 将解析后的动作列表编译为 MacroProgram"""
+
+    # 宏字典中动作区域 -> 编译结果存放的键
+    PROGRAM_KEYS = {
+        'start_actions': 'start_program',
+        'actions': 'program',
+        'finish_actions': 'finish_program',
+    }
+
+    def compile_actions(self, actions: Sequence[Action]) -> MacroProgram:
+        """编译一个动作序列"""
+        program = MacroProgram()
+        name_index: Dict[str, int] = {}
+        count = len(actions)
+        i = 0
+
+        while i < count:
+            action = actions[i]
+            op = action.op
+
+            # 同一行 "按下 q,w,e" 展开的连续按键是同时发生的，合并为一条指令
+            group = action.group
+            if op == OpCode.PRESS and group is not None:
+                end = i + 1
+                while end < count and actions[end].op == OpCode.PRESS and actions[end].group == group:
+                    end += 1
+                if end - i > 1:
+                    program.ops.append(OpCode.PRESS_GROUP)
+                    program.args.append(len(program.groups))
+                    program.durations.append(0.0)
+                    program.groups.append(tuple(a.key for a in actions[i:end]))
+                    program.action_count += end - i
+                    i = end
+                    continue
+
+            name = action.key or action.button or ''
+            duration = action.duration
+            consumed = 1
+
+            # 融合：按键/单击后紧跟延迟时合并为一条超级指令
+            fused = OpCode.FUSE_WITH_DELAY.get(op)
+            if fused and i + 1 < count and actions[i + 1].op == OpCode.DELAY:
+                op = fused
+                duration = actions[i + 1].duration
+                consumed = 2
+
+            if name not in name_index:
+                name_index[name] = len(program.names)
+                program.names.append(name)
+
+            program.ops.append(op)
+            program.args.append(name_index[name])
+            program.durations.append(duration)
+            program.action_count += consumed
+            i += consumed
+
+        return program
+
+    def compile_macro(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """编译宏字段中的所有动作区域，结果写回字段（"重复 = N" 作用于主动作区域）"""
+        for action_key, program_key in self.PROGRAM_KEYS.items():
+            fields[program_key] = self.compile_actions(fields.get(action_key, ()))
+        fields['program'].repeat = max(1, fields.get('repeat_count', 1))
+        return fields
+
+    def link_keys(self, macro: Macro) -> List[str]:
+        """把宏用到的按键（动作与附加按键）解析为扫描码并存入共享缓存，报告无法识别的按键
+
+        Returns:
+            无法识别的按键名
+        """
+        names = [action.key for actions in (macro.start_actions, macro.actions, macro.finish_actions)
+                 for action in actions if action.key]
+        names.extend(macro.additional_keys)
+        unknown: List[str] = []
+        for name in names:
+            if not key_resolver.resolve(name) and name not in unknown:
+                unknown.append(name)
+        for name in unknown:
+            log.warning(_msg('warn_unknown_key', macro.name, name))
+        return unknown
+
+
+class MacroAnalyzer:
+    """静态定时分析 - 加载时由优化后的动作计算宏的定时概况（不执行宏）
+
+    时间线与 program_steps 一致（按键间隔、默认延迟、按住时长都计入），得到：
+        cycle_ms            每次触发执行一遍的时长（含 "重复 = N"）
+        events              一遍注入的输入事件数（按下和松开各算一个）
+        events_per_sec      按周期平均的每秒注入事件数，即循环/按住时模式下的持续速率（周期为 0 时为 None）
+        unbounded           循环/按住时模式下周期为 0：执行线程不等待地连续注入，速率没有上限
+        longest_wait_ms     两次注入之间最长的等待（循环时包括首尾相接处）
+        longest_step_events 最长的不可打断动作：一步内一次提交的输入事件数
+        stop_latency_ms     停止请求到宏停止的最坏延迟。等待和按住时长都会被停止请求唤醒，
+                            不可打断的只有一步内的注入，因此为 STOP_LATENCY_BOUND，与动作时长无关
+    """
+
+    # 每个动作注入的输入事件数
+    EVENTS = {
+        OpCode.PRESS: 2, OpCode.HOLD: 2, OpCode.CLICK: 2, OpCode.DOUBLECLICK: 4,
+        OpCode.KEYDOWN: 1, OpCode.KEYUP: 1, OpCode.MOUSEDOWN: 1, OpCode.MOUSEUP: 1,
+    }
+
+    def profile(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """计算宏字段中主动作区域的定时概况"""
+        interval = Config.KEY_PRESS_INTERVAL
+        repeat = max(1, fields.get('repeat_count', 1))
+        t = 0.0
+        first = last = None  # 第一次 / 最近一次注入的时间
+        longest = 0.0
+        events = 0
+        step = most = 0  # 当前一步 / 最长一步注入的事件数
+        group = None
+        for action in fields.get('actions', ()):
+            op = action.op
+            if op == OpCode.DELAY:
+                t += action.duration
+                group = None
+                continue
+            count = self.EVENTS[op]
+            events += count
+            if op == OpCode.PRESS and action.group is not None and action.group == group:
+                step += count  # 同一组按键一次提交
+                most = max(most, step)
+                continue
+            group = action.group if op == OpCode.PRESS else None
+            step = 1 if op == OpCode.HOLD else count  # 按住在两步中分别按下和松开
+            most = max(most, step)
+            if last is not None:
+                longest = max(longest, t - last)
+            if first is None:
+                first = t
+            last = t
+            if op == OpCode.PRESS:
+                t += interval
+            elif op == OpCode.HOLD:
+                longest = max(longest, action.duration)
+                t += action.duration
+                last = t
+
+        looping = fields.get('repeat_mode', 'once') != 'once' or repeat > 1
+        if looping and last is not None:
+            longest = max(longest, t - last + first)
+        return {
+            'cycle_ms': t * repeat * 1000,
+            'events': events * repeat,
+            'events_per_sec': events / t if t > 0 else None,
+            'unbounded': t == 0 and events > 0 and fields.get('repeat_mode', 'once') != 'once',
+            'longest_wait_ms': longest * 1000,
+            'longest_step_events': most,
+            'stop_latency_ms': Config.STOP_LATENCY_BOUND * 1000,
+        }
+
+    @staticmethod
+    def over_budget(macros: Sequence[Macro]) -> List[Macro]:
+        """循环/按住时模式下每秒注入的输入事件数超过 Config.INPUT_RATE_BUDGET（或没有上限）的宏
+
+        单次执行的宏只注入一遍，没有持续速率，不参与检查。
+        """
+        return [macro for macro in macros if macro.repeat_mode != 'once' and
+                (macro.timing['unbounded'] or (macro.timing['events_per_sec'] or 0) > Config.INPUT_RATE_BUDGET)]
+
+    @staticmethod
+    def print_optimization_report(macros: Sequence[Macro]) -> None:
+        """打印每个宏优化前后的动作数和周期"""
+        print(f"{Style.BRIGHT}{_msg('optimize_title')}{Style.RESET_ALL}")
+        for macro in macros:
+            stats = macro.optimization
+            if not stats:
+                continue
+            repeat = _msg('optimize_repeat', stats['repeat']) if stats['repeat'] > 1 else ''
+            print(_msg('optimize_row', macro.name, stats['actions_before'], stats['actions_after'],
+                       stats['cycle_before_ms'], stats['cycle_after_ms'], repeat))
+
+    @classmethod
+    def print_timing_report(cls, macros: Sequence[Macro]) -> List[Macro]:
+        """打印每个宏的定时概况，标出超出输入速率预算的宏
+
+        Returns:
+            超出预算的宏
+        """
+        over = cls.over_budget(macros)
+        print(f"{Style.BRIGHT}{_msg('timing_title', Config.INPUT_RATE_BUDGET)}{Style.RESET_ALL}")
+        for macro in macros:
+            timing = macro.timing
+            print(_msg('timing_row', macro.name, macro.repeat_mode, timing['cycle_ms'], timing['events'],
+                       cls.rate_text(timing), timing['longest_wait_ms'],
+                       timing['stop_latency_ms'], timing['longest_step_events'],
+                       _msg('timing_over') if macro in over else ''))
+        if over:
+            print(f"{Fore.YELLOW}{_msg('timing_over_count', len(over))}{Style.RESET_ALL}")
+        else:
+            print(f"{Fore.GREEN}{_msg('timing_ok', len(macros))}{Style.RESET_ALL}")
+        return over
+
+    @staticmethod
+    def rate_text(timing: Dict[str, Any]) -> str:
+        """每秒事件数的显示文本"""
+        if timing['unbounded']:
+            return _msg('timing_unbounded')
+        rate = timing['events_per_sec']
+        return '-' if rate is None else f'{rate:.0f}'
 
 
 class MacroEngine:
     """宏引擎 - 负责解析和执行宏指令"""
 
     # 键盘扫描码映射表
+    # 键盘扫描码（Set 1）-> 按键名；扩展键（E0 前缀）记为 0x100 | 扫描码
     SCAN_CODE_MAP = {
-        30: 'a', 31: 's', 32: 'd', 33: 'f',
-        17: 'w', 44: 'z', 45: 'x', 46: 'c',
+        0x01: 'esc',
+        0x02: '1', 0x03: '2', 0x04: '3', 0x05: '4', 0x06: '5',
+        0x07: '6', 0x08: '7', 0x09: '8', 0x0A: '9', 0x0B: '0',
+        0x0C: '-', 0x0D: '=', 0x0E: 'backspace', 0x0F: 'tab',
+        0x10: 'q', 0x11: 'w', 0x12: 'e', 0x13: 'r', 0x14: 't',
+        0x15: 'y', 0x16: 'u', 0x17: 'i', 0x18: 'o', 0x19: 'p',
+        0x1A: '[', 0x1B: ']', 0x1C: 'enter', 0x1D: 'ctrl',
+        0x1E: 'a', 0x1F: 's', 0x20: 'd', 0x21: 'f', 0x22: 'g',
+        0x23: 'h', 0x24: 'j', 0x25: 'k', 0x26: 'l',
+        0x27: ';', 0x28: "'", 0x29: '`', 0x2A: 'shift', 0x2B: '\\',
+        0x2C: 'z', 0x2D: 'x', 0x2E: 'c', 0x2F: 'v', 0x30: 'b',
+        0x31: 'n', 0x32: 'm', 0x33: ',', 0x34: '.', 0x35: '/',
+        0x36: 'right shift', 0x37: 'keypad *', 0x38: 'alt', 0x39: 'space', 0x3A: 'caps lock',
+        0x3B: 'f1', 0x3C: 'f2', 0x3D: 'f3', 0x3E: 'f4', 0x3F: 'f5',
+        0x40: 'f6', 0x41: 'f7', 0x42: 'f8', 0x43: 'f9', 0x44: 'f10',
+        0x45: 'num lock', 0x46: 'scroll lock',
+        0x47: 'keypad 7', 0x48: 'keypad 8', 0x49: 'keypad 9', 0x4A: 'keypad -',
+        0x4B: 'keypad 4', 0x4C: 'keypad 5', 0x4D: 'keypad 6', 0x4E: 'keypad +',
+        0x4F: 'keypad 1', 0x50: 'keypad 2', 0x51: 'keypad 3',
+        0x52: 'keypad 0', 0x53: 'keypad .',
+        0x57: 'f11', 0x58: 'f12',
+        # 扩展键
+        0x11C: 'keypad enter', 0x11D: 'right ctrl', 0x135: 'keypad /',
+        0x137: 'print screen', 0x138: 'right alt',
+        0x147: 'home', 0x148: 'up', 0x149: 'page up',
+        0x14B: 'left', 0x14D: 'right',
+        0x14F: 'end', 0x150: 'down', 0x151: 'page down',
+        0x152: 'insert', 0x153: 'delete',
+        0x15B: 'left windows', 0x15C: 'right windows', 0x15D: 'menu',
     }
 
-    def __init__(self, window_monitor: Optional[WindowMonitor] = None):
-        self.running = False
-        self.stop_flag = False
+    def __init__(self, window_monitor: Optional[WindowMonitor] = None,
+                 backend: Optional[InputBackend] = None):
         self.window_monitor = window_monitor
-        self.pressed_keys: List[str] = []  # 追踪按下的键
-
-        # 动作处理器映射
-        self._action_handlers: Dict[str, Callable] = {
-            'press': self._handle_press,
-            'hold': self._handle_hold,
-
-            'delay': self._handle_delay,
-            'click': self._handle_click,
-            'doubleclick': self._handle_doubleclick,
-            'keydown': self._handle_keydown,
-            'keyup': self._handle_keyup,
-        }
+        self.backend = backend if backend is not None else create_input_backend()
+        self.optimizer = MacroOptimizer()
+        self.compiler = MacroCompiler()
+        self.analyzer = MacroAnalyzer()
+
+        # 执行通道（每个通道一条时间线，停止时通过取消令牌立即唤醒等待，每次执行使用独立的令牌）
+        self.wake = threading.Event()  # 任一通道被取消时置位，唤醒多路复用的执行线程
+        self.channels: Dict[str, MacroChannel] = {}
+        self.channel = self.get_channel(Config.DEFAULT_CHANNEL)  # 同步执行接口使用的通道
+        self.timing_stats: Dict[str, TimingStats] = {}  # 宏名称 -> 定时统计
+        self.tracer: Optional[LatencyTracer] = LatencyTracer() if Config.TRACE_ENABLED else None
+
+    @property
+    def running(self) -> bool:
+        """是否有任一通道正在执行宏"""
+        return any(channel.running for channel in list(self.channels.values()))
+
+    @property
+    def stop_flag(self) -> bool:
+        """默认通道的当前执行是否已被要求停止"""
+        return self.channel.cancel_token.is_set()
+
+    @property
+    def cancel_token(self) -> CancelToken:
+        return self.channel.cancel_token
+
+    @property
+    def scheduler(self) -> TimingScheduler:
+        return self.channel.scheduler
+
+    @property
+    def pressed_keys(self) -> List[str]:
+        return self.channel.pressed_keys
+
+    @property
+    def pressed_buttons(self) -> List[str]:
+        return self.channel.pressed_buttons
+
+    def get_channel(self, name: str) -> MacroChannel:
+        """获取执行通道（不存在时创建）"""
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels.setdefault(name, MacroChannel(name, self.wake))
+        return channel
+
+    @staticmethod
+    def channel_name(macro: Macro) -> str:
+        """宏所属的执行通道名称"""
+        return macro.channel or Config.DEFAULT_CHANNEL
+
+    def build_macro(self, fields: Dict[str, Any]) -> Macro:
+        """由解析器收集的宏字段构建宏模型：转换动作、优化、定时分析、编译（字段无效时抛出 ValueError）"""
+        for action_key in MacroOptimizer.ACTION_KEYS:
+            fields[action_key] = tuple(action if isinstance(action, Action) else Action.from_dict(action)
+                                       for action in fields.get(action_key, ()))
+        self.optimizer.optimize_macro(fields)
+        fields['timing'] = self.analyzer.profile(fields)
+        self.compiler.compile_macro(fields)
+        macro = Macro(**fields)
+        self.compiler.link_keys(macro)
+        return macro
 
     def parse_delay(self, delay_str: str) -> float:
         """解析延迟时间，支持多种格式：100ms, 0.1s, 1秒"""
@@ -397,199 +1731,646 @@ class MacroEngine:
         return str(key_str).strip().lower()
 
     def parse_key_code(self, key_code: int) -> Optional[str]:
-        """解析键盘扫描码（用于 XML 格式）"""
-        return self.SCAN_CODE_MAP.get(int(key_code))
-
-    def _handle_press(self, action: Dict[str, Any], repeat_count: int = 1) -> None:
-        """处理按键动作"""
-        key = action['key']
-        for _ in range(repeat_count):
-            if self.stop_flag:
-                break
-            try:
-                keyboard.press_and_release(key)
-                time.sleep(Config.KEY_PRESS_INTERVAL)
-            except Exception:
-                pass
+        """解析键盘扫描码（用于 XML 格式），扩展键可写为 0xE0xx 或 0x1xx"""
+        code = int(key_code)
+        if code >= 0xE000:
+            code = 0x100 | (code & 0xFF)
+        return self.SCAN_CODE_MAP.get(code)
+
+    def _key_down(self, key: str, channel: Optional[MacroChannel] = None) -> None:
+        """按下按键并追踪"""
+        self.backend.press(key)
+        # 追踪按下的键
+        pressed_keys = (channel or self.channel).pressed_keys
+        if key not in pressed_keys:
+            pressed_keys.append(key)
+
+    def _key_up(self, key: str, channel: Optional[MacroChannel] = None) -> None:
+        """释放按键并取消追踪"""
+        self.backend.release(key)
+        # 从追踪列表中移除
+        pressed_keys = (channel or self.channel).pressed_keys
+        if key in pressed_keys:
+            pressed_keys.remove(key)
+
+    def _button_down(self, button: str, channel: Optional[MacroChannel] = None) -> None:
+        """按下鼠标按钮并追踪"""
+        self.backend.mouse_down(button)
+        pressed_buttons = (channel or self.channel).pressed_buttons
+        if button not in pressed_buttons:
+            pressed_buttons.append(button)
+
+    def _button_up(self, button: str, channel: Optional[MacroChannel] = None) -> None:
+        """松开鼠标按钮并取消追踪"""
+        self.backend.mouse_up(button)
+        pressed_buttons = (channel or self.channel).pressed_buttons
+        if button in pressed_buttons:
+            pressed_buttons.remove(button)
+
+    def reset_keys(self, force_release_modifiers: bool = False,
+                   channel: Optional[MacroChannel] = None) -> None:
+        """重置按住的键
 
-    def _handle_hold(self, action: Dict[str, Any], _: int = 1) -> None:
-        """处理按住动作"""
-        key = action['key']
-        duration = action['duration']
-        try:
-            keyboard.press(key)
-            time.sleep(duration)
-            keyboard.release(key)
-        except Exception:
-            pass
+        Args:
+            force_release_modifiers: 是否强制释放所有修饰键（用于紧急情况）
+            channel: 只重置该通道追踪的键，None 表示所有通道
+        """
+        channels = [channel] if channel is not None else list(self.channels.values())
 
-    def _handle_delay(self, action: Dict[str, Any], _: int = 1) -> None:
-        """处理延迟动作（可中断）"""
-        duration = action['duration']
-        # 将长延迟拆分成多个短延迟，以便可以中断
-        elapsed = 0.0
-
-        while elapsed < duration and not self.stop_flag:
-            remaining = duration - elapsed
-            sleep_time = min(Config.DELAY_CHECK_INTERVAL, remaining)
-            time.sleep(sleep_time)
-            elapsed += sleep_time
-
-    def _handle_click(self, action: Dict[str, Any], _: int = 1) -> None:
-        """处理鼠标点击动作"""
-        button = action.get('button', 'left')
-        mouse.click(button)
+        # 释放追踪的按键（使用副本，作为一批同时松开）
+        keys: List[str] = []
+        buttons: List[str] = []
+        for ch in channels:
+            keys.extend(k for k in ch.pressed_keys if k not in keys)
+            ch.pressed_keys.clear()
+            buttons.extend(b for b in ch.pressed_buttons if b not in buttons)
+            ch.pressed_buttons.clear()
 
-    def _handle_doubleclick(self, action: Dict[str, Any], _: int = 1) -> None:
-        """处理鼠标双击动作"""
-        button = action.get('button', 'left')
-        mouse.double_click(button)
+        # 强制释放修饰键（防止输入法干扰导致按键卡住）
+        if force_release_modifiers:
+            keys.extend(k for k in Config.FORCE_RELEASE_MODIFIER_KEYS if k not in keys)
 
-    def _handle_keydown(self, action: Dict[str, Any], _: int = 1) -> None:
-        """处理按下键（不释放）"""
-        key = action['key']
-        try:
-            keyboard.press(key)
-            # 追踪按下的键
-            if key not in self.pressed_keys:
-                self.pressed_keys.append(key)
-        except Exception:
-            pass
+        if keys:
+            self.backend.release_keys(keys)
 
-    def _handle_keyup(self, action: Dict[str, Any], _: int = 1) -> None:
-        """处理释放键"""
-        key = action['key']
-        try:
-            keyboard.release(key)
-            # 从追踪列表中移除
-            if key in self.pressed_keys:
-                self.pressed_keys.remove(key)
-        except Exception:
-            pass
+        # 释放按住的鼠标按钮
+        if buttons:
+            self.backend.submit([(InputBackend.MOUSEUP, button) for button in buttons])
 
-    def reset_keys(self, force_release_modifiers: bool = False) -> None:
-        """重置所有按住的键
+    def run_program(self, program: MacroProgram,
+                    key_state_checker: Optional[Callable[[], bool]] = None,
+                    check_window: bool = True) -> bool:
+        """在默认通道上同步解释执行编译后的宏程序
 
-        Args:
-            force_release_modifiers: 是否强制释放所有修饰键（用于紧急情况）
+        Returns:
+            True 表示完整执行，False 表示被中断
         """
-        # 释放追踪的按键
-        for key in self.pressed_keys[:]:  # 使用副本遍历
-            try:
-                keyboard.release(key)
-            except Exception:
-                pass
-        self.pressed_keys.clear()
+        channel = self.channel
+        return self._drive(channel, self.program_steps(program, channel, key_state_checker, check_window))
 
-        # 强制释放修饰键（防止输入法干扰导致按键卡住）
-        if force_release_modifiers:
-            for modifier_key in Config.FORCE_RELEASE_MODIFIER_KEYS:
-                try:
-                    keyboard.release(modifier_key)
-                except Exception:
-                    pass
+    def program_steps(self, program: MacroProgram, channel: MacroChannel,
+                      key_state_checker: Optional[Callable[[], bool]] = None,
+                      check_window: bool = True) -> Generator[None, None, bool]:
+        """在通道上逐步解释执行编译后的宏程序（生成器）
 
-    def execute_action(self, action: Dict[str, Any], repeat_count: int = 1) -> None:
-        """执行单个动作"""
-        if self.stop_flag:
-            return
+        每个注入动作都按通道时间线上的绝对截止时间执行：生成器先 yield，由驱动方
+        等到 channel.scheduler.deadline，再做状态检查，然后注入并推进时间线。
+        延迟指令只推进时间线。整个程序重复执行 program.repeat 遍。
+
+        Returns:
+            True 表示完整执行，False 表示被中断
+        """
+        ops = program.ops
+        args = program.args
+        durations = program.durations
+        names = program.names
+        monitor = self.window_monitor if check_window else None
+        interval = Config.KEY_PRESS_INTERVAL
+        scheduler = channel.scheduler
+        cancel_token = channel.cancel_token
+        backend = self.backend
+        tap = backend.tap
+
+        # 操作码绑定为局部变量，避免循环内的属性查找
+        PRESS, PRESS_DELAY, DELAY = OpCode.PRESS, OpCode.PRESS_DELAY, OpCode.DELAY
+        CLICK, CLICK_DELAY = OpCode.CLICK, OpCode.CLICK_DELAY
+
+        for _ in range(program.repeat):
+            for pc in range(len(ops)):
+                op = ops[pc]
+                if op == DELAY:
+                    scheduler.deadline += durations[pc]
+                    continue
+
+                yield
+                if cancel_token.is_set():
+                    return False
 
-        action_type = action['type']
-        handler = self._action_handlers.get(action_type)
+                # 检查按键状态（用于"按住时"模式）
+                if key_state_checker is not None and not key_state_checker():
+                    return False
+
+                # 窗口焦点检查（读取跟踪线程缓存的状态）
+                if monitor is not None and not monitor.target_active:
+                    self.on_focus_lost()
+                    return False
 
-        if handler:
-            handler(action, repeat_count)
+                if op == PRESS_DELAY or op == PRESS:
+                    tap(names[args[pc]])
+                    scheduler.deadline += interval + durations[pc]
+                elif op == CLICK_DELAY or op == CLICK:
+                    backend.click(names[args[pc]])
+                    scheduler.deadline += durations[pc]
+                elif op == OpCode.PRESS_GROUP:
+                    backend.tap_keys(program.groups[args[pc]])
+                    scheduler.deadline += interval
+                elif op == OpCode.HOLD:
+                    # 按住期间登记到通道的 pressed_keys，任何停止路径都能释放它
+                    key = names[args[pc]]
+                    self._key_down(key, channel)
+                    scheduler.deadline += durations[pc]
+                    yield
+                    self._key_up(key, channel)
+                elif op == OpCode.DOUBLECLICK:
+                    backend.double_click(names[args[pc]])
+                elif op == OpCode.KEYDOWN:
+                    self._key_down(names[args[pc]], channel)
+                elif op == OpCode.KEYUP:
+                    self._key_up(names[args[pc]], channel)
+                elif op == OpCode.MOUSEDOWN:
+                    self._button_down(names[args[pc]], channel)
+                elif op == OpCode.MOUSEUP:
+                    self._button_up(names[args[pc]], channel)
+
+        return True
+
+    def begin(self, channel: MacroChannel, macro: Macro,
+              cancel_token: Optional[CancelToken] = None) -> None:
+        """在通道上开始一次执行：新的取消令牌，以当前时间为起点的时间线"""
+        channel.cancel_token = cancel_token if cancel_token is not None else CancelToken(self.wake)
+        scheduler = channel.scheduler
+        scheduler.reset(self.timing_stats.setdefault(macro.name, TimingStats()),
+                        channel.cancel_token)
+        tracer = scheduler.tracer = self.tracer
+        if tracer is not None:
+            scheduler.trace_id = tracer.macro_id(macro.name)
+            tracer.record(LatencyTracer.START, scheduler.trace_id, scheduler.deadline)
+        channel.macro = macro
+
+    def end(self, channel: MacroChannel) -> None:
+        """结束通道上的执行"""
+        tracer = self.tracer
+        if tracer is not None and channel.cancel_token.is_set():
+            tracer.record(LatencyTracer.STOP, channel.scheduler.trace_id, time.perf_counter(),
+                          channel.cancel_token.requested_at)
+        channel.macro = None
+
+    def _drive(self, channel: MacroChannel, steps: Generator[None, None, Any]) -> Any:
+        """在当前线程中同步推进步进生成器，每一步等到通道的截止时间"""
+        wait = channel.scheduler.wait
+        try:
+            while True:
+                next(steps)
+                if not wait():
+                    steps.close()
+                    return False
+        except StopIteration as done:
+            return done.value
 
-    def execute_macro(self, macro: Dict[str, Any], repeat_mode: str = 'once',
+    def execute_macro(self, macro: Macro, repeat_mode: str = 'once',
                      key_state_checker: Optional[Callable[[], bool]] = None,
-                     additional_keys: Optional[List[str]] = None) -> None:
-        """执行宏序列
+                     additional_keys: Optional[List[str]] = None,
+                     cancel_token: Optional[CancelToken] = None) -> None:
+        """在默认通道上同步执行宏序列
 
         Args:
             macro: 宏配置
             repeat_mode: 重复模式 ('once', 'loop', 'hold')
             key_state_checker: 按键状态检查函数，返回 True 表示继续执行，False 表示停止
             additional_keys: 附加按键列表，这些键在 reset_keys 后需要重新按下
+            cancel_token: 本次执行的取消令牌（由调用方预先创建，避免启动前的停止请求丢失）
         """
-        self.running = True
-        self.stop_flag = False
-        actions = macro['actions']
-        start_actions = macro.get('start_actions', [])
-        reset_keys_enabled = macro.get('reset_keys', False)
-        skip_window_check = macro.get('skip_window_check', False)
-
-        # 如果启用了"重置按键"，在宏开始执行前立即释放所有键
-        if reset_keys_enabled:
-            self.reset_keys(force_release_modifiers=True)
-
-            # 重新按下附加按键（避免附加按键被 reset_keys 释放）
-            if additional_keys:
-                for key in additional_keys:
-                    try:
-                        keyboard.press(key)
-                    except Exception:
-                        pass
-
-        # 执行起始动作（只在第一次触发时执行）
-        if start_actions:
-            for action in start_actions:
-                if self.stop_flag:
-                    break
-                self.execute_action(action)
+        channel = self.channel
+        self.begin(channel, macro, cancel_token)
+        try:
+            self._drive(channel, self.macro_steps(macro, channel, repeat_mode,
+                                                  key_state_checker, additional_keys))
+        finally:
+            self.end(channel)
+
+    def macro_steps(self, macro: Macro, channel: MacroChannel,
+                    repeat_mode: str = 'once',
+                    key_state_checker: Optional[Callable[[], bool]] = None,
+                    additional_keys: Optional[List[str]] = None) -> Generator[None, None, None]:
+        """在通道上逐步执行宏序列（生成器，调用前先用 begin() 开始执行）
+
+        参数同 execute_macro。被中断时（包括生成器被关闭）释放本通道按住的键。
+        """
+        cancel_token = channel.cancel_token
+        try:
+            reset_keys_enabled = macro.reset_keys
+            check_window = channel.check_window = not macro.skip_window_check
+
+            # 空闲时焦点跟踪是暂停的，开始执行前先刷新一次缓存的焦点状态
+            monitor = self.window_monitor
+            if check_window and monitor is not None and monitor.enabled:
+                monitor.refresh()
+
+            # 如果启用了"重置按键"，在宏开始执行前立即释放本通道的键
+            if reset_keys_enabled:
+                self.reset_keys(force_release_modifiers=True, channel=channel)
+
+                # 重新按下附加按键（避免附加按键被 reset_keys 释放）
+                if additional_keys:
+                    self.backend.press_keys(additional_keys)
+
+            # 执行起始动作（只在第一次触发时执行）
+            yield from self.program_steps(macro.start_program, channel, check_window=False)
+
+            # 根据模式执行
+            program = macro.program
+            if repeat_mode == 'once':
+                yield from self.program_steps(program, channel, key_state_checker, check_window)
+            else:  # loop 或 hold
+                # 只有延迟的循环体不会让出，每轮额外让出一次，避免独占执行线程
+                delay_only = all(op == OpCode.DELAY for op in program.ops)
+                while not cancel_token.is_set():
+                    # 周期性检查按键状态
+                    if key_state_checker and not key_state_checker():
+                        break
+
+                    if not (yield from self.program_steps(program, channel,
+                                                          key_state_checker, check_window)):
+                        break
+                    if delay_only:
+                        yield
+
+            # 执行结束动作（如果配置了）
+            if not cancel_token.is_set():
+                yield from self.program_steps(macro.finish_program, channel, check_window=False)
+
+            # 等待时间线上最后的延迟结束
+            yield
+        finally:
+            # 被中断时由执行线程自己释放按键，避免与停止请求方的释放交错导致按键卡住
+            if cancel_token.is_set():
+                self.reset_keys(force_release_modifiers=channel.release_modifiers, channel=channel)
+            channel.release_modifiers = False
+
+    def on_focus_lost(self) -> None:
+        """目标窗口失去焦点：中断受窗口限制的通道（可由焦点跟踪线程调用）
+
+        这里只发出取消请求，按键由执行线程在宏结束时释放（窗口切换时同时强制释放修饰键）。
+        """
+        lost = [channel for channel in list(self.channels.values())
+                if channel.running and channel.check_window and not channel.cancel_token.is_set()]
+        if not lost:
+            return
+        log.warning(_msg('warn_window_lost'))
+        for channel in lost:
+            channel.release_modifiers = True
+            channel.cancel_token.cancel()
+
+    def stop_macro(self, channel: Optional[MacroChannel] = None) -> None:
+        """停止宏并释放按住的键
+
+        Args:
+            channel: 只停止该通道，None 表示所有通道
+        """
+        for ch in [channel] if channel is not None else list(self.channels.values()):
+            ch.cancel_token.cancel()
+        self.reset_keys(channel=channel)
+
+
+# ========================================
+# 配置缓存与文件监视
+# ========================================
+class ConfigCache:
+    """已解析并编译的宏配置的磁盘缓存
+
+    缓存文件与配置文件放在一起（<配置文件>.cache），内容为：
+        MAGIC | 键 (32 字节) | 载荷摘要 (32 字节) | marshal 载荷
+
+    载荷只包含基本类型（解析警告的 (级别, 消息) 列表；每个宏一个元组：字段值、动作元组、程序数组的字节），
+    读取时重新构造 Action / MacroProgram / Macro，缓存文件中不会有可执行的内容。
+    命中缓存时由解析器重新输出保存的警告，有问题的配置每次加载都会提示。
+    键由配置文件内容、解析器版本、映射表版本和影响优化与定时分析结果的 Config 设置共同决定，
+    任一变化都会使缓存失效。
+    读取时任何异常（截断、损坏、版本不符）都视为未命中，由调用方回退到完整解析。
+    """
+    MAGIC = b'D4MC\x03'
+    SUFFIX = '.cache'
+    CHUNK_SIZE = 1 << 16   # 计算文件键时每次读取的字节数
+
+    # 影响缓存内容（解析、优化、定时分析结果）的 Config 设置
+    SETTINGS = ('KEY_PRESS_INTERVAL', 'STOP_LATENCY_BOUND', 'DEFAULT_DELAY_FALLBACK', 'DEFAULT_CHANNEL')
+    PROGRAM_KEYS = ('start_program', 'program', 'finish_program')
+
+    _mapping_version: Optional[bytes] = None
+
+    def __init__(self, config_path: str):
+        self.path = config_path + self.SUFFIX
+
+    @classmethod
+    def mapping_version(cls) -> bytes:
+        """映射表版本：修改同义词、中文映射或扫描码表后自动变化"""
+        if cls._mapping_version is None:
+            tables = (
+                sorted(LanguageMapping.EN_SYNONYMS.items()),
+                sorted(LanguageMapping.ZH_CN.items()),
+                sorted(LanguageMapping.XML_REPEAT_MODE.items()),
+                sorted(LanguageMapping.XML_MOUSE_EVENTS.items()),
+                sorted(LanguageMapping.MOUSE_ACTIONS),  # 值为 lambda，仅取键
+                sorted(MacroEngine.SCAN_CODE_MAP.items()),
+            )
+            cls._mapping_version = hashlib.sha256(repr(tables).encode('utf-8')).digest()
+        return cls._mapping_version
+
+    @classmethod
+    def _new_hash(cls) -> Any:
+        """以解析器版本、映射表版本和相关 Config 设置为前缀的摘要对象"""
+        h = hashlib.sha256()
+        h.update(b'%d\0' % MacroParser.VERSION)
+        h.update(cls.mapping_version())
+        h.update(repr([getattr(Config, name) for name in cls.SETTINGS]).encode('utf-8'))
+        return h
+
+    @classmethod
+    def make_key(cls, content: bytes) -> bytes:
+        """计算缓存键"""
+        h = cls._new_hash()
+        h.update(content)
+        return h.digest()
+
+    @classmethod
+    def file_key(cls, path: str) -> bytes:
+        """分块读取文件计算缓存键（与 make_key(文件内容) 相同，但不把整个文件读入内存）"""
+        h = cls._new_hash()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.digest()
+
+    def load(self, key: bytes) -> Optional[Tuple[List[Macro], List[Tuple[str, str]]]]:
+        """读取缓存，返回 (宏列表, 解析警告)，未命中或缓存损坏时返回 None"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        header = len(self.MAGIC)
+        if (data[:header] != self.MAGIC or
+                data[header:header + 32] != key):
+            return None
+        payload = data[header + 64:]
+        if hashlib.sha256(payload).digest() != data[header + 32:header + 64]:
+            return None
+        try:
+            messages, records = marshal.loads(payload)
+            messages = [(level, message) for level, message in messages]
+            if not all(level in ('warning', 'error') and isinstance(message, str) for level, message in messages):
+                return None
+            actions: Dict[Tuple[Any, ...], Action] = {}
+            return [self._load_macro(record, actions) for record in records], messages
+        except Exception:
+            return None
+
+    def store(self, key: bytes, macros: List[Macro], messages: Sequence[Tuple[str, str]] = ()) -> bool:
+        """写入缓存（先写临时文件再原子替换，避免留下半写的缓存）"""
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            payload = marshal.dumps((tuple(messages), [self._dump_macro(macro) for macro in macros]))
+            with open(tmp_path, 'wb') as f:
+                f.write(self.MAGIC + key + hashlib.sha256(payload).digest() + payload)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+    @classmethod
+    def _dump_macro(cls, macro: Macro) -> Tuple[Any, ...]:
+        """宏 -> 基本类型的元组（字段顺序同 Macro.FIELDS）"""
+        record = []
+        for field in Macro.FIELDS:
+            value = getattr(macro, field)
+            if field in MacroOptimizer.ACTION_KEYS:
+                value = tuple((a.op, a.key, a.button, a.duration, a.group) for a in value)
+            elif field in cls.PROGRAM_KEYS and value is not None:
+                value = (value.ops.tobytes(), value.args.tobytes(), value.durations.tobytes(),
+                         tuple(value.names), tuple(value.groups), value.action_count, value.repeat)
+            record.append(value)
+        return tuple(record)
+
+    @classmethod
+    def _load_macro(cls, record: Tuple[Any, ...], actions: Dict[Tuple[Any, ...], Action]) -> Macro:
+        """_dump_macro 的逆变换（字段无效时抛出异常）
+
+        动作不可变，相同的动作元组共用一个 Action（actions 为本次读取共用的表）。
+        """
+        fields = dict(zip(Macro.FIELDS, record, strict=True))
+        for field in MacroOptimizer.ACTION_KEYS:
+            converted = []
+            for data in fields[field]:
+                action = actions.get(data)
+                if action is None:
+                    action = actions[data] = Action(*data)
+                converted.append(action)
+            fields[field] = tuple(converted)
+        for field in cls.PROGRAM_KEYS:
+            data = fields[field]
+            if data is not None:
+                program = fields[field] = MacroProgram()
+                program.ops.frombytes(data[0])
+                program.args.frombytes(data[1])
+                program.durations.frombytes(data[2])
+                if not len(program.ops) == len(program.args) == len(program.durations):
+                    raise ValueError('inconsistent program arrays')
+                program.names = list(data[3])
+                program.groups = [tuple(group) for group in data[4]]
+                program.action_count, program.repeat = data[5], data[6]
+        return Macro(**fields)
+
+
+class ConfigWatcher:
+    """配置文件监视器 - 文件保存后调用回调（通常是增量重载）
+
+    Windows 上有 pywin32 时阻塞等待目录的变化通知，其他情况下轮询修改时间。
+
+    编辑器保存时常常产生多次写入（截断、写入、改名替换），这些变化会合并：
+    检测到变化后重新计时，文件状态保持 debounce 秒不变才触发一次回调。
+    """
+
+    def __init__(self, path: str, on_change: Callable[[], None],
+                 interval: Optional[float] = None, debounce: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            path: 配置文件路径
+            on_change: 文件变化并稳定后调用的函数（在监视线程中调用）
+            interval: 轮询间隔，默认 Config.CONFIG_WATCH_INTERVAL
+            debounce: 防抖时间，默认 Config.CONFIG_WATCH_DEBOUNCE
+            clock: 时间来源（便于测试）
+        """
+        self.path = path
+        self.on_change = on_change
+        self.interval = Config.CONFIG_WATCH_INTERVAL if interval is None else interval
+        self.debounce = Config.CONFIG_WATCH_DEBOUNCE if debounce is None else debounce
+        self.clock = clock
+        self._stat = self._read_stat()
+        self._changed_at: Optional[float] = None  # 最近一次观察到变化的时间，None 表示没有待处理的变化
+        self._stop_event = threading.Event()
+        self._stop_handle: Any = None             # 变化通知模式下用于唤醒等待的 Win32 事件
+        self._thread: Optional[threading.Thread] = None
+
+    def _read_stat(self) -> Optional[Tuple[int, int]]:
+        """读取文件的 (修改时间, 大小)，文件不存在时返回 None"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def poll(self) -> bool:
+        """检查一次文件状态
+
+        Returns:
+            True 表示本次调用触发了回调
+        """
+        stat = self._read_stat()
+        now = self.clock()
+        if stat != self._stat:
+            self._stat = stat
+            self._changed_at = now  # 新的变化：重新开始计时
+            return False
+        if self._changed_at is None or now - self._changed_at < self.debounce:
+            return False
+
+        self._changed_at = None
+        if stat is None:
+            return False  # 文件被删除：保持当前配置，等待文件重新出现
+        try:
+            self.on_change()
+        except Exception as e:
+            log.error(_msg('warn_error', e))
+        return True
 
-        def run_actions():
-            """执行一次所有动作"""
-            for action in actions:
-                if self.stop_flag:
-                    return False
+    def start(self) -> None:
+        """启动后台监视线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='ConfigWatcher', daemon=True)
+            self._thread.start()
 
-                # 检查按键状态（用于"按住时"模式）
-                if key_state_checker and not key_state_checker():
-                    return False
+    def stop(self) -> None:
+        """停止后台监视线程"""
+        self._stop_event.set()
+        if self._stop_handle is not None:
+            win32event.SetEvent(self._stop_handle)
+
+    def _watch(self) -> None:
+        """监视线程主循环"""
+        if WIN32_EVENTS_AVAILABLE:
+            try:
+                self._watch_notifications()
+                return
+            except Exception as e:  # 目录不支持变化通知（例如某些网络驱动器）：退回轮询
+                log.warning(_msg('warn_watch_fallback', e))
+        while not self._stop_event.wait(self.interval):
+            self.poll()
+
+    def _watch_notifications(self) -> None:
+        """阻塞等待目录的变化通知，只在文件变化后的防抖期间定时检查"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle = win32file.FindFirstChangeNotification(
+            directory, False,
+            win32con.FILE_NOTIFY_CHANGE_LAST_WRITE | win32con.FILE_NOTIFY_CHANGE_SIZE |
+            win32con.FILE_NOTIFY_CHANGE_FILE_NAME)
+        self._stop_handle = win32event.CreateEvent(None, True, False, None)
+        try:
+            while not self._stop_event.is_set():
+                timeout = (win32event.INFINITE if self._changed_at is None
+                           else int(self.debounce * 1000) + 1)
+                result = win32event.WaitForMultipleObjects([self._stop_handle, handle], False, timeout)
+                if result == win32event.WAIT_OBJECT_0:
+                    return
+                if result == win32event.WAIT_OBJECT_0 + 1:
+                    win32file.FindNextChangeNotification(handle)
+                self.poll()
+        finally:
+            win32file.FindCloseChangeNotification(handle)
 
-                # 窗口焦点检查（如果启用）
-                if not skip_window_check:
-                    if self.window_monitor and not self.window_monitor.is_target_window_active():
-                        log.warning(_msg('warn_window_lost'))
-                        self.reset_keys(force_release_modifiers=True)  # 窗口切换时强制释放所有按键
-                        return False
 
-                self.execute_action(action)
-            return True
+# ========================================
+# 配置解析
+# ========================================
+class ActionLexer:
+    """动作行词法分析器
 
-        # 根据模式执行
-        if repeat_mode == 'once':
-            run_actions()
-        else:  # loop 或 hold
-            while not self.stop_flag:
-                # 周期性检查按键状态
-                if key_state_checker and not key_state_checker():
-                    break
+    中文映射与英文同义词预先合并为一张词表，每个词只查一次表；
+    一行只扫描一遍，按动作关键字切分为指令，并记录每条指令的列号用于报错。
+    注释以 # 开头的词开始（例如 "按下 q  # 注释"），词中间的 # 不视为注释。
+    配置行的值本身可以是 #（例如 "触发键 = #"），值之后的 # 才是注释。
+    """
 
-                if not run_actions():
-                    break
+    _COMMENT_RE = re.compile(r'(?:^|\s)#')
 
-        # 执行结束动作（如果配置了）
-        finish_actions = macro.get('finish_actions', [])
-        if finish_actions and not self.stop_flag:
-            for action in finish_actions:
-                if self.stop_flag:
-                    break
-                self.execute_action(action)
+    def __init__(self, action_types: Sequence[str]):
+        """
+        Args:
+            action_types: 动作类型（标准英文），出现这些词时开始一条新指令
+        """
+        # 与 _translate 相同的两级映射：先中文，再英文同义词
+        self.table: Dict[str, str] = dict(LanguageMapping.EN_SYNONYMS)
+        for word, translated in LanguageMapping.ZH_CN.items():
+            self.table[word] = LanguageMapping.EN_SYNONYMS.get(translated, translated)
+
+        # 原词 -> 动作类型
+        action_types = set(action_types)
+        self.keywords: Dict[str, str] = {
+            word: translated for word, translated in self.table.items() if translated in action_types
+        }
+        for action_type in action_types:
+            if action_type not in self.table:
+                self.keywords[action_type] = action_type
 
-        self.running = False
+    def translate(self, word: str) -> str:
+        """翻译中文和英文同义词为标准英文"""
+        return self.table.get(word, word)
+
+    @staticmethod
+    def strip_comment(line: str, start: int = 0) -> str:
+        """移除行尾注释（start 之前的 # 不视为注释）"""
+        if '#' not in line:
+            return line
+        match = ActionLexer._COMMENT_RE.search(line, start)
+        return line[:match.start()] if match else line
+
+    def lex(self, line: str) -> List[Tuple[Optional[str], List[str], int]]:
+        """把一行切分为指令
+
+        Returns:
+            [(动作类型, 词列表（含关键字）, 首个词的序号), ...]；
+            动作类型为 None 表示第一个关键字之前无法识别的内容
+        """
+        statements: List[Tuple[Optional[str], List[str], int]] = []
+        keywords = self.keywords
+        parts: Optional[List[str]] = None
+        for index, word in enumerate(line.split()):
+            if word[0] == '#':
+                break
+            action_type = keywords.get(word)
+            if action_type is not None or parts is None:
+                parts = [word]
+                statements.append((action_type, parts, index))
+            else:
+                parts.append(word)
+        return statements
 
-    def stop_macro(self) -> None:
-        """停止当前宏并释放所有按住的键"""
-        self.stop_flag = True
-        self.reset_keys()
+    @staticmethod
+    def column(line: str, index: int) -> int:
+        """第 index 个词在行中的列号（从 1 开始，只在报错时计算）"""
+        pos = 0
+        for i, word in enumerate(line.split()):
+            pos = line.find(word, pos)
+            if i == index:
+                break
+            pos += len(word)
+        return pos + 1
 
 
 class MacroParser:
     """配置文件解析器 - 支持文本格式和 XML 格式"""
 
+    # 解析/编译结果格式版本：修改宏模型或字节码后递增，使旧缓存失效
+    VERSION = 11
+
     def __init__(self, window_monitor: Optional[WindowMonitor] = None):
         self.engine = MacroEngine(window_monitor)
+        self.messages: List[Tuple[str, str]] = []  # 最近一次加载输出的解析警告 (级别, 消息)，随缓存保存
 
         # 配置项处理器映射（依赖实例方法）
         self._config_handlers = {
@@ -600,6 +2381,12 @@ class MacroParser:
             'additional_keys': self._handle_additional_keys,
             'default_delay': self._handle_default_delay,
             'skip_window_check': self._handle_skip_window_check,
+            'channel': self._handle_channel,
+            'exclusive': self._handle_exclusive,
+            'priority': self._handle_priority,
+            'buffer': self._handle_buffer,
+            'buffer_expiry': self._handle_buffer_expiry,
+            'rapid_threshold': self._handle_rapid_threshold,
         }
 
         # 动作解析器映射（合并实例方法和静态映射）
@@ -613,15 +2400,15 @@ class MacroParser:
         }
         # 添加鼠标动作（从 LanguageMapping 获取）
         self._action_parsers.update(LanguageMapping.MOUSE_ACTIONS)
+        self.lexer = ActionLexer(list(self._action_parsers))
+
+        # 多键按下动作的分组编号
+        self._press_group_seq = 0
 
 
     def _translate(self, text: str) -> str:
         """翻译中文和英文同义词为标准英文"""
-        # 先尝试中文映射
-        result = LanguageMapping.ZH_CN.get(text, text)
-        # 再尝试英文同义词映射
-        result = LanguageMapping.EN_SYNONYMS.get(result, result)
-        return result
+        return self.lexer.table.get(text, text)
 
     def _handle_trigger_key(self, value: str, macro: Dict[str, Any]) -> None:
         """处理触发键配置"""
@@ -640,7 +2427,12 @@ class MacroParser:
         if self._translate(value) == 'hold':
             macro['repeat_mode'] = 'hold'
         elif value.isdigit():
-            macro['repeat_count'] = int(value)
+            count = int(value)
+            if count < 1:
+                # 不丢弃整个宏（否则触发键失效），按执行一遍处理
+                self._report('warning', _msg('warn_repeat_count', macro['name'], value))
+                count = 1
+            macro['repeat_count'] = count
 
     def _handle_reset_keys(self, value: str, macro: Dict[str, Any]) -> None:
         """处理重置按键配置"""
@@ -665,6 +2457,38 @@ class MacroParser:
         translated_value = self._translate(value).lower()
         macro['skip_window_check'] = (translated_value == 'true')
 
+    def _handle_channel(self, value: str, macro: Dict[str, Any]) -> None:
+        """处理执行通道配置（不同通道的宏可以同时运行）"""
+        macro['channel'] = value.strip() or Config.DEFAULT_CHANNEL
+
+    def _handle_exclusive(self, value: str, macro: Dict[str, Any]) -> None:
+        """处理独占配置（启动时中断所有通道的宏）"""
+        translated_value = self._translate(value).lower()
+        macro['exclusive'] = (translated_value == 'true')
+
+    def _handle_priority(self, value: str, macro: Dict[str, Any]) -> None:
+        """处理优先级配置（缓冲队列中优先级高的宏先执行，写满时先淘汰优先级低的）"""
+        try:
+            macro['priority'] = int(value)
+        except ValueError:
+            self._report('warning', _msg('warn_config_format', value))
+
+    def _handle_buffer(self, value: str, macro: Dict[str, Any]) -> None:
+        """处理缓冲策略配置（通道忙时：自动 / 中断 / 排队 / 忽略）"""
+        policy = self._translate(value).lower()
+        if policy in InputScheduler.POLICIES:
+            macro['buffer_policy'] = policy
+        else:
+            self._report('warning', _msg('warn_config_format', value))
+
+    def _handle_buffer_expiry(self, value: str, macro: Dict[str, Any]) -> None:
+        """处理缓冲时限配置"""
+        macro['buffer_expiry'] = self.engine.parse_delay(value)
+
+    def _handle_rapid_threshold(self, value: str, macro: Dict[str, Any]) -> None:
+        """处理连按阈值配置"""
+        macro['rapid_threshold'] = self.engine.parse_delay(value)
+
     def _parse_press_action(self, parts: List[str]) -> Optional[List[Dict[str, Any]]]:
         """解析按键动作"""
         if len(parts) >= 2:
@@ -674,9 +2498,11 @@ class MacroParser:
             keys_str = keys_str.replace(',', ' ').replace('、', ' ')
             keys = [k.strip() for k in keys_str.split() if k.strip()]
 
-            # 如果有多个键，返回多个动作
+            # 如果有多个键，返回多个动作（同一组，编译时合并为一次注入）
             if len(keys) > 1:
-                return [{'type': 'press', 'key': self.engine.parse_key(self._translate(k))}
+                self._press_group_seq += 1
+                return [{'type': 'press', 'key': self.engine.parse_key(self._translate(k)),
+                         'group': self._press_group_seq}
                        for k in keys]
             elif len(keys) == 1:
                 return [{'type': 'press', 'key': self.engine.parse_key(self._translate(keys[0]))}]
@@ -712,26 +2538,40 @@ class MacroParser:
         return None
 
 
-    def parse_text_format(self, content: str) -> List[Dict[str, Any]]:
+    def _report(self, level: str, message: str) -> None:
+        """输出解析警告并记录下来（写入缓存，命中缓存时重新输出）"""
+        self.messages.append((level, message))
+        getattr(log, level)(message)
+
+    def parse_text_format(self, content: str) -> List[Macro]:
         """解析简洁的文本格式"""
-        macros = []
+        return list(self.iter_text_format(content.split('\n')))
+
+    def iter_text_format(self, lines: Iterable[str]) -> Iterator[Macro]:
+        """逐行解析文本格式，每个宏段结束时立即产出该宏（已插入默认延迟并编译）"""
         current_macro = None
         current_action_section = 'actions'  # 当前正在解析的动作区域
 
-        for line in content.split('\n'):
-            line = line.strip()
+        for line_no, raw_line in enumerate(lines, 1):
+            line = raw_line.strip()
 
             # 跳过空行和注释
-            if not line or line.startswith('#'):
+            if not line or line[0] == '#':
                 continue
+            # 去掉注释后的内容只用于判断行的类型，配置行的值由 _parse_config_line 处理注释
+            code = self.lexer.strip_comment(line).rstrip()
 
             # 新的宏定义
-            if line.startswith('[') and line.endswith(']'):
+            if code.startswith('[') and code.endswith(']'):
                 if current_macro:
-                    macros.append(current_macro)
+                    macro = self._finish_macro(current_macro)
+                    if macro is not None:
+                        yield macro
 
+                # 分组编号在宏内独立，修改其他宏不会改变本宏的内容（增量重载按内容比较）
+                self._press_group_seq = 0
                 current_macro = {
-                    'name': line[1:-1].strip(),
+                    'name': code[1:-1].strip(),
                     'trigger_key': None,
                     'repeat_mode': 'once',
                     'actions': [],
@@ -745,9 +2585,9 @@ class MacroParser:
                 continue
 
             # 解析配置项
-            if '=' in line:
+            if '=' in code:
                 # 检查是否是动作区域配置项
-                key_part = line.split('=', 1)[0].strip()
+                key_part = code.split('=', 1)[0].strip()
                 translated_key = self._translate(key_part)
 
                 if translated_key == 'start_actions':
@@ -765,54 +2605,35 @@ class MacroParser:
                     current_action_section = 'actions'  # 遇到其他配置项时，重置为普通动作模式
             else:
                 # 解析动作指令（支持一行多个指令，用多个空格分隔）
-                actions = self._parse_action_line(line)
+                actions = self._parse_action_line(raw_line, line_no)
                 if actions:
                     # 根据当前区域添加到对应的动作列表
                     current_macro[current_action_section].extend(actions)
 
         if current_macro:
-            # 在解析完所有动作后，插入默认延迟
-            self._insert_default_delays(current_macro)
-            macros.append(current_macro)
-
-        return macros
-
-    def _insert_default_delays(self, macro: Dict[str, Any]) -> None:
-        """在每个非延迟动作后插入默认延迟"""
-        default_delay = macro.get('default_delay')
-        if not default_delay:
-            return
-
-        # 处理所有动作区域（起始、普通、结束）
-        for action_key in ['start_actions', 'actions', 'finish_actions']:
-            actions = macro.get(action_key, [])
-            if not actions:
-                continue
+            macro = self._finish_macro(current_macro)
+            if macro is not None:
+                yield macro
 
-            new_actions = []
-            for i, action in enumerate(actions):
-                new_actions.append(action)
-
-                # 如果当前动作不是delay，且不是最后一个动作，插入默认延迟
-                if action['type'] != 'delay' and i < len(actions) - 1:
-                    # 检查下一个动作是否已经是delay
-                    next_action = actions[i + 1]
-                    if next_action['type'] != 'delay':
-                        # 插入默认延迟
-                        new_actions.append({'type': 'delay', 'duration': default_delay})
-
-            macro[action_key] = new_actions
+    def _finish_macro(self, fields: Dict[str, Any]) -> Optional[Macro]:
+        """宏段结束：由收集的字段构建宏模型（优化动作、编译），定义无效时警告并返回 None"""
+        try:
+            return self.engine.build_macro(fields)
+        except (TypeError, ValueError) as e:
+            self._report('warning', _msg('warn_invalid_macro', fields.get('name', ''), e))
+            return None
 
     def _parse_config_line(self, line: str, macro: Dict[str, Any]) -> None:
         """解析配置行"""
         try:
             if '=' not in line:
-                log.warning(_msg('warn_config_format', line))
+                self._report('warning', _msg('warn_config_format', line))
                 return
 
             key, value = line.split('=', 1)
             key = self._translate(key.strip())
-            value = value.strip()
+            # 值的第一个字符不会是注释（"触发键 = #" 的值为 #）
+            value = self.lexer.strip_comment(value.strip(), 1).rstrip()
 
             # 使用处理器映射
             handler = self._config_handlers.get(key)
@@ -821,145 +2642,1150 @@ class MacroParser:
             else:
                 # 未知的配置项，给出警告但不中断
                 if key and not key.startswith('_'):  # 跳过空键和内部键
-                    log.warning(_msg('warn_unknown_config', key, macro['name']))
+                    self._report('warning', _msg('warn_unknown_config', key, macro['name']))
         except Exception as e:
-            log.error(_msg('warn_parse_failed', line))
-            log.error(_msg('warn_error', e))
+            self._report('error', _msg('warn_parse_failed', line))
+            self._report('error', _msg('warn_error', e))
 
-    def _parse_action_line(self, line: str) -> List[Dict[str, Any]]:
+    def _parse_action_line(self, line: str, line_no: int = 0) -> List[Dict[str, Any]]:
         """解析单行动作指令（支持一行多个指令）"""
-        # 移除注释
-        line = line.split('#')[0].strip()
-        if not line:
-            return []
+        actions = []
+        for action_type, parts, index in self.lexer.lex(line):
+            if action_type is None:
+                self._report('warning', _msg('warn_action_syntax', line_no, self.lexer.column(line, index),
+                                             _msg('err_unknown_token', ' '.join(parts))))
+                continue
 
-        parts = line.split()
-        if not parts:
-            return []
+            # 解析动作
+            result = self._action_parsers[action_type](parts)
+            if not result:
+                self._report('warning', _msg('warn_action_syntax', line_no, self.lexer.column(line, index),
+                                             _msg('err_missing_args', parts[0])))
+            elif isinstance(result, list):
+                # 处理返回列表或单个动作的情况
+                actions.extend(result)
+            else:
+                actions.append(result)
+        return actions
+
+    def parse_xml_format(self, content: str) -> List[Macro]:
+        """解析 XML 格式 """
+        return list(self.iter_xml_format(io.StringIO(content)))
 
+    def iter_xml_format(self, source: Any) -> Iterator[Macro]:
+        """增量解析 XML 格式（文件路径或文件对象），每个 DefaultMacro 结束时产出该宏
+
+        已处理完的元素立即从父元素中移除，内存占用与单个宏相当，与文件大小无关。
+        """
+        stack: List[ET.Element] = []   # 尚未结束的元素
+        macro_depth = 0                # 当前位于几层 DefaultMacro 之内
+        unknown_codes: set = set()     # 已警告过的未知扫描码
+        try:
+            for event, elem in ET.iterparse(source, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(elem)
+                    if elem.tag == 'DefaultMacro':
+                        macro_depth += 1
+                    continue
+
+                stack.pop()
+                if elem.tag == 'DefaultMacro':
+                    macro_depth -= 1
+                    macro = self._build_xml_macro(elem, unknown_codes)
+                    if macro is not None:
+                        yield macro
+                elif macro_depth:
+                    continue  # 宏内部的元素在宏结束时一起读取
+                if stack:
+                    stack[-1].remove(elem)
+        except Exception as e:
+            self._report('error', _msg('parse_xml_failed', e))
+
+    def _build_xml_macro(self, macro_elem: ET.Element, unknown_codes: set) -> Optional[Macro]:
+        """由一个 DefaultMacro 元素构建宏模型"""
+        repeat_type = macro_elem.findtext('.//RepeatType', '0')
+        keydown_syntax = macro_elem.findtext('.//KeyDown/Syntax', '')
+        name = macro_elem.findtext('Major', _msg('unnamed_macro'))
+
+        return self._finish_macro({
+            'name': name,
+            'description': macro_elem.findtext('Description', ''),
+            'trigger_key': None,
+            'repeat_mode': LanguageMapping.XML_REPEAT_MODE.get(repeat_type, 'once'),
+            'actions': self._parse_xml_syntax(keydown_syntax, name, unknown_codes)
+        })
+
+    def _parse_xml_syntax(self, syntax: str, macro_name: str = '',
+                          unknown_codes: Optional[set] = None) -> List[Dict[str, Any]]:
+        """解析 XML 格式的按键语法（简单直接）"""
         actions = []
-        i = 0
 
-        while i < len(parts):
-            # 翻译并检查是否是动作关键字
-            action_type = self._translate(parts[i])
-            parser = self._action_parsers.get(action_type)
-
-            if parser:
-                # 找到下一个动作关键字的位置
-                next_action_idx = None
-                for j in range(i + 1, len(parts)):
-                    if self._translate(parts[j]) in self._action_parsers:
-                        next_action_idx = j
-                        break
+        for line in syntax.strip().split('\n'):
+            parts = line.split()
+            if not parts:
+                continue
 
-                # 提取当前动作的所有参数
-                if next_action_idx:
-                    action_parts = parts[i:next_action_idx]
-                else:
-                    action_parts = parts[i:]
-
-                # 解析动作
-                result = parser(action_parts)
-                if result:
-                    # 处理返回列表或单个动作的情况
-                    if isinstance(result, list):
-                        actions.extend(result)
-                    else:
-                        actions.append(result)
-
-                # 移动到下一个动作
-                i = next_action_idx if next_action_idx else len(parts)
-            else:
-                i += 1
+            cmd = parts[0]
+            try:
+                if cmd in ('KeyDown', 'KeyUp'):
+                    code = int(parts[1])
+                    key = self.engine.parse_key_code(code)
+                    if key:
+                        action_type = 'keydown' if cmd == 'KeyDown' else 'keyup'
+                        actions.append({'type': action_type, 'key': key})
+                    elif unknown_codes is None or code not in unknown_codes:
+                        if unknown_codes is not None:
+                            unknown_codes.add(code)
+                        self._report('warning', _msg('warn_unknown_scan_code', code, macro_name))
+
+                elif cmd == 'Delay':
+                    actions.append({'type': 'delay', 'duration': int(parts[1]) / 1000})
+
+                elif cmd in LanguageMapping.XML_MOUSE_EVENTS:
+                    action_type, button = LanguageMapping.XML_MOUSE_EVENTS[cmd]
+                    actions.append({'type': action_type, 'button': button})
+            except (IndexError, ValueError):
+                continue  # 缺少参数或参数不是数字：跳过该行
 
         return actions
 
-    def parse_xml_format(self, content: str) -> List[Dict[str, Any]]:
-        """解析 XML 格式 """
+    def load_file(self, filepath: str, use_cache: Optional[bool] = None) -> List[Macro]:
+        """加载配置文件（内容未变化时直接使用磁盘缓存，跳过解析与编译）"""
+        return list(self.iter_file(filepath, use_cache))
+
+    def iter_file(self, filepath: str, use_cache: Optional[bool] = None) -> Iterator[Macro]:
+        """逐个产出配置文件中的宏
+
+        文本格式边读边解析，每个宏段结束就产出该宏，解析过程的内存占用与单个宏相当
+        （启用缓存时还会保留已产出的宏，以便解析完成后写入缓存）。
+        内容未变化时直接从磁盘缓存产出。
+        """
+        if use_cache is None:
+            use_cache = Config.CONFIG_CACHE_ENABLED
         try:
-            root = ET.fromstring(content)
-            macros = []
+            cache = key = None
+            # 先取文件状态再计算键：计算键之后、解析之前文件被修改时，解析结束后的状态一定不同
+            stat = os.stat(filepath)
+            if use_cache:
+                cache = ConfigCache(filepath)
+                key = ConfigCache.file_key(filepath)
+                cached = cache.load(key)
+                if cached is not None:
+                    macros, self.messages = cached
+                    for level, message in self.messages:
+                        getattr(log, level)(message)
+                    for macro in macros:
+                        self.engine.compiler.link_keys(macro)  # 缓存中没有扫描码，重新解析（已解析的直接命中）
+                        yield macro
+                    return
+
+            parsed: List[Macro] = []
+            self.messages = []
+            for macro in self._iter_path(filepath):
+                if cache is not None:
+                    parsed.append(macro)
+                yield macro
+
+            # 解析期间文件被修改时不写缓存（键对应的是修改前的内容）
+            after = os.stat(filepath)
+            if (cache is not None and parsed and
+                    (after.st_mtime_ns, after.st_size) == (stat.st_mtime_ns, stat.st_size)):
+                cache.store(key, parsed, self.messages)
+        except Exception as e:
+            log.error(_msg('load_file_failed', e))
+
+    def _iter_path(self, filepath: str) -> Iterator[Macro]:
+        """根据文件格式流式解析"""
+        if self._is_xml_file(filepath):
+            yield from self.iter_xml_format(filepath)
+        else:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                yield from self.iter_text_format(f)
 
-            for macro_elem in root.findall('.//DefaultMacro'):
-                repeat_type = macro_elem.findtext('.//RepeatType', '0')
-                keydown_syntax = macro_elem.findtext('.//KeyDown/Syntax', '')
+    @staticmethod
+    def _is_xml_file(filepath: str) -> bool:
+        """根据第一个非空白字符判断是否为 XML 格式"""
+        with open(filepath, 'rb') as f:
+            chunk = f.read(4096)
+            if chunk.startswith(b'\xef\xbb\xbf'):  # UTF-8 BOM
+                chunk = chunk[3:]
+            while chunk and not chunk.strip():
+                chunk = f.read(4096)
+            return chunk.lstrip().startswith(b'<')
 
-                macros.append({
-                    'name': macro_elem.findtext('Major', _msg('unnamed_macro')),
-                    'description': macro_elem.findtext('Description', ''),
-                    'trigger_key': None,
-                    'repeat_mode': LanguageMapping.XML_REPEAT_MODE.get(repeat_type, 'once'),
-                    'actions': self._parse_xml_syntax(keydown_syntax)
-                })
 
-            return macros
-        except Exception as e:
-            log.error(_msg('parse_xml_failed', e))
+# ========================================
+# 热键分发
+# ========================================
+class HotkeyDispatcher:
+    """全局热键分发器 - 一个键盘钩子 + 以 (扫描码, 修饰键掩码) 为键的分发表
+
+    每个按键事件只做常数次字典查找，与绑定的热键数量无关。
+    分发表按扫描码预先分组为 (修饰键掩码位, {掩码: 绑定})，既没有绑定也不是修饰键的按键
+    只做一次查找就返回，不更新任何状态。
+    组合键状态机：
+        - 修饰键按下/松开时更新当前掩码（左右修饰键分别记录）
+        - 按下时先精确匹配 (扫描码, 掩码)，没有时退回到不带修饰键的绑定，
+          因此 "f" 在按住 ctrl 时仍会触发，而 "ctrl+shift+f" 只在同时按住 ctrl 和 shift 时触发
+        - 按下时记住命中的绑定，松开事件交给同一个绑定（即使修饰键已先松开）
+        - 有松开回调的绑定忽略系统自动重复产生的按下事件
+    """
+
+    CTRL = 1
+    SHIFT = 2
+    ALT = 4
+    WIN = 8
+
+    # 修饰键名称 -> 掩码位
+    MODIFIER_NAMES = {
+        'ctrl': CTRL, 'control': CTRL, 'left ctrl': CTRL, 'right ctrl': CTRL,
+        'shift': SHIFT, 'left shift': SHIFT, 'right shift': SHIFT,
+        'alt': ALT, 'left alt': ALT, 'right alt': ALT, 'alt gr': ALT,
+        'win': WIN, 'windows': WIN, 'left windows': WIN, 'right windows': WIN,
+    }
+
+    # 修饰键扫描码（Set 1，keyboard 库在 Windows 上报告的值）-> 掩码位
+    MODIFIER_SCAN_CODES = {29: CTRL, 42: SHIFT, 54: SHIFT, 56: ALT, 91: WIN, 92: WIN}
+
+    _HOTKEY_SPLIT_RE = re.compile(r'\+(?=.)')  # 末尾的 + 是按键本身（例如 "小键盘加"）
+
+    def __init__(self):
+        # (扫描码, 掩码) -> (按下回调, 松开回调)
+        self.table: Dict[Tuple[int, int], Tuple[Callable[[], None], Optional[Callable[[], None]]]] = {}
+        # 扫描码 -> (修饰键掩码位, {掩码: 绑定})，由 bind 维护，dispatch 只读这一张表
+        self._routes: Dict[int, Tuple[int, Dict[int, Tuple[Callable[[], None], Optional[Callable[[], None]]]]]] = {}
+        self._reset_routes()
+        self.modifiers = 0                        # 当前按住的修饰键掩码
+        self._held_modifiers: Dict[int, int] = {}  # 按住的修饰键扫描码 -> 掩码位
+        # 按住中的绑定键：扫描码 -> (命中的绑定, 最近一次按下的时间)
+        self._active: Dict[int, Tuple[Tuple[Callable[[], None], Optional[Callable[[], None]]], float]] = {}
+        self._hook: Optional[Callable] = None
+        self.callbacks = 0                        # 已执行的回调次数
+        self.slowest_callback = 0.0               # 单次回调的最长耗时（秒），回调阻塞期间钩子收不到任何按键
+
+    def _reset_routes(self) -> None:
+        """只保留修饰键的路由"""
+        self._routes = {code: (bit, {}) for code, bit in self.MODIFIER_SCAN_CODES.items()}
+
+    def parse_hotkey(self, hotkey: str) -> Tuple[Tuple[int, ...], int]:
+        """解析热键字符串为 (扫描码, 修饰键掩码)，无法识别时抛出 ValueError"""
+        *modifier_names, key = self._HOTKEY_SPLIT_RE.split(hotkey.strip().lower())
+        mask = 0
+        for name in modifier_names:
+            bit = self.MODIFIER_NAMES.get(name.strip())
+            if bit is None:
+                raise ValueError(hotkey)
+            mask |= bit
+        codes = key_resolver.scan_codes(key.strip())
+        if not codes:
+            raise ValueError(hotkey)
+        return codes, mask
+
+    def bind(self, hotkey: str, on_press: Callable[[], None],
+             on_release: Optional[Callable[[], None]] = None) -> List[Tuple[int, int]]:
+        """绑定热键
+
+        Returns:
+            分发表中的键（用于 unbind）；热键无法识别时返回空列表
+        """
+        try:
+            codes, mask = self.parse_hotkey(hotkey)
+        except ValueError:
+            log.warning(_msg('warn_unknown_hotkey', hotkey))
             return []
+        binding = (on_press, on_release)
+        # 绑定修饰键本身时（例如 "shift"），它的扫描码也要更新修饰键掩码
+        bit = self.MODIFIER_NAMES.get(self._HOTKEY_SPLIT_RE.split(hotkey.strip().lower())[-1].strip(), 0)
+        keys = [(code, mask) for code in codes]
+        for code, mask in keys:
+            self.table[(code, mask)] = binding
+            route = self._routes.get(code)
+            if route is None:
+                route = self._routes[code] = (self.MODIFIER_SCAN_CODES.get(code, bit), {})
+            route[1][mask] = binding
+        return keys
+
+    def unbind(self, keys: Sequence[Tuple[int, int]]) -> None:
+        """移除 bind 返回的绑定（扫描码的路由保留，按住中的键松开时仍能正确处理）"""
+        for code, mask in keys:
+            self.table.pop((code, mask), None)
+            route = self._routes.get(code)
+            if route is not None:
+                route[1].pop(mask, None)
+
+    def clear(self) -> None:
+        """移除所有绑定并重置状态"""
+        self.table.clear()
+        self._reset_routes()
+        self.reset_state()
+
+    def reset_state(self) -> None:
+        """重置修饰键和按键状态（例如按键事件可能丢失之后）"""
+        self.modifiers = 0
+        self._held_modifiers.clear()
+        self._active.clear()
+
+    def install(self) -> None:
+        """安装全局键盘钩子"""
+        if self._hook is None:
+            self._hook = keyboard.hook(self.dispatch)
+
+    def uninstall(self) -> None:
+        """移除全局键盘钩子"""
+        if self._hook is not None:
+            try:
+                keyboard.unhook(self._hook)
+            except (KeyError, ValueError):
+                pass  # 已被 unhook_all 移除
+            self._hook = None
+
+    def dispatch(self, event: Any) -> None:
+        """处理一个键盘事件（keyboard 钩子回调）"""
+        code = event.scan_code
+        route = self._routes.get(code)
+        if route is None:
+            bit = self.MODIFIER_NAMES.get(event.name or '')
+            if bit is None:
+                return  # 没有绑定的普通键
+            route = self._routes[code] = (bit, {})  # 记住按名称识别出的修饰键扫描码
+        bit, bindings = route
+
+        if event.event_type == 'down':
+            now = event.time
+            active = self._active.get(code)
+            if active is not None and now - active[1] < Config.HOTKEY_REPEAT_WINDOW:
+                # 自动重复：有松开回调的绑定只在第一次按下时触发
+                binding = active[0]
+                self._active[code] = (binding, now)
+                if binding[1] is None:
+                    self._call(binding[0])
+                return
+
+            if bit:
+                mask = self.modifiers & ~bit
+                self._held_modifiers[code] = bit
+                self.modifiers |= bit
+            else:
+                mask = self.modifiers
+            binding = bindings.get(mask)
+            if binding is None and mask:
+                binding = bindings.get(0)
+            if binding is not None:
+                self._active[code] = (binding, now)
+                self._call(binding[0])
+            elif active is not None:
+                del self._active[code]
+        else:
+            if bit and self._held_modifiers.pop(code, None) is not None:
+                modifiers = 0
+                for held in self._held_modifiers.values():
+                    modifiers |= held
+                self.modifiers = modifiers
+            active = self._active.pop(code, None)
+            if active is not None and active[0][1] is not None:
+                self._call(active[0][1])
+
+    def _call(self, callback: Callable[[], None]) -> None:
+        start = time.perf_counter()
+        try:
+            callback()
+        except Exception as e:
+            log.error(_msg('warn_error', e))
+        elapsed = time.perf_counter() - start
+        self.callbacks += 1
+        if elapsed > self.slowest_callback:
+            self.slowest_callback = elapsed
+
+
+class HeldKeyState:
+    """触发键的按住状态 - 按预先分配的键 ID 索引的字节数组
+
+    键盘钩子线程按下/松开时只做一次单字节赋值，执行线程的"按住时"检查只读一个字节，两边都不加锁。
+    这依赖 CPython 的实现：GIL 保证 bytearray 单个元素的读写不会被打断；换到没有 GIL 的解释器
+    （例如自由线程构建）时需要重新加锁。
+    只有为新的键分配 ID 时加锁（注册热键时，不在热路径上）；数组原地增长，已取得的引用始终有效。
+
+    这样做只为消除尾延迟：加锁时钩子线程持锁期间被切换出去，检查会阻塞数毫秒；
+    平均吞吐量与加锁方式基本相同。
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}   # 键名（小写）-> ID
+        self.states = bytearray()       # ID -> 是否按住
+        self._lock = threading.Lock()
+
+    def key_id(self, key: str) -> int:
+        """键名对应的 ID（不存在时分配）"""
+        key = key.lower()
+        key_id = self.ids.get(key)
+        if key_id is None:
+            with self._lock:
+                key_id = self.ids.get(key)
+                if key_id is None:
+                    key_id = len(self.states)
+                    self.states.append(0)
+                    self.ids[key] = key_id
+        return key_id
+
+    def press(self, key_id: int) -> None:
+        self.states[key_id] = 1
+
+    def release(self, key_id: int) -> None:
+        self.states[key_id] = 0
+
+    def is_held(self, key_id: int) -> bool:
+        return self.states[key_id] != 0
+
+    def held(self) -> List[str]:
+        """当前按住的键名"""
+        states = self.states
+        return [key for key, key_id in self.ids.items() if states[key_id]]
+
+    def release_keys(self, keys: Iterable[str]) -> None:
+        """把指定的键标记为松开"""
+        for key in keys:
+            key_id = self.ids.get(key.lower())
+            if key_id is not None:
+                self.states[key_id] = 0
+
+    def clear(self) -> None:
+        """把所有键标记为松开"""
+        self.states[:] = bytes(len(self.states))
+
+
+# ========================================
+# 输入录制
+# ========================================
+class InputRecorder:
+    """输入录制器 - 把键盘/鼠标事件记录为文本格式的宏段
+
+    钩子回调只取一个序号、写入一个 (时间, 种类, 名称) 元组到预分配的缓冲区，
+    转换（配对、量化、合并延迟、截短空闲）在录制结束后进行。
+    也可以用 feed() 注入合成事件。
+    """
+
+    KEY_DOWN = 0
+    KEY_UP = 1
+    BUTTON_DOWN = 2
+    BUTTON_UP = 3
+
+    # 鼠标库的按钮名 -> 文本格式的单击指令
+    CLICK_WORDS = {'left': '左键', 'right': '右键', 'middle': '中键',
+                   'x': '侧键1', 'x1': '侧键1', 'x2': '侧键2'}
+    # 左右不分的修饰键
+    KEY_ALIASES = {'right shift': 'shift', 'right ctrl': 'ctrl', 'right alt': 'alt',
+                   'alt gr': 'alt', 'left windows': 'win', 'right windows': 'win'}
+    # 文本格式中有特殊含义、不能作为按键名的符号
+    RESERVED_KEYS = {'#', '=', ',', '、'}
+
+    def __init__(self, capacity: int = 0, ignore_keys: Iterable[str] = (),
+                 clock: Callable[[], float] = time.perf_counter):
+        self.capacity = capacity or Config.RECORD_CAPACITY
+        self.clock = clock
+        self.ignore_keys = {key.lower() for key in ignore_keys}  # 例如录制热键本身
+        self.slots: List[Optional[Tuple[float, int, str]]] = [None] * self.capacity
+        self._seq = itertools.count()
+        self.recording = False
+        self._hooks: List[Any] = []
+        # 含空格的按键名只能用中文别名写入文本格式
+        self.key_words = {}
+        for word, key in LanguageMapping.ZH_CN.items():
+            if ' ' in key:
+                self.key_words.setdefault(key, word)
+
+    def on_key(self, event: Any) -> None:
+        """keyboard 钩子回调"""
+        i = next(self._seq)
+        if i < self.capacity:
+            self.slots[i] = (self.clock(), self.KEY_DOWN if event.event_type == 'down' else self.KEY_UP,
+                             event.name)
+
+    def on_mouse(self, event: Any) -> None:
+        """mouse 钩子回调（只记录按钮事件）"""
+        button = getattr(event, 'button', None)  # 移动和滚轮事件没有 button
+        if button is None:
+            return
+        i = next(self._seq)
+        if i < self.capacity:
+            self.slots[i] = (self.clock(), self.BUTTON_UP if event.event_type == 'up' else self.BUTTON_DOWN,
+                             button)
+
+    def feed(self, events: Iterable[Tuple[float, int, str]]) -> None:
+        """写入合成事件 (时间, 种类, 名称)"""
+        slots, capacity = self.slots, self.capacity
+        for event in events:
+            i = next(self._seq)
+            if i < capacity:
+                slots[i] = event
+
+    def clear(self) -> None:
+        """清空缓冲区"""
+        self.slots = [None] * self.capacity
+        self._seq = itertools.count()
+
+    def start(self) -> None:
+        """安装键盘和鼠标钩子并开始录制"""
+        self.clear()
+        self.recording = True
+        self._hooks = [keyboard.hook(self.on_key), self.on_mouse]
+        mouse.hook(self.on_mouse)
+
+    def stop(self) -> None:
+        """移除钩子并结束录制"""
+        if self._hooks:
+            keyboard.unhook(self._hooks[0])
+            mouse.unhook(self._hooks[1])
+            self._hooks = []
+        self.recording = False
+
+    def events(self) -> List[Tuple[float, int, str]]:
+        """已录制的事件（按时间排序）"""
+        return sorted(slot for slot in self.slots if slot is not None)
+
+    def build_actions(self) -> Tuple[List[Tuple[Any, ...]], List[str]]:
+        """把事件转换为动作列表
+
+        Returns:
+            ([(类型, 开始时间, 名称, 时长)], 无法写入文本格式而跳过的按键名)
+            类型为 press / hold / keydown / keyup / click
+        """
+        events = []
+        skipped: List[str] = []
+        held = set()
+        for t, kind, name in self.events():
+            name = (name or '').lower()
+            if kind <= self.KEY_UP:
+                name = self.KEY_ALIASES.get(name, name)
+            is_down = kind in (self.KEY_DOWN, self.BUTTON_DOWN)
+            if is_down and (kind, name) in held:
+                continue  # 按住时的系统自动重复不是新的按下
+            if is_down:
+                held.add((kind, name))
+            else:
+                held.discard((kind - 1, name))
+            if kind <= self.KEY_UP:
+                if not name or name in self.ignore_keys:
+                    continue
+                if name in self.RESERVED_KEYS or (' ' in name and name not in self.key_words):
+                    if name not in skipped:
+                        skipped.append(name)
+                    continue
+            elif name not in self.CLICK_WORDS:
+                continue
+            events.append((t, kind, name))
 
-    def _parse_xml_syntax(self, syntax: str) -> List[Dict[str, Any]]:
-        """解析 XML 格式的按键语法（简单直接）"""
         actions = []
+        pending: Dict[Tuple[bool, str], int] = {}  # (是否鼠标, 名称) -> 按下事件的下标
+        for index, (t, kind, name) in enumerate(events):
+            is_mouse = kind >= self.BUTTON_DOWN
+            key = (is_mouse, name)
+            if kind in (self.KEY_DOWN, self.BUTTON_DOWN):
+                pending[key] = index
+                continue
+            down = pending.pop(key, None)
+            if down is None:
+                continue  # 录制开始前就已按下
+            t_down = events[down][0]
+            duration = t - t_down
+            overlapped = index - down > 1  # 按下和松开之间有其他事件
+            if is_mouse:
+                actions.append(('click', t_down, name, 0.0))
+            elif not overlapped and duration < Config.RECORD_TAP_THRESHOLD:
+                actions.append(('press', t_down, name, 0.0))
+            elif not overlapped:
+                actions.append(('hold', t_down, name, duration))
+            else:
+                actions.append(('keydown', t_down, name, 0.0))
+                actions.append(('keyup', t, name, 0.0))
 
-        for line in syntax.strip().split('\n'):
-            parts = line.strip().split()
-            if not parts or len(parts) < 2:
+        # 录制结束时仍按住的键记为一次按下
+        for (is_mouse, name), down in pending.items():
+            actions.append(('click' if is_mouse else 'press', events[down][0], name, 0.0))
+        actions.sort(key=lambda action: action[1])
+        return actions, skipped
+
+    def _word(self, name: str) -> str:
+        """按键名在文本格式中的写法"""
+        return self.key_words.get(name, name)
+
+    def to_text(self, name: str, trigger_key: str = '') -> Tuple[str, Dict[str, int]]:
+        """生成文本格式的宏段
+
+        延迟按 RECORD_QUANTUM 量化，量化误差不累积（按相对录制起点的目标时间计算）；
+        相邻动作之间只产生一条合并后的等待，为零的等待不写出，
+        超过 RECORD_IDLE_GAP 的空闲截短，开头和结尾的空闲去掉。
+
+        Returns:
+            (文本, 统计 {events, actions, waits, skipped})
+        """
+        actions, skipped = self.build_actions()
+        quantum = Config.RECORD_QUANTUM
+        lines = [f'[{name}]']
+        if trigger_key:
+            lines.append(f'触发键 = {trigger_key}')
+        lines.append('动作 =')
+
+        waits = 0
+        emitted = 0.0  # 已写出的时间线长度
+        removed = 0.0  # 被截短的空闲时间
+        origin = actions[0][1] if actions else 0.0
+        for action_type, start, key, duration in actions:
+            gap = start - origin - removed - emitted
+            if gap > Config.RECORD_IDLE_GAP:
+                removed += gap - Config.RECORD_IDLE_GAP
+                gap = Config.RECORD_IDLE_GAP
+            wait = round(gap / quantum) * quantum
+            if wait > 0:
+                lines.append(f'  等待 {round(wait * 1000)}ms')
+                emitted += wait
+                waits += 1
+
+            if action_type == 'press':
+                lines.append(f'  按下 {self._word(key)}')
+                emitted += Config.KEY_PRESS_INTERVAL  # 引擎在每次按下后等待按键间隔
+            elif action_type == 'hold':
+                hold = max(quantum, round(duration / quantum) * quantum)
+                lines.append(f'  hold {self._word(key)} {round(hold * 1000)}ms')
+                emitted += hold
+            elif action_type == 'keydown':
+                lines.append(f'  按住 {self._word(key)}')
+            elif action_type == 'keyup':
+                lines.append(f'  松开 {self._word(key)}')
+            else:
+                lines.append(f'  {self.CLICK_WORDS[key]}')
+
+        stats = {'events': sum(1 for slot in self.slots if slot is not None),
+                 'actions': len(actions), 'waits': waits, 'skipped': len(skipped)}
+        if skipped:
+            log.warning(_msg('warn_record_skipped', ', '.join(skipped)))
+        return '\n'.join(lines) + '\n', stats
+
+
+# ========================================
+# 输入缓冲
+# ========================================
+class InputScheduler:
+    """输入缓冲调度器 - 决定通道忙时新触发的宏是中断、排队还是忽略
+
+    每个宏可以配置：
+        priority        优先级，队列中优先级高的先执行（同优先级先进先出）
+        buffer_policy   auto（默认，快速连按才排队，否则中断）/ preempt / queue / ignore
+        buffer_expiry   排队请求的有效期，过期未执行的请求直接丢弃
+        rapid_threshold auto 策略的连按阈值
+    同一个宏的重复请求合并为一条（有效期从最后一次按下算起）；
+    队列写满时淘汰已过期的请求，再淘汰优先级最低中最早的一条，新请求优先级更低时才被拒绝。
+    时钟可以替换为虚拟时钟，用于确定性的测试。
+    """
+
+    AUTO = 'auto'
+    PREEMPT = 'preempt'
+    QUEUE = 'queue'
+    IGNORE = 'ignore'
+    POLICIES = Macro.BUFFER_POLICIES
+
+    # admit() 的结果
+    START = 'start'        # 立即启动（中断同一通道的当前宏）
+    QUEUED = 'queued'      # 已进入队列（或与已有请求合并）
+    DROPPED = 'dropped'    # 被忽略或队列已满
+
+    def __init__(self, capacity: int = 0, clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity or Config.INPUT_BUFFER_SIZE
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries: List[Tuple[int, int, float, Macro]] = []  # (优先级, 序号, 过期时间, 宏)
+        self.last_start: Dict[str, float] = {}  # 宏名称 -> 最近一次启动时间
+        self._seq = itertools.count()
+        self.stats = {'started': 0, 'queued': 0, 'coalesced': 0, 'expired': 0,
+                      'evicted': 0, 'rejected': 0, 'ignored': 0}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def admit(self, macro: Macro, busy: bool) -> str:
+        """处理一次触发
+
+        Args:
+            macro: 被触发的宏
+            busy: 宏所在的通道是否正在执行
+
+        Returns:
+            START / QUEUED / DROPPED
+        """
+        now = self.clock()
+        with self.lock:
+            if busy:
+                policy = macro.buffer_policy
+                if policy == self.AUTO:
+                    # "按住时"模式立即中断；其他模式只有快速连按才排队（避免误触）
+                    threshold = macro.rapid_threshold
+                    if threshold is None:
+                        threshold = Config.RAPID_PRESS_THRESHOLD
+                    last = self.last_start.get(macro.name)
+                    rapid = last is not None and now - last < threshold
+                    policy = self.QUEUE if rapid and macro.repeat_mode != 'hold' else self.PREEMPT
+                if policy == self.IGNORE:
+                    self.stats['ignored'] += 1
+                    return self.DROPPED
+                if policy == self.QUEUE:
+                    return self._push(macro, now)
+
+            self.last_start[macro.name] = now
+            self.stats['started'] += 1
+            return self.START
+
+    def _push(self, macro: Macro, now: float) -> str:
+        """加入队列（调用方持有锁）"""
+        entries = self.entries
+        priority = macro.priority
+        expiry = macro.buffer_expiry
+        deadline = now + (Config.INPUT_BUFFER_EXPIRY if expiry is None else expiry)
+
+        for i, (_, seq, _, queued) in enumerate(entries):
+            if queued is macro:
+                entries[i] = (priority, seq, deadline, macro)
+                self.stats['coalesced'] += 1
+                return self.QUEUED
+
+        if len(entries) >= self.capacity:
+            self._expire(now)
+        if len(entries) >= self.capacity:
+            victim = min(entries, key=lambda entry: (entry[0], entry[1]))
+            if victim[0] > priority:
+                self.stats['rejected'] += 1
+                return self.DROPPED
+            entries.remove(victim)
+            self.stats['evicted'] += 1
+
+        entries.append((priority, next(self._seq), deadline, macro))
+        self.stats['queued'] += 1
+        return self.QUEUED
+
+    def _expire(self, now: float) -> None:
+        """丢弃过期的请求（调用方持有锁）"""
+        live = [entry for entry in self.entries if entry[2] >= now]
+        self.stats['expired'] += len(self.entries) - len(live)
+        self.entries[:] = live
+
+    def pop(self, channel_name: str) -> Optional[Macro]:
+        """取出某通道中优先级最高（同优先级最早）的未过期请求"""
+        now = self.clock()
+        with self.lock:
+            self._expire(now)
+            best = None
+            for entry in self.entries:
+                if MacroEngine.channel_name(entry[3]) != channel_name:
+                    continue
+                if best is None or (entry[0], -entry[1]) > (best[0], -best[1]):
+                    best = entry
+            if best is None:
+                return None
+            self.entries.remove(best)
+            self.last_start[best[3].name] = now
+            self.stats['started'] += 1
+            return best[3]
+
+    def retain(self, keep: Callable[[Macro], bool]) -> None:
+        """只保留 keep(宏) 为 True 的请求（重载后丢弃已失效的宏）"""
+        with self.lock:
+            self.entries[:] = [entry for entry in self.entries if keep(entry[3])]
+
+    def clear(self) -> None:
+        """清空队列"""
+        with self.lock:
+            self.entries.clear()
+
+
+# ========================================
+# 宏运行器
+# ========================================
+class MacroExecutor:
+    """常驻宏执行线程 - 在一个线程上复用所有执行通道
+
+    热键回调只投递命令。每个通道是一条独立的时间线（宏的步进生成器），执行线程
+    等到所有通道中最早的截止时间，推进到期的通道，多个宏同时运行也只占用这一个线程：
+        START   - 在该通道之前的宏之后执行
+        PREEMPT - 立即中断该通道的当前宏（独占宏中断所有通道），然后执行新宏
+        STOP    - 立即中断宏所在的通道（未指定宏时中断所有通道）
+    PREEMPT / STOP 会使这些通道中之前投递但尚未开始执行的命令失效；
+    以 follow_up 方式投递的命令与该通道的当前宏属于同一代，会随当前宏一起失效。
+    """
+
+    START = 'start'
+    PREEMPT = 'preempt'
+    STOP = 'stop'
+    SHUTDOWN = 'shutdown'
+
+    def __init__(self, engine: MacroEngine,
+                 run_macro: Callable[[Macro, MacroChannel], Iterator[None]]):
+        """
+        Args:
+            engine: 宏引擎
+            run_macro: 返回宏在通道上的步进生成器，每次 yield 后执行线程等到通道的截止时间
+        """
+        self.engine = engine
+        self.run_macro = run_macro
+        self.lock = threading.Lock()
+        self.wake = engine.wake                # 投递命令或任一通道被取消时置位
+        self.generations: Dict[str, int] = {}  # 通道 -> 代（每次 PREEMPT / STOP 递增）
+        self.running_generations: Dict[str, int] = {}  # 通道 -> 正在执行的命令所属的代
+        self.pending: Dict[str, deque] = {}    # 通道 -> 等待执行的 (宏, 代)
+        self.active: List[MacroChannel] = []   # 正在执行的通道（只由执行线程修改）
+        self.shutting_down = False
+        self.idle = threading.Event()          # 没有宏在执行时置位
+        self.idle.set()
+        self.idle_listeners: List[Callable[[bool], None]] = []  # 空闲状态变化时调用（参数为是否空闲）
+        self.thread = threading.Thread(target=self._run, name='MacroExecutor', daemon=True)
+        self.thread.start()
+
+    def submit(self, command: str, macro: Optional[Macro] = None,
+               follow_up: bool = False) -> None:
+        """投递命令（不阻塞）
+
+        Args:
+            command: START / PREEMPT / STOP / SHUTDOWN
+            macro: 要执行的宏
+            follow_up: 作为该通道当前宏的后续命令投递（仅用于 START）
+        """
+        engine = self.engine
+        with self.lock:
+            if command == self.SHUTDOWN:
+                self.shutting_down = True
+            else:
+                name = engine.get_channel(engine.channel_name(macro)).name if macro else None
+                if follow_up:
+                    generation = self.running_generations.get(name, 0)
+                else:
+                    if command != self.START:
+                        if macro is None or (command == self.PREEMPT and macro.exclusive):
+                            names = list(engine.channels)
+                        else:
+                            names = [name]
+                        for target in names:
+                            self.generations[target] = self.generations.get(target, 0) + 1
+                            channel = engine.channels[target]
+                            if channel.running:
+                                channel.cancel_token.cancel()
+                    generation = self.generations.get(name, 0)
+                if command != self.STOP and macro is not None:
+                    self.pending.setdefault(name, deque()).append((macro, generation))
+        self.wake.set()
+
+    def is_busy(self, channel_name: str) -> bool:
+        """通道是否正在执行宏"""
+        channel = self.engine.channels.get(channel_name)
+        return channel is not None and channel.running
+
+    def active_macros(self) -> List[Macro]:
+        """正在执行的宏"""
+        return [macro for macro in (channel.macro for channel in list(self.active))
+                if macro is not None]
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """中断所有通道并等待执行线程空闲
+
+        Returns:
+            True 表示在超时前已空闲
+        """
+        self.submit(self.STOP)
+        return self.idle.wait(timeout)
+
+    def shutdown(self) -> None:
+        """停止执行线程"""
+        self.submit(self.SHUTDOWN)
+
+    def _run(self) -> None:
+        """执行线程主循环"""
+        active = self.active
+        clock = time.perf_counter
+        wait_until = TimingScheduler.wait_until
+        while True:
+            self.wake.clear()
+            for channel in [channel for channel in active if channel.cancel_token.is_set()]:
+                self._finish(channel)
+
+            with self.lock:
+                if self.shutting_down:
+                    break
+                started = self._start_pending()
+                if not active and not started:
+                    self._set_idle(True)
+            for channel in started:
+                active.append(channel)
+                self._step(channel)  # 执行到第一个等待点
+
+            if not active:
+                self.wake.wait()  # 空闲时阻塞，直到投递新命令
                 continue
 
-            cmd, *args = parts
+            # 等到最早的截止时间；期间投递的命令或取消请求会立即唤醒
+            if wait_until(min(channel.scheduler.deadline for channel in active), self.wake) is None:
+                continue
+            now = clock()
+            for channel in active[:]:
+                scheduler = channel.scheduler
+                if scheduler.deadline <= now:
+                    scheduler.arrive()
+                    self._step(channel)
+
+        for channel in active[:]:
+            channel.cancel_token.cancel()
+            self._finish(channel)
+        self._set_idle(True)
+
+    def _start_pending(self) -> List[MacroChannel]:
+        """在空闲的通道上开始等待中的宏（持有锁时调用）"""
+        started = []
+        for name, pending in self.pending.items():
+            channel = self.engine.channels[name]
+            if channel.running:
+                continue
+            while pending:
+                macro, generation = pending.popleft()
+                if generation != self.generations.get(name, 0):
+                    continue  # 已被之后的 PREEMPT / STOP 取代
+                # 在锁内创建取消令牌并标记运行状态，之后的停止请求一定能作用于本次执行
+                self.engine.begin(channel, macro, CancelToken(self.wake))
+                self.running_generations[name] = generation
+                channel.steps = self.run_macro(macro, channel)
+                started.append(channel)
+                break
+        if started:
+            self._set_idle(False)
+        return started
+
+    def _set_idle(self, idle: bool) -> None:
+        """更新空闲状态，变化时通知监听器"""
+        if idle == self.idle.is_set():
+            return
+        if idle:
+            self.idle.set()
+        else:
+            self.idle.clear()
+        for listener in self.idle_listeners:
+            listener(idle)
 
-            if cmd in ('KeyDown', 'KeyUp'):
-                key = self.engine.parse_key_code(int(args[0]))
-                if key:
-                    action_type = 'keydown' if cmd == 'KeyDown' else 'keyup'
-                    actions.append({'type': action_type, 'key': key})
+    def _step(self, channel: MacroChannel) -> None:
+        """推进通道到下一个等待点，宏结束时收尾"""
+        try:
+            next(channel.steps)
+            return
+        except StopIteration:
+            pass
+        except Exception as e:
+            log.error(_msg('warn_error', e))
+        self._finish(channel)
 
-            elif cmd == 'Delay':
-                actions.append({'type': 'delay', 'duration': int(args[0]) / 1000})
+    def _finish(self, channel: MacroChannel) -> None:
+        """结束通道上的宏（被中断时关闭生成器会释放该通道按住的键）"""
+        self.active.remove(channel)
+        try:
+            channel.steps.close()
+        except Exception as e:
+            log.error(_msg('warn_error', e))
+        channel.steps = None
+        self.engine.end(channel)
 
-            elif cmd == 'LeftDown':
-                actions.append({'type': 'click', 'button': 'left'})
 
-            elif cmd == 'RightDown':
-                actions.append({'type': 'click', 'button': 'right'})
+class LoopWake:
+    """事件循环的唤醒对象 - 与 threading.Event.set() 同接口，可在任意线程调用"""
 
-        return actions
+    def __init__(self, loop: asyncio.AbstractEventLoop, callback: Callable[[], None]):
+        self.loop = loop
+        self.callback = callback
 
-    def load_file(self, filepath: str) -> List[Dict[str, Any]]:
-        """加载配置文件"""
+    def set(self) -> None:
+        """在事件循环线程中调用回调"""
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            self.loop.call_soon_threadsafe(self.callback)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+
+class AsyncMacroExecutor(MacroExecutor):
+    """asyncio 宏执行器 - 每个运行中的宏是事件循环中的一个任务
+
+    命令语义与 MacroExecutor 相同。热键回调投递的命令和取消请求经
+    call_soon_threadsafe 交给事件循环线程；延迟由事件循环定时器完成，
+    只有截止时间前 TIMING_SPIN_THRESHOLD 内以让出循环的方式自旋；
+    停止时直接取消任务，不需要轮询取消令牌。
+    定时精度取决于事件循环定时器的精度（Windows 上受系统计时精度限制）。
+    """
+
+    def __init__(self, engine: MacroEngine,
+                 run_macro: Callable[[Macro, MacroChannel], Iterator[None]]):
+        self.loop = asyncio.new_event_loop()
+        self.tasks: Dict[str, asyncio.Task] = {}  # 通道 -> 正在执行的任务（只由事件循环线程访问）
+        super().__init__(engine, run_macro)
+        self.wake = LoopWake(self.loop, self._schedule)
+
+    def _run(self) -> None:
+        """事件循环线程"""
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _schedule(self) -> None:
+        """处理取消请求并启动等待中的宏（在事件循环线程中运行）"""
+        for name, task in list(self.tasks.items()):
+            if self.engine.channels[name].cancel_token.is_set():
+                task.cancel()
+
+        with self.lock:
+            shutting_down = self.shutting_down
+            started = [] if shutting_down else self._start_pending()
+            if not self.tasks and not started:
+                self._set_idle(True)
+
+        if shutting_down:
+            for name, task in self.tasks.items():
+                self.engine.channels[name].cancel_token.cancel()
+                task.cancel()
+            if not self.tasks:
+                self.loop.stop()
+            return
+
+        for channel in started:
+            self.active.append(channel)
+            self.tasks[channel.name] = self.loop.create_task(self._drive(channel))
 
-            # 判断文件格式
-            return (self.parse_xml_format(content) if content.strip().startswith('<')
-                    else self.parse_text_format(content))
+    async def _drive(self, channel: MacroChannel) -> None:
+        """推进通道的步进生成器，每一步等到通道的截止时间"""
+        scheduler = channel.scheduler
+        clock = scheduler.clock
+        spin = Config.TIMING_SPIN_THRESHOLD
+        try:
+            for _ in channel.steps:
+                remaining = scheduler.deadline - clock()
+                if remaining > spin:
+                    await asyncio.sleep(remaining - spin)
+                # 截止时间已到也至少让出一次，其他宏和投递的命令不会被饿死
+                await asyncio.sleep(0)
+                while scheduler.deadline > clock():
+                    await asyncio.sleep(0)
+                scheduler.arrive()
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            log.error(_msg('load_file_failed', e))
-            return []
+            log.error(_msg('warn_error', e))
+        finally:
+            del self.tasks[channel.name]
+            self._finish(channel)
+            self._schedule()
+
+
+def create_executor(engine: MacroEngine,
+                    run_macro: Callable[[Macro, MacroChannel], Iterator[None]],
+                    name: str = '') -> MacroExecutor:
+    """按名称创建宏执行器（默认使用 Config.EXECUTOR）"""
+    executors = {
+        'thread': MacroExecutor,
+        'asyncio': AsyncMacroExecutor,
+    }
+    return executors.get(name or Config.EXECUTOR, MacroExecutor)(engine, run_macro)
+
+
+class ControlWorker:
+    """控制命令线程 - 热键回调只投递命令并立即返回
+
+    耗时的控制操作（等待宏停止后释放按键、重载配置、打印和导出报告、写录制文件、退出）
+    在这个线程上按投递顺序执行，钩子线程不会因此错过触发键、松开或 Esc。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: deque = deque()  # 等待执行的 (命令, 参数)
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='ControlWorker', daemon=True)
+        self.thread.start()
+
+    def post(self, command: Callable[..., Any], *args: Any) -> None:
+        """投递命令（不阻塞）"""
+        with self.lock:
+            self.pending.append((command, args))
+        self.wake.set()
+
+    def stop(self) -> None:
+        """执行完已投递的命令后结束线程"""
+        self.post(None)
+
+    def _run(self) -> None:
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            while True:
+                with self.lock:
+                    if not self.pending:
+                        break
+                    command, args = self.pending.popleft()
+                if command is None:
+                    return
+                try:
+                    command(*args)
+                except Exception as e:
+                    log.error(_msg('warn_error', e))
 
 
 class MacroRunner:
-    """宏运行器 - 负责热键监听和宏执行"""
+    """宏运行器 - 负责热键监听和宏执行
 
-    def __init__(self, config_file: str, target_window_names: Optional[List[str]] = None):
+    热键回调只做立即生效且不阻塞的部分（修改状态、向执行线程投递命令），
+    其余控制操作投递给 ControlWorker。
+    """
+
+    def __init__(self, config_file: str, target_window_names: Optional[List[str]] = None,
+                 window_source: Optional[WindowSource] = None,
+                 watch_config: Optional[bool] = None, defer_load: bool = False,
+                 executor: str = '', trace: Optional[bool] = None, trace_file: Optional[str] = None,
+                 record_file: Optional[str] = None):
         """
         初始化宏运行器
 
         Args:
             config_file: 配置文件路径
             target_window_names: 目标窗口名称列表（如 ['Diablo IV']），None 表示不限制窗口
+            window_source: 前台窗口信息来源，默认使用 pywin32
+            watch_config: 保存配置文件后自动重载，默认 Config.CONFIG_WATCH_ENABLED
+            defer_load: 推迟到 start() 时加载配置，边解析边注册热键（大型宏库无需等待全部解析完成）
+            executor: 宏执行器（'thread' / 'asyncio'），默认 Config.EXECUTOR
+            trace: 启用延迟追踪，默认 Config.TRACE_ENABLED（指定 trace_file 时自动启用）
+            trace_file: 追踪报告的导出文件（.json / .csv），默认 Config.TRACE_EXPORT_FILE
+            record_file: 录制结果追加到的文件，默认 Config.RECORD_FILE
         """
-        self.window_monitor = WindowMonitor(target_window_names)
+        self.window_monitor = WindowMonitor(target_window_names, window_source)
         self.parser = MacroParser(self.window_monitor)
         self.engine = self.parser.engine
+        self.window_monitor.add_focus_lost_listener(self.engine.on_focus_lost)
         self.config_file = config_file
-        self.macros: List[Dict[str, Any]] = []
-        self.hotkey_map: Dict[str, Dict[str, Any]] = {}
-        self.current_thread: Optional[threading.Thread] = None
+        self.trace_file = trace_file if trace_file is not None else Config.TRACE_EXPORT_FILE
+        if trace is None:
+            trace = Config.TRACE_ENABLED
+        self.engine.tracer = (self.engine.tracer or LatencyTracer()) if trace or trace_file else None
+        self.record_file = record_file or Config.RECORD_FILE
+        self.recorder = InputRecorder(ignore_keys=[Config.HOTKEY_RECORD])
+        self.recordings = 0
+        self.macros: List[Macro] = []
+        self.hotkey_map: Dict[str, Macro] = {}
+        self.dispatcher = HotkeyDispatcher()
+        self.trigger_hooks: Dict[str, List[Tuple[int, int]]] = {}  # 触发键 -> 分发表中的绑定
+        self.reload_lock = threading.Lock()
+        self.executor = create_executor(self.engine, self._execute_macro_with_queue, executor)
+        self.control = ControlWorker()
         self.paused = False
 
+        # 只在有宏执行时跟踪窗口焦点，空闲时跟踪线程阻塞等待
+        self.executor.idle_listeners.append(lambda idle: self.window_monitor.set_tracking(not idle))
+        self.window_monitor.set_tracking(not self.executor.idle.is_set())
+
+        # 主线程阻塞等待退出请求（stop() 可在任意线程调用），清理完成后置位 stopped
+        self.shutdown_event = threading.Event()
+        self.stopped = threading.Event()
+
+        if watch_config is None:
+            watch_config = Config.CONFIG_WATCH_ENABLED
+        self.config_watcher = ConfigWatcher(config_file, self.reload_config) if watch_config else None
+
         # Esc 双击检测
         self.last_esc_time = 0
         self.esc_double_click_interval = Config.ESC_DOUBLE_CLICK_INTERVAL
@@ -968,9 +3794,8 @@ class MacroRunner:
         self.macro_additional_keys: Dict[str, List[str]] = {}
         self.additional_keys_lock = threading.Lock()
 
-        # 按键输入缓冲队列
-        self.input_buffer: deque = deque(maxlen=Config.INPUT_BUFFER_SIZE)
-        self.buffer_lock = threading.Lock()
+        # 按键输入缓冲调度
+        self.input_scheduler = InputScheduler()
 
         # 控制热键防抖 - 记录上次按下时间
         self.last_pause_time = 0
@@ -978,69 +3803,101 @@ class MacroRunner:
         self.last_exit_time = 0
         self.control_key_debounce = Config.CONTROL_KEY_DEBOUNCE
 
-        # 追踪每个宏最后一次触发时间（宏名称 -> 时间戳）
-        self.last_macro_trigger_time: Dict[str, float] = {}
-
         # 追踪当前按住的触发键（用于"按住时"模式的状态检查）
-        self.held_trigger_keys: set = set()
-        self.held_keys_lock = threading.Lock()
+        self.held_keys = HeldKeyState()
         self.current_hold_macro_name: Optional[str] = None
 
-        self.load_config()
+        self.defer_load = defer_load
+        if not defer_load:
+            self.load_config()
+
+    def load_config(self, register_hotkeys: bool = False) -> None:
+        """加载配置
 
-    def load_config(self) -> None:
-        """加载配置"""
-        self.macros = self.parser.load_file(self.config_file)
+        Args:
+            register_hotkeys: 每解析出一个宏就立即注册它的触发键（热键钩子已安装时使用）
+        """
+        self.macros = []
+        self.hotkey_map = {}
+        for macro in self.parser.iter_file(self.config_file):
+            self.macros.append(macro)
+            self._add_hotkey(macro, register_hotkeys)
 
         if not self.macros:
             log.warning(_msg('no_macros_found'))
             return
 
-        # 只显示总数，不显示每个宏的详细信息
-        log.success(f"加载 {len(self.macros)} 个宏", use_icon=False)
-
-        self._build_hotkey_map()
+        # 只显示总数和最高输入速率，不显示每个宏的详细信息；超出输入速率预算的宏单独警告
+        rate_text = MacroAnalyzer.rate_text
+        busiest = max(self.macros, key=lambda macro: (macro.timing['unbounded'],
+                                                      macro.timing['events_per_sec'] or 0))
+        log.success(f"加载 {len(self.macros)} 个宏  "
+                    f"{_msg('load_rate', rate_text(busiest.timing), busiest.name)}", use_icon=False)
+        for macro in MacroAnalyzer.over_budget(self.macros):
+            log.warning(_msg('warn_input_rate', macro.name, rate_text(macro.timing), Config.INPUT_RATE_BUDGET))
 
     def _build_hotkey_map(self) -> None:
         """构建热键映射"""
         self.hotkey_map = {}
         for macro in self.macros:
-            trigger_key = macro.get('trigger_key')
-            if not trigger_key:
-                continue
+            self._add_hotkey(macro)
+
+    def _add_hotkey(self, macro: Macro, register: bool = False) -> None:
+        """把宏加入热键映射（重复的触发键以后出现的宏为准）"""
+        trigger_key = macro.trigger_key
+        if not trigger_key:
+            return
 
-            trigger_key_lower = trigger_key.lower()
-            if trigger_key_lower in self.hotkey_map:
-                existing_macro = self.hotkey_map[trigger_key_lower]
-                log.warning(_msg('warn_duplicate_key', trigger_key))
-                log.warning(_msg('warn_key_override', existing_macro['name'], macro['name']))
+        trigger_key_lower = trigger_key.lower()
+        if trigger_key_lower in self.hotkey_map:
+            existing_macro = self.hotkey_map[trigger_key_lower]
+            log.warning(_msg('warn_duplicate_key', trigger_key))
+            log.warning(_msg('warn_key_override', existing_macro.name, macro.name))
+            if register:
+                self._unhook_trigger(trigger_key_lower)
 
-            self.hotkey_map[trigger_key_lower] = macro
+        self.hotkey_map[trigger_key_lower] = macro
+        if register:
+            self._hook_trigger(trigger_key_lower, macro)
 
     def setup_hotkeys(self) -> None:
-        """设置热键"""
+        """设置热键（所有热键共用一个全局键盘钩子）"""
         keyboard.unhook_all()
+        self.dispatcher.uninstall()
+        self.dispatcher.clear()
+        self.trigger_hooks = {}
 
-        # 系统热键 - 使用 on_press_key 确保最高优先级和可靠性
-        keyboard.on_press_key(Config.HOTKEY_EXIT, lambda _: self._handle_exit_key())
-        keyboard.on_press_key(Config.HOTKEY_RELOAD, lambda _: self._handle_reload_key())
-        keyboard.on_press_key(Config.HOTKEY_PAUSE, lambda _: self._handle_pause_key())
+        # 系统热键
+        self.dispatcher.bind(Config.HOTKEY_EXIT, self._handle_exit_key)
+        self.dispatcher.bind(Config.HOTKEY_RELOAD, self._handle_reload_key)
+        self.dispatcher.bind(Config.HOTKEY_PAUSE, self._handle_pause_key)
+        self.dispatcher.bind(Config.HOTKEY_TRACE, lambda: self.control.post(self.dump_trace))
+        self.dispatcher.bind(Config.HOTKEY_RECORD, lambda: self.control.post(self.toggle_recording))
 
         # 紧急停止热键（双击 Esc）
-        keyboard.on_press_key('esc', lambda _: self.emergency_stop())
+        self.dispatcher.bind('esc', self.emergency_stop)
 
         # 宏热键
         for key_str, macro in self.hotkey_map.items():
-            repeat_mode = macro.get('repeat_mode', 'once')
-            has_additional_keys = bool(macro.get('additional_keys'))
+            self._hook_trigger(key_str, macro)
 
-            # hold 模式或有附加按键的宏，需要监听释放事件
-            if repeat_mode == 'hold' or has_additional_keys:
-                keyboard.on_press_key(key_str, lambda _, m=macro: self._on_trigger_press(m))
-                keyboard.on_release_key(key_str, lambda _, m=macro: self._on_trigger_release(m))
-            else:
-                # 其他模式且无附加按键，直接启动
-                keyboard.on_press_key(key_str, lambda _, m=macro: self.start_macro(m))
+        self.dispatcher.install()
+
+    def _hook_trigger(self, key_str: str, macro: Macro) -> None:
+        """在分发表中绑定一个触发键"""
+        # hold 模式或有附加按键的宏，需要监听释放事件
+        if macro.repeat_mode == 'hold' or macro.additional_keys:
+            key_id = self.held_keys.key_id(macro.trigger_key or '')
+            bindings = self.dispatcher.bind(key_str, lambda m=macro, k=key_id: self._on_trigger_press(m, k),
+                                            lambda m=macro, k=key_id: self._on_trigger_release(m, k))
+        else:
+            # 其他模式且无附加按键，直接启动
+            bindings = self.dispatcher.bind(key_str, lambda m=macro: self.start_macro(m))
+        self.trigger_hooks[key_str] = bindings
+
+    def _unhook_trigger(self, key_str: str) -> None:
+        """从分发表中移除一个触发键"""
+        self.dispatcher.unbind(self.trigger_hooks.pop(key_str, []))
 
     def _handle_pause_key(self) -> None:
         """处理暂停热键"""
@@ -1054,7 +3911,7 @@ class MacroRunner:
         current_time = time.time()
         if current_time - self.last_reload_time > self.control_key_debounce:
             self.last_reload_time = current_time
-            self.reload_config()
+            self.control.post(self.reload_config)
 
     def _handle_exit_key(self) -> None:
         """处理退出热键"""
@@ -1063,193 +3920,271 @@ class MacroRunner:
             self.last_exit_time = current_time
             self.stop()
 
+    def dump_trace(self) -> None:
+        """打印热键回调耗时、每个宏的定时漂移与抖动和延迟追踪报告，并在配置了导出文件时导出"""
+        print(_msg('hook_stats', self.dispatcher.callbacks, self.dispatcher.slowest_callback * 1000))
+        self.print_timing_stats()
+        tracer = self.engine.tracer
+        if tracer is None:
+            log.warning(_msg('trace_disabled'))
+            return
+        report = tracer.report()
+        if not report:
+            print(_msg('trace_empty'))
+            return
+
+        def brief(stats: Dict[str, Any]) -> str:
+            if not stats['count']:
+                return '-'
+            return f"{stats['p50']:.2f} / {stats['p95']:.2f} / {stats['p99']:.2f}"
+
+        print(f"{Style.BRIGHT}{_msg('trace_title')}{Style.RESET_ALL}")
+        for name, metrics in report.items():
+            print(_msg('trace_row', name, brief(metrics['hook_to_start_ms']),
+                       brief(metrics['action_error_ms']), brief(metrics['stop_ms'])))
+        if self.trace_file:
+            self.export_trace()
+
+    def print_timing_stats(self) -> None:
+        """打印调度器统计的每个宏的漂移和抖动（不需要启用追踪）"""
+        stats = [(name, timing.to_dict()) for name, timing in list(self.engine.timing_stats.items())
+                 if timing.count]
+        if not stats:
+            return
+        print(f"{Style.BRIGHT}{_msg('drift_title')}{Style.RESET_ALL}")
+        for name, d in stats:
+            print(_msg('drift_row', name, d['waits'], d['mean_ms'], d['jitter_ms'], d['max_ms'],
+                       d['drift_ms'], d['resyncs']))
+
+    def export_trace(self) -> None:
+        """导出延迟追踪报告到 trace_file"""
+        try:
+            self.engine.tracer.export(self.trace_file)
+            log.success(_msg('trace_exported', self.trace_file), use_icon=False)
+        except OSError as e:
+            log.error(_msg('warn_error', e))
+
+    def toggle_recording(self) -> None:
+        """开始/结束录制（录制期间不触发宏），结束时把录制结果追加到 record_file"""
+        if not self.recorder.recording:
+            self._stop_current_macro()
+            self.recorder.start()
+            print(f"{Fore.MAGENTA}{_msg('record_start', Config.HOTKEY_RECORD)}{Style.RESET_ALL}")
+            return
+
+        self.recorder.stop()
+        self.recordings += 1
+        text, stats = self.recorder.to_text(f'录制 {self.recordings}')
+        if not stats['actions']:
+            print(_msg('record_empty'))
+            return
+        try:
+            with open(self.record_file, 'a', encoding='utf-8') as f:
+                f.write('\n' + text)
+            log.success(_msg('record_saved', stats['events'], stats['actions'], self.record_file),
+                        use_icon=False)
+        except OSError as e:
+            log.error(_msg('warn_error', e))
+
     def toggle_pause(self) -> None:
-        """切换暂停/恢复状态"""
+        """切换暂停/恢复状态（立即生效，提示和释放按键由控制线程完成）"""
         self.paused = not self.paused
 
         if self.paused:
-            print(f"{Fore.YELLOW}{_msg('pause_on')}{Style.RESET_ALL}")
             self._stop_current_macro()
             self.clear_input_buffer()  # 暂停时清空缓冲队列
-            self._force_release_all_keys()  # 强制释放所有按键
+            self.control.post(print, f"{Fore.YELLOW}{_msg('pause_on')}{Style.RESET_ALL}")
+            self.control.post(self._release_after_stop)  # 强制释放所有按键
         else:
-            print(f"{Fore.GREEN}{_msg('pause_off')}{Style.RESET_ALL}")
+            self.control.post(print, f"{Fore.GREEN}{_msg('pause_off')}{Style.RESET_ALL}")
 
     def reload_config(self) -> None:
-        """重新加载配置文件"""
-        self._stop_current_macro()
-        self.clear_input_buffer()  # 重新加载时清空缓冲队列
-        self._force_release_all_keys()  # 强制释放所有按键
-        self.load_config()
-        self.setup_hotkeys()
-        print(f"{Fore.GREEN}{_msg('config_reloaded')}{Style.RESET_ALL}")
+        """重新加载配置文件（增量）
 
-    def start_macro(self, macro: Dict[str, Any]) -> None:
-        """启动宏（智能缓冲）"""
-        if self.paused:
-            return
+        按名称和内容键比较新旧宏：内容未变的宏沿用原对象，其触发键钩子、正在运行的循环、
+        缓冲队列中的待执行项都保持不变；只有新增、修改、删除的宏才会重新注册或停止。
+        """
+        with self.reload_lock:
+            macros = self.parser.load_file(self.config_file)
+            if not macros:
+                log.warning(_msg('no_macros_found'))  # 保留当前配置（例如文件正在保存中）
+                return
+            diff = self._apply_macros(macros)
 
-        macro_name = macro['name']
-        current_time = time.time()
+        print(f"{Fore.GREEN}{_msg('config_reloaded')}{Style.RESET_ALL}  "
+              f"{Style.DIM}{_msg('config_reload_diff', *diff)}{Style.RESET_ALL}")
 
-        if Config.INPUT_BUFFER_ENABLED and self.engine.running:
-            should_buffer = self._should_buffer_macro(macro, current_time)
+    def _apply_macros(self, macros: List[Macro]) -> Tuple[int, int, int, int]:
+        """用新的宏列表替换当前配置，只处理发生变化的部分
 
-            if should_buffer:
-                with self.buffer_lock:
-                    if len(self.input_buffer) >= Config.INPUT_BUFFER_SIZE:
-                        return
-                    self.input_buffer.append(macro)
-                return
+        Returns:
+            (新增, 修改, 删除, 未变) 的宏数量
+        """
+        old_by_name = {macro.name: macro for macro in self.macros}
+        merged = []
+        added = changed = unchanged = 0
+        for macro in macros:
+            old = old_by_name.get(macro.name)
+            if old is None:
+                added += 1
+            elif old.content_key == macro.content_key:
+                macro = old  # 内容未变：沿用原对象
+                unchanged += 1
+            else:
+                changed += 1
+            merged.append(macro)
+        new_by_name = {macro.name: macro for macro in merged}
+        removed = sum(1 for name in old_by_name if name not in new_by_name)
+        live = set(map(id, merged))
+
+        old_map = self.hotkey_map
+        self.macros = merged
+        self._build_hotkey_map()
 
-        self._stop_current_macro()
+        # 只重新注册映射发生变化的触发键
+        stale_keys = {key for key, macro in old_map.items() if self.hotkey_map.get(key) is not macro}
+        for key in stale_keys:
+            self._unhook_trigger(key)
+        for key, macro in self.hotkey_map.items():
+            if old_map.get(key) is not macro:
+                self._hook_trigger(key, macro)
+
+        # 停止已被修改或删除的宏，未受影响的宏（包括其他通道）继续运行
+        for current in self.executor.active_macros():
+            if id(current) not in live:
+                self.executor.submit(MacroExecutor.STOP, current)
+
+        self.input_scheduler.retain(lambda macro: id(macro) in live)
+
+        for name in list(self.macro_additional_keys):
+            old = old_by_name.get(name)
+            if old is None or new_by_name.get(name) is not old:
+                self._release_additional_keys(name)
+
+        # 旧钩子已移除的触发键不会再收到松开事件
+        self.held_keys.release_keys(stale_keys)
+        name = self.current_hold_macro_name
+        if name is not None and new_by_name.get(name) is not old_by_name.get(name):
+            self.current_hold_macro_name = None
 
-        self.last_macro_trigger_time[macro_name] = current_time
+        return added, changed, removed, unchanged
 
-        self.current_thread = threading.Thread(
-            target=self._execute_macro_with_queue,
-            args=(macro,),
-            daemon=True
-        )
-        self.current_thread.start()
+    def start_macro(self, macro: Macro) -> None:
+        """启动宏（通道忙时由缓冲调度器决定中断、排队或忽略）"""
+        if self.paused or self.recorder.recording:
+            return
 
-    def _should_buffer_macro(self, macro: Dict[str, Any], current_time: float) -> bool:
-        """判断是否应该缓冲宏"""
-        macro_name = macro['name']
-        repeat_mode = macro.get('repeat_mode', 'once')
+        if Config.INPUT_BUFFER_ENABLED:
+            busy = self.executor.is_busy(self.engine.channel_name(macro))
+            if self.input_scheduler.admit(macro, busy) != InputScheduler.START:
+                return
 
-        # 规则1：如果新宏是"按住时"模式，不缓冲（立即中断）
-        if repeat_mode == 'hold':
-            return False
+        # 中断同一通道的当前宏并交给执行线程
+        self.executor.submit(MacroExecutor.PREEMPT, macro)
 
-        # 规则2：如果新宏在短时间内重复触发，才缓冲（避免误触）
-        last_trigger = self.last_macro_trigger_time.get(macro_name, 0)
-        time_since_last = current_time - last_trigger
+    def _execute_macro_with_queue(self, macro: Macro, channel: MacroChannel) -> Iterator[None]:
+        """在通道上逐步执行宏，并在完成后处理该通道队列中的下一个宏（由执行线程推进）"""
+        repeat_mode = macro.repeat_mode
 
-        if time_since_last < Config.RAPID_PRESS_THRESHOLD:
-            # 短时间内连按，缓冲
-            return True
-        else:
-            # 不是快速连按，直接中断当前宏
-            return False
+        check_key_still_held: Optional[Callable[[], bool]] = None
+        if repeat_mode == 'hold':
+            # 无锁读取：钩子线程只对这个字节做单次赋值
+            states = self.held_keys.states
+            key_id = self.held_keys.key_id(macro.trigger_key or '')
 
-    def _execute_macro_with_queue(self, macro: Dict[str, Any]) -> None:
-        """执行宏，并在完成后处理队列中的下一个宏"""
-        macro_name = macro['name']
-        trigger_key = macro.get('trigger_key', '')
-        repeat_mode = macro.get('repeat_mode', 'once')
-        additional_keys = macro.get('additional_keys', [])
-
-        def check_key_still_held() -> bool:
-            if repeat_mode != 'hold':
-                return True
-            with self.held_keys_lock:
-                is_held = trigger_key in self.held_trigger_keys
-                if not is_held:
-                    return False
-                return True
+            def key_held() -> bool:
+                return states[key_id] != 0
+            check_key_still_held = key_held
 
         try:
-            self.engine.execute_macro(macro, repeat_mode,
-                                     key_state_checker=check_key_still_held,
-                                     additional_keys=additional_keys)
+            yield from self.engine.macro_steps(macro, channel, repeat_mode,
+                                               key_state_checker=check_key_still_held,
+                                               additional_keys=macro.additional_keys)
         finally:
             if Config.INPUT_BUFFER_ENABLED:
-                self._process_next_in_queue()
-
-    def _process_next_in_queue(self) -> None:
-        """处理队列中的下一个宏"""
-        with self.buffer_lock:
-            if len(self.input_buffer) > 0:
-                next_macro = self.input_buffer.popleft()
-                # 静默执行
-
-                # 递归执行下一个宏（使用新线程）
-                self.current_thread = threading.Thread(
-                    target=self._execute_macro_with_queue,
-                    args=(next_macro,),
-                    daemon=True
-                )
-                self.current_thread.start()
+                self._process_next_in_queue(channel.name)
+
+    def _process_next_in_queue(self, channel_name: str) -> None:
+        """处理队列中属于该通道的下一个宏（优先级最高且未过期）"""
+        next_macro = self.input_scheduler.pop(channel_name)
+        if next_macro is not None:
+            # 静默执行：排在已投递的命令之后，当前宏被中断时一并失效
+            self.executor.submit(MacroExecutor.START, next_macro, follow_up=True)
 
     def clear_input_buffer(self) -> None:
         """清空输入缓冲队列"""
-        with self.buffer_lock:
-            self.input_buffer.clear()
-            # 静默清空
+        self.input_scheduler.clear()
 
     def _stop_current_macro(self) -> None:
-        """停止当前运行的宏"""
-        if self.engine.running:
-            self.engine.stop_macro()
-            if self.current_thread:
-                self.current_thread.join(timeout=Config.THREAD_JOIN_TIMEOUT)
+        """要求停止所有正在运行的宏（不等待，可在热键回调中调用）"""
+        self.executor.submit(MacroExecutor.STOP)
+
+    def _release_after_stop(self) -> None:
+        """等宏停止后强制释放所有按键（在控制线程中执行）"""
+        self.executor.idle.wait(Config.THREAD_JOIN_TIMEOUT)
+        self._force_release_all_keys()
 
     def _force_release_all_keys(self) -> None:
         """强制释放所有按键（包括附加按键和修饰键）"""
         self.engine.reset_keys(force_release_modifiers=True)
+        self._release_all_additional_keys()
+        self.held_keys.clear()
+        self.current_hold_macro_name = None
+
+    def _release_all_additional_keys(self) -> None:
+        """释放所有宏的附加按键"""
         with self.additional_keys_lock:
-            for keys in self.macro_additional_keys.values():
-                for key in keys:
-                    try:
-                        keyboard.release(key)
-                    except Exception:
-                        pass
+            keys = [key for keys in self.macro_additional_keys.values() for key in keys]
+            if keys:
+                self.engine.backend.release_keys(keys)
             self.macro_additional_keys.clear()
-        with self.held_keys_lock:
-            self.held_trigger_keys.clear()
-            self.current_hold_macro_name = None
 
-    def _on_trigger_press(self, macro: Dict[str, Any]) -> None:
-        """触发键按下时的处理（按住附加按键并启动宏）"""
-        macro_name = macro['name']
-        trigger_key = macro.get('trigger_key', '')
-        additional_keys = macro.get('additional_keys', [])
+    def _on_trigger_press(self, macro: Macro, key_id: Optional[int] = None) -> None:
+        """触发键按下时的处理（按住附加按键并启动宏）
 
-        with self.held_keys_lock:
-            self.held_trigger_keys.add(trigger_key)
-            if macro.get('repeat_mode') == 'hold':
-                self.current_hold_macro_name = macro_name
+        Args:
+            key_id: 触发键在 held_keys 中的 ID（注册热键时预先计算），None 时按键名查找
+        """
+        macro_name = macro.name
+        additional_keys = macro.additional_keys
+
+        tracer = self.engine.tracer
+        if tracer is not None:
+            tracer.record(LatencyTracer.HOOK, tracer.macro_id(macro_name), time.perf_counter())
+
+        if key_id is None:
+            key_id = self.held_keys.key_id(macro.trigger_key or '')
+        self.held_keys.press(key_id)
+        if macro.repeat_mode == 'hold':
+            self.current_hold_macro_name = macro_name
 
         if additional_keys:
             with self.additional_keys_lock:
-                self.macro_additional_keys[macro_name] = additional_keys.copy()
-                for key in additional_keys:
-                    try:
-                        keyboard.press(key)
-                    except Exception:
-                        pass
+                self.macro_additional_keys[macro_name] = list(additional_keys)
+                self.engine.backend.press_keys(additional_keys)
 
         self.start_macro(macro)
 
-    def _on_trigger_release(self, macro: Dict[str, Any]) -> None:
+    def _on_trigger_release(self, macro: Macro, key_id: Optional[int] = None) -> None:
         """触发键松开时的处理（根据模式决定是否停止宏和释放附加按键）"""
-        macro_name = macro['name']
-        trigger_key = macro.get('trigger_key', '')
-        repeat_mode = macro.get('repeat_mode', 'once')
+        macro_name = macro.name
 
-        with self.held_keys_lock:
-            self.held_trigger_keys.discard(trigger_key)
-            if self.current_hold_macro_name == macro_name:
-                self.current_hold_macro_name = None
+        if key_id is None:
+            key_id = self.held_keys.key_id(macro.trigger_key or '')
+        self.held_keys.release(key_id)
+        if self.current_hold_macro_name == macro_name:
+            self.current_hold_macro_name = None
 
         self._release_additional_keys(macro_name)
 
-        if repeat_mode == 'hold':
-            if self.engine.running:
-                self.engine.stop_macro()
+        if macro.repeat_mode == 'hold':
+            self.executor.submit(MacroExecutor.STOP, macro)
 
     def _release_additional_keys(self, macro_name: str) -> None:
         """释放指定宏的附加按键"""
         with self.additional_keys_lock:
             if macro_name in self.macro_additional_keys:
-                keys = self.macro_additional_keys[macro_name]
-                for key in keys:
-                    try:
-                        keyboard.release(key)
-                    except Exception:
-                        pass
-                del self.macro_additional_keys[macro_name]
+                self.engine.backend.release_keys(self.macro_additional_keys.pop(macro_name))
 
     def emergency_stop(self) -> None:
         """紧急停止所有宏（双击 Esc）"""
@@ -1258,23 +4193,10 @@ class MacroRunner:
         # 检查是否在双击间隔内
         if current_time - self.last_esc_time <= self.esc_double_click_interval:
             # 确认双击，执行紧急停止
-            print(f"{Fore.RED}{_msg('emergency_stopped')}{Style.RESET_ALL}")
             self._stop_current_macro()
             self.clear_input_buffer()
-            self.engine.reset_keys(force_release_modifiers=True)
-
-            with self.additional_keys_lock:
-                for keys in self.macro_additional_keys.values():
-                    for key in keys:
-                        try:
-                            keyboard.release(key)
-                        except Exception:
-                            pass
-                self.macro_additional_keys.clear()
-
-            with self.held_keys_lock:
-                self.held_trigger_keys.clear()
-                self.current_hold_macro_name = None
+            self.control.post(print, f"{Fore.RED}{_msg('emergency_stopped')}{Style.RESET_ALL}")
+            self.control.post(self._release_after_stop)
 
             self.last_esc_time = 0
         else:
@@ -1288,23 +4210,73 @@ class MacroRunner:
               f"{Style.DIM}{_msg('app_hints', Config.HOTKEY_PAUSE, Config.HOTKEY_RELOAD, Config.HOTKEY_EXIT)}{Style.RESET_ALL}")
 
         self.setup_hotkeys()
+        if self.defer_load:
+            # 控制热键已就绪，宏热键随解析进度逐个注册
+            self.defer_load = False
+            with self.reload_lock:
+                self.load_config(register_hotkeys=True)
+        if self.config_watcher is not None:
+            print(f"{Style.DIM}{_msg('config_watching', self.config_file)}{Style.RESET_ALL}")
+            self.config_watcher.start()
+        if WIN32_EVENTS_AVAILABLE:
+            # 阻塞等待时 Windows 上的 Ctrl+C 无法打断主线程，改由控制台事件请求退出
+            win32api.SetConsoleCtrlHandler(self._on_console_event, True)
         try:
-            while True:
-                time.sleep(0.1)
-        except SystemExit:
-            pass
+            self.shutdown_event.wait()  # 空闲时主线程不产生任何唤醒
+        finally:
+            self._shutdown()
 
     def stop(self) -> None:
-        """停止宏运行器"""
+        """请求退出（不阻塞，可在任意线程调用），由 start() 所在的主线程完成清理"""
+        self.shutdown_event.set()
+
+    def _on_console_event(self, ctrl_type: int) -> bool:
+        """控制台 Ctrl+C / 关闭窗口（在系统创建的线程中调用）：请求退出并等待清理完成"""
+        self.stop()
+        self.stopped.wait(Config.THREAD_JOIN_TIMEOUT)
+        return True
+
+    def _shutdown(self) -> None:
+        """停止所有后台服务并释放按键"""
         print(f"\n{Fore.CYAN}{_msg('app_exiting')}{Style.RESET_ALL}")
-        self._stop_current_macro()
+        self.executor.stop(timeout=Config.THREAD_JOIN_TIMEOUT)
         self._force_release_all_keys()  # 强制释放所有按键
+        if self.engine.tracer is not None and self.trace_file:
+            self.export_trace()
+        self.recorder.stop()
+        self.dispatcher.uninstall()
         keyboard.unhook_all()
-        sys.exit(0)
+        self.executor.shutdown()
+        self.window_monitor.stop()
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        self.control.stop()
+        if WIN32_EVENTS_AVAILABLE:
+            win32api.SetConsoleCtrlHandler(self._on_console_event, False)
+        self.stopped.set()
 
 
 def main() -> None:
     """主函数"""
+    arg_parser = argparse.ArgumentParser(description=Config.APP_NAME)
+    arg_parser.add_argument('--executor', choices=['thread', 'asyncio'], default=Config.EXECUTOR,
+                            help='宏执行器：thread 常驻线程（默认）/ asyncio 事件循环')
+    arg_parser.add_argument('--trace', action='store_true',
+                            help=f'启用延迟追踪，按 {Config.HOTKEY_TRACE} 打印 p50/p95/p99 报告')
+    arg_parser.add_argument('--trace-file', metavar='FILE',
+                            help='退出和打印报告时导出追踪报告（.json 或 .csv，隐含 --trace）')
+    arg_parser.add_argument('--report', action='store_true',
+                            help='加载配置，打印每个宏优化前后的动作数和周期后退出')
+    arg_parser.add_argument('--check', action='store_true',
+                            help='加载配置，打印每个宏的周期、输入速率和最坏停止延迟后退出（有宏超出预算时返回 1）')
+    arg_parser.add_argument('--budget', type=float, metavar='N',
+                            help=f'输入速率预算，每秒注入的事件数（默认 {Config.INPUT_RATE_BUDGET}）')
+    arg_parser.add_argument('--record-file', metavar='FILE',
+                            help=f'按 {Config.HOTKEY_RECORD} 录制的宏追加到的文件（默认 {Config.RECORD_FILE}）')
+    args = arg_parser.parse_args()
+    if args.budget is not None:
+        Config.INPUT_RATE_BUDGET = args.budget
+
     print(f"\n{Style.BRIGHT}{Config.APP_NAME} v{Config.APP_VERSION}{Style.RESET_ALL}")
 
     # 显示警告
@@ -1316,7 +4288,18 @@ def main() -> None:
         input(_msg('press_enter_exit'))
         return
 
-    runner = MacroRunner(Config.CONFIG_FILE, Config.TARGET_WINDOWS)
+    if args.report or args.check:
+        # 只做静态分析：直接解析配置，不创建运行器（不安装钩子、不启动任何线程）
+        macros = MacroParser().load_file(Config.CONFIG_FILE)
+        if args.report:
+            MacroAnalyzer.print_optimization_report(macros)
+            return
+        over = MacroAnalyzer.print_timing_report(macros)
+        raise SystemExit(1 if over else 0)
+
+    runner = MacroRunner(Config.CONFIG_FILE, Config.TARGET_WINDOWS, defer_load=True,
+                         executor=args.executor, trace=args.trace or None,
+                         trace_file=args.trace_file, record_file=args.record_file)
 
     try:
         runner.start()
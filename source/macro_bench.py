@@ -0,0 +1,2218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Diablo 4 宏程序 - 性能基准测试
+
+keyboard / mouse 会被替换为只计数的桩模块，不会向系统注入任何真实按键，
+可以在没有输入钩子的普通 Linux 环境下运行。
+
+用法:
+    python macro_bench.py                              运行全部基准
+    python macro_bench.py vm stop                      只运行指定的基准
+    python macro_bench.py --json result.json           同时把结果写入 JSON
+    python macro_bench.py --baseline base.json         与保存的基线比较，出现退化时返回 1
+
+任何基准的 checks 中出现 False 时返回 1（不需要基线）。
+"""
+
+import argparse
+import bisect
+import contextlib
+import csv
+import io
+import json
+import math
+import os
+import pickle
+import platform
+import re
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# ========================================
+# 输入库桩模块
+# ========================================
+class InputStub:
+    """keyboard / mouse 桩模块的调用计数"""
+    injected = 0
+    hooks = 0      # 注册的按键钩子数
+    unhooks = 0    # 移除的按键钩子数
+    timestamps: Optional[List[float]] = None  # 非 None 时记录每次注入的时间
+
+    @staticmethod
+    def inject(*_args, **_kwargs) -> None:
+        InputStub.injected += 1
+        if InputStub.timestamps is not None:
+            InputStub.timestamps.append(time.perf_counter())
+
+    @staticmethod
+    def noop(*_args, **_kwargs) -> Any:
+        return None
+
+    @staticmethod
+    def hook_key(*_args, **_kwargs) -> object:
+        InputStub.hooks += 1
+        return object()
+
+    @staticmethod
+    def unhook(_hook: Any) -> None:
+        InputStub.unhooks += 1
+
+    scan_codes: Dict[str, int] = {}  # 按键名 -> 分配的扫描码（每个名称唯一）
+    unmapped: set = set()            # 视为无法识别的按键名
+    lookups = 0                      # 按键名查找次数
+
+    @staticmethod
+    def key_to_scan_codes(key: Any) -> tuple:
+        if isinstance(key, int):
+            return (key,)
+        if isinstance(key, (list, tuple)):
+            return sum((InputStub.key_to_scan_codes(k) for k in key), ())
+        InputStub.lookups += 1
+        name = str(key).strip().lower()
+        if name in InputStub.unmapped:
+            raise ValueError(f'Key {key!r} is not mapped to any known key.')
+        codes = InputStub.scan_codes
+        return (codes.setdefault(name, 0x200 + len(codes)),)
+
+    @staticmethod
+    def parse_hotkey(hotkey: Any) -> tuple:
+        """与 keyboard.parse_hotkey 相同的拆分过程（不含系统按键表的查找开销）"""
+        if isinstance(hotkey, int) or len(hotkey) == 1:
+            return ((InputStub.key_to_scan_codes(hotkey),),)
+        if isinstance(hotkey, (list, tuple)):
+            if not any(isinstance(k, (list, tuple)) for k in hotkey):
+                return (tuple(InputStub.key_to_scan_codes(k) for k in hotkey),)
+            return tuple(hotkey)
+        return tuple(tuple(InputStub.key_to_scan_codes(k) for k in re.split(r'\s?\+\s?', step))
+                     for step in re.split(r',\s?', hotkey))
+
+    @staticmethod
+    def send(hotkey: Any, do_press: bool = True, do_release: bool = True) -> None:
+        InputStub.parse_hotkey(hotkey)
+        InputStub.inject()
+
+
+def install_input_stubs() -> None:
+    """用桩模块替换 keyboard / mouse（必须在导入 macro 之前调用）"""
+    keyboard_stub = types.ModuleType('keyboard')
+    # 与 keyboard 库一样，按键名字符串在每次调用时都经过 parse_hotkey
+    keyboard_stub.send = InputStub.send
+    keyboard_stub.press_and_release = lambda hotkey: InputStub.send(hotkey)
+    keyboard_stub.press = lambda hotkey: InputStub.send(hotkey, True, False)
+    keyboard_stub.release = lambda hotkey: InputStub.send(hotkey, False, True)
+    keyboard_stub.unhook_all = InputStub.noop
+    keyboard_stub.hook = keyboard_stub.on_press_key = keyboard_stub.on_release_key = InputStub.hook_key
+    keyboard_stub.unhook = InputStub.unhook
+    keyboard_stub.key_to_scan_codes = InputStub.key_to_scan_codes
+
+    mouse_stub = types.ModuleType('mouse')
+    for name in ('click', 'double_click', 'press', 'release'):
+        setattr(mouse_stub, name, InputStub.inject)
+    mouse_stub.hook = InputStub.hook_key
+    mouse_stub.unhook = InputStub.unhook
+
+    sys.modules['keyboard'] = keyboard_stub
+    sys.modules['mouse'] = mouse_stub
+
+
+install_input_stubs()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from macro import (Action, BatchedBackend, Config, ConfigCache, ConfigWatcher,  # noqa: E402
+                   HeldKeyState, HotkeyDispatcher, InputRecorder, InputScheduler, KeyboardMouseBackend,
+                   KeyResolver, LanguageMapping, LatencyTracer, Logger, Macro, MacroAnalyzer, MacroEngine,
+                   MacroParser, MacroRunner, OpCode, main as macro_main, RecordingBackend, WindowMonitor, WindowSource)
+
+KEY_PRESS_INTERVAL = Config.KEY_PRESS_INTERVAL
+
+
+# ========================================
+# 辅助函数
+# ========================================
+class FakeWindowSource(WindowSource):
+    """可设置标题的前台窗口来源"""
+
+    def __init__(self, title: str):
+        self.title = title
+        self.calls = 0
+
+    def get_foreground_title(self) -> str:
+        self.calls += 1
+        return self.title
+
+
+def generate_rotation(name: str, trigger: str, presses: int, delay_ms: int = 0) -> str:
+    """生成一个文本格式的宏段"""
+    keys = 'qwertasdfg'
+    lines = [f'[{name}]', f'触发键 = {trigger}', '循环 = 是', '动作 =']
+    for i in range(presses):
+        lines.append(f'  按下 {keys[i % len(keys)]}  等待 {delay_ms}ms')
+    return '\n'.join(lines) + '\n'
+
+
+class LegacyActionHandlers:
+    """旧的执行路径（冻结副本）：按动作类型查字典分派到处理方法，按键后同步等待按键间隔
+
+    MacroEngine 已改为解释执行编译后的程序，这里保留原来的分派方式作为基准的比较对象。
+    """
+
+    def __init__(self, engine: MacroEngine):
+        self.engine = engine
+        self._action_handlers: Dict[int, Callable] = {
+            OpCode.PRESS: self._handle_press,
+            OpCode.HOLD: self._handle_hold,
+            OpCode.DELAY: self._handle_delay,
+            OpCode.CLICK: self._handle_click,
+            OpCode.DOUBLECLICK: self._handle_doubleclick,
+            OpCode.KEYDOWN: self._handle_keydown,
+            OpCode.KEYUP: self._handle_keyup,
+            OpCode.MOUSEDOWN: self._handle_mousedown,
+            OpCode.MOUSEUP: self._handle_mouseup,
+        }
+
+    def execute_action(self, action: Action, repeat_count: int = 1) -> None:
+        """执行单个动作"""
+        if self.engine.stop_flag:
+            return
+
+        handler = self._action_handlers.get(action.op)
+
+        if handler:
+            handler(action, repeat_count)
+
+    def _handle_press(self, action: Action, repeat_count: int = 1) -> None:
+        engine = self.engine
+        key = action.key
+        for _ in range(repeat_count):
+            if engine.stop_flag:
+                break
+            engine.backend.tap(key)
+            engine.scheduler.sleep(Config.KEY_PRESS_INTERVAL)
+
+    def _handle_hold(self, action: Action, _: int = 1) -> None:
+        engine = self.engine
+        engine._key_down(action.key)
+        engine.scheduler.sleep(action.duration)
+        engine._key_up(action.key)
+
+    def _handle_delay(self, action: Action, _: int = 1) -> None:
+        self.engine.scheduler.sleep(action.duration)
+
+    def _handle_click(self, action: Action, _: int = 1) -> None:
+        self.engine.backend.click(action.button)
+
+    def _handle_doubleclick(self, action: Action, _: int = 1) -> None:
+        self.engine.backend.double_click(action.button)
+
+    def _handle_keydown(self, action: Action, _: int = 1) -> None:
+        self.engine._key_down(action.key)
+
+    def _handle_keyup(self, action: Action, _: int = 1) -> None:
+        self.engine._key_up(action.key)
+
+    def _handle_mousedown(self, action: Action, _: int = 1) -> None:
+        self.engine._button_down(action.button)
+
+    def _handle_mouseup(self, action: Action, _: int = 1) -> None:
+        self.engine._button_up(action.button)
+
+
+def run_dict_path(engine: MacroEngine, macro_def: Macro, rounds: int) -> None:
+    """旧的执行路径：逐个动作分派（与原 run_actions 的检查一致）"""
+    execute_action = LegacyActionHandlers(engine).execute_action
+    actions = macro_def.actions
+    for _ in range(rounds):
+        for action in actions:
+            if engine.stop_flag:
+                return
+            if engine.window_monitor and not engine.window_monitor.is_target_window_active():
+                return
+            execute_action(action)
+
+
+def percentiles(samples: List[float], scale: float = 1000.0) -> Dict[str, float]:
+    """计算 p50 / p95 / p99 / max（默认换算为毫秒）"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale  # noqa: E731
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': ordered[-1] * scale}
+
+
+def write_config(content: str) -> str:
+    """写入临时配置文件，返回路径"""
+    fd, path = tempfile.mkstemp(suffix='.txt', prefix='macro_bench_')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return path
+
+
+def remove_config(path: str) -> None:
+    """删除临时配置文件及其缓存"""
+    for leftover in (path, ConfigCache(path).path):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+def measure(func: Callable[[], None], actions: int) -> Dict[str, float]:
+    """计时并换算为每秒动作数和单个动作开销（time.sleep 临时替换为空操作）"""
+    real_sleep = time.sleep
+    time.sleep = InputStub.noop
+    try:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+    finally:
+        time.sleep = real_sleep
+    return {
+        'seconds': elapsed,
+        'actions_per_sec': actions / elapsed if elapsed else 0.0,
+        'ns_per_action': elapsed / actions * 1e9 if actions else 0.0,
+    }
+
+
+@contextlib.contextmanager
+def config_override(**values: Any) -> Iterator[None]:
+    """临时修改 Config 设置，退出时（包括异常和检查失败）恢复原值；也可以用作装饰器"""
+    saved = {name: getattr(Config, name) for name in values}
+    for name, value in values.items():
+        setattr(Config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+
+
+# ========================================
+# 基准项
+# ========================================
+@config_override(KEY_PRESS_INTERVAL=0)
+def bench_vm() -> Dict[str, Any]:
+    """字节码解释器 vs 动作字典分派（只测量调度开销）"""
+    parser = MacroParser()
+    engine = parser.engine
+    macro_def = parser.parse_text_format(generate_rotation('bench', '1', 50))[0]
+    program = macro_def.program
+    rounds = 2000
+    actions = len(macro_def.actions) * rounds
+
+    results = {
+        'dict': measure(lambda: run_dict_path(engine, macro_def, rounds), actions),
+        'vm': measure(lambda: [engine.run_program(program) for _ in range(rounds)], actions),
+        'instructions': len(program),
+        'source_actions': program.action_count,
+    }
+    results['speedup'] = results['dict']['seconds'] / results['vm']['seconds']
+    return results
+
+
+@config_override(KEY_PRESS_INTERVAL=0)
+def bench_engine() -> Dict[str, Any]:
+    """execute_macro 在单次 / 循环 / 按住时模式下的每秒动作数（零延迟，只测量执行开销）"""
+    parser = MacroParser()
+    engine = parser.engine
+    macro_def = parser.parse_text_format(generate_rotation('engine', '1', 50))[0]
+    rounds = 1000
+    actions = len(macro_def.actions) * rounds
+    # 循环模式下按键状态检查在每轮开始和每条注入指令前各调用一次
+    checks_per_round = 1 + sum(1 for op in macro_def.program.ops if op != OpCode.DELAY)
+
+    def run_repeated(mode: str) -> None:
+        remaining = [rounds * checks_per_round]
+
+        def still_held() -> bool:
+            remaining[0] -= 1
+            return remaining[0] > 0
+
+        engine.execute_macro(macro_def, mode, key_state_checker=still_held)
+
+    def run_once() -> None:
+        for _ in range(rounds):
+            engine.execute_macro(macro_def)
+
+    results = {
+        'once': measure(run_once, actions),
+        'loop': measure(lambda: run_repeated('loop'), actions),
+        'hold': measure(lambda: run_repeated('hold'), actions),
+    }
+    return results
+
+
+def timeline_length(engine: MacroEngine, program: Any) -> float:
+    """不等待地走完程序，返回时间线推进的长度（秒）"""
+    scheduler = engine.channel.scheduler
+    scheduler.deadline = 0.0
+    for _ in engine.program_steps(program, engine.channel, check_window=False):
+        pass
+    return scheduler.deadline
+
+
+def bench_optimize() -> Dict[str, Any]:
+    """宏优化：合并延迟、去掉零等待、默认延迟，"重复 = N" 用计数循环代替 N 份动作列表"""
+    repeat = 10
+    lines = []
+    for i in range(200):
+        lines += [f'[优化{i}]', f'触发键 = f{i % 12 + 1}', '默认延迟 = 5ms', f'重复 = {repeat}', '动作 =',
+                  '  按下 q  等待 0ms  等待 20ms  等待 30ms',
+                  '  按下 w,e',
+                  '  按下 r',
+                  '  hold t 100ms  等待 10ms  等待 0ms',
+                  '  左键']
+    parser = MacroParser()
+    start = time.perf_counter()
+    macros = parser.parse_text_format('\n'.join(lines) + '\n')
+    parse_ms = (time.perf_counter() - start) * 1000
+    macro_def = macros[0]
+    actions = macro_def.actions
+    stats = macro_def.optimization
+
+    # 对照：把动作列表复制 N 份再编译
+    engine = parser.engine
+    copies = engine.compiler.compile_actions(actions * repeat)
+    program = macro_def.program
+
+    engine.backend = RecordingBackend()
+    timeline = timeline_length(engine, program)
+    counted_events = len(engine.backend.events)
+    engine.backend.clear()
+    copies_timeline = timeline_length(engine, copies)
+    copies_events = len(engine.backend.events)
+
+    delays = [a for a in actions if a.type == 'delay']
+    return {
+        'parse_ms_200_macros': parse_ms,
+        'optimization': stats,
+        'instructions': {'counted_loop': len(program), 'copies': len(copies)},
+        'checks': {
+            'no_adjacent_delays': all(not (a.type == b.type == 'delay')
+                                      for a, b in zip(actions, actions[1:])),
+            'no_zero_waits': all(a.duration > 0 for a in delays),
+            'merged_delay': delays[0].duration == 0.05,
+            'group_kept': OpCode.PRESS_GROUP in program.ops,
+            'repeat_events': counted_events == copies_events and counted_events > 0,
+            'timeline_matches_copies': abs(timeline - copies_timeline) < 1e-9,
+            'cycle_matches_timeline': abs(stats['cycle_after_ms'] - timeline * 1000) < 1e-6,
+            'cycle_not_longer': stats['cycle_after_ms'] <= stats['cycle_before_ms'],
+        },
+    }
+
+
+ANALYZE_CONFIG = """[技能1]
+触发键 = 1
+循环 = 是
+按下 q
+等待 25ms
+
+[快速]
+触发键 = 2
+重复 = 按住时
+动作 =
+  按下 q,w
+  按下 e
+
+[连点]
+触发键 = 3
+循环 = 是
+跳过窗口检测 = 是
+左键
+
+[长按]
+触发键 = 4
+循环 = 是
+动作 =
+  hold t 300ms
+  按下 q  等待 50ms
+
+[连招]
+触发键 = 5
+默认延迟 = 5ms
+重复 = 3
+动作 =
+  按住 shift
+  按下 w,e  等待 20ms
+  双击左键
+  松开 shift
+"""
+
+
+@config_override(CONFIG_CACHE_ENABLED=False)
+def bench_analyze() -> Dict[str, Any]:
+    """静态定时分析：加载时计算的周期、事件数与实际执行的时间线一致，超出输入速率预算的宏被标出"""
+    path = write_config(ANALYZE_CONFIG)
+    output = io.StringIO()
+    config_file, argv = Config.CONFIG_FILE, sys.argv
+    threads = threading.active_count()
+    try:
+        with contextlib.redirect_stdout(output):
+            runner = MacroRunner(path)
+            over = MacroAnalyzer.print_timing_report(runner.macros)
+        runner.executor.shutdown()
+        runner.control.stop()
+        runner.window_monitor.stop()
+
+        # --check 只解析配置，不创建运行器：不启动线程
+        Config.CONFIG_FILE, sys.argv = path, ['macro.py', '--check']
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                macro_main()
+                check_status = 0
+            except SystemExit as e:
+                check_status = e.code
+            check_threads = threading.active_count() - threads
+    finally:
+        Config.CONFIG_FILE, sys.argv = config_file, argv
+        remove_config(path)
+    by_name = {macro.name: macro for macro in runner.macros}
+
+    # 记录后端的一条单击/按键事件对应系统中的按下和松开两个输入事件
+    backend = RecordingBackend()
+    injected = {backend.TAP: 2, backend.DOWN: 1, backend.UP: 1, backend.CLICK: 2, backend.DOUBLECLICK: 4,
+                backend.MOUSEDOWN: 1, backend.MOUSEUP: 1}
+    engine = runner.engine
+    engine.backend = backend
+    matches = {}
+    for macro in runner.macros:
+        backend.clear()
+        timeline = timeline_length(engine, macro.program)
+        events = sum(injected[kind] for _, kind, _ in backend.events)
+        matches[macro.name] = (abs(macro.timing['cycle_ms'] - timeline * 1000) < 1e-6
+                               and macro.timing['events'] == events)
+
+    # 分析开销：200 个宏的配置
+    parser = MacroParser()
+    lines = [f'[分析{i}]\n触发键 = f{i % 12 + 1}\n循环 = 是\n默认延迟 = 5ms\n动作 =\n'
+             f'  按下 q  按下 w,e  hold r 100ms\n  左键  等待 20ms\n' for i in range(200)]
+    fields = [{'name': macro.name, 'repeat_mode': macro.repeat_mode, 'actions': macro.actions}
+              for macro in parser.parse_text_format('\n'.join(lines))]
+    analyzer = engine.analyzer
+    start = time.perf_counter()
+    for f in fields:
+        analyzer.profile(f)
+    profile_us = (time.perf_counter() - start) * 1e6 / len(fields)
+
+    text = output.getvalue()
+    timing = {name: macro.timing for name, macro in by_name.items()}
+    return {
+        'timing': timing,
+        'profile_us_per_macro': profile_us,
+        'checks': {
+            'timeline_and_events_match': all(matches.values()),
+            'loop_rate': abs(timing['技能1']['events_per_sec'] - 2 / 0.035) < 1e-6,
+            # 连招 单次执行（重复 = 3）速率虽高但没有持续速率，不参与预算检查
+            'over_budget_flagged': {m.name for m in over} == {'快速', '连点'},
+            'zero_cycle_is_unbounded': (timing['连点']['unbounded']
+                                        and timing['连点']['events_per_sec'] is None),
+            'finite_rates': all(t['events_per_sec'] is None or math.isfinite(t['events_per_sec'])
+                                for t in timing.values()),
+            'hold_longest_wait': abs(timing['长按']['longest_wait_ms'] - 300) < 1e-6,
+            # 按住 300ms 可被唤醒：停止延迟与动作时长无关
+            'stop_is_longest_uninterruptible': all(t['stop_latency_ms'] == Config.STOP_LATENCY_BOUND * 1000
+                                                   for t in timing.values()),
+            'longest_step_events': (timing['快速']['longest_step_events'] == 4
+                                    and timing['连招']['longest_step_events'] == 4
+                                    and timing['长按']['longest_step_events'] == 2),
+            'load_warns': text.count('超过预算') == len(over),
+            'check_without_runner': check_status == 1 and check_threads == 0,
+        },
+    }
+
+
+def legacy_macro_dict(macro: Macro) -> Dict[str, Any]:
+    """旧的宏表示：嵌套字典（只写入配置过的字段，动作为字典列表）"""
+    def action_dict(action: Action) -> Dict[str, Any]:
+        d: Dict[str, Any] = {'type': action.type}
+        if action.key:
+            d['key'] = action.key
+        if action.op in OpCode.BUTTON_OPS:
+            d['button'] = action.button
+        if action.op in OpCode.TIMED_OPS:
+            d['duration'] = action.duration
+        if action.group is not None:
+            d['group'] = action.group
+        return d
+
+    d: Dict[str, Any] = {'name': macro.name, 'trigger_key': macro.trigger_key, 'repeat_mode': macro.repeat_mode}
+    for field in ('actions', 'start_actions', 'finish_actions'):
+        d[field] = [action_dict(action) for action in getattr(macro, field)]
+    defaults = Macro('')
+    for field in Macro.CONTENT_FIELDS:
+        value = getattr(macro, field)
+        if field not in d and value != getattr(defaults, field):
+            d[field] = list(value) if isinstance(value, tuple) else value
+    for field in ('start_program', 'program', 'finish_program', 'optimization', 'timing'):
+        d[field] = getattr(macro, field)
+    return d
+
+
+def rebuild_macro(macro: Macro) -> Macro:
+    """重新构建宏模型（新的 Action 对象，编译产物沿用原对象）"""
+    values = {field: getattr(macro, field) for field in Macro.FIELDS}
+    for field in ('actions', 'start_actions', 'finish_actions'):
+        values[field] = tuple(Action(a.op, a.key, a.button, a.duration, a.group) for a in values[field])
+    return Macro(**values)
+
+
+def bench_model() -> Dict[str, Any]:
+    """宏模型：5000 个宏的内存占用和字段访问开销（嵌套字典 vs __slots__ 不可变模型），以及校验检查"""
+    count = 5000
+    sections = []
+    for i in range(count):
+        section = generate_rotation(f'宏{i}', f'k{i}', 6 + i % 5, 10 + i % 4 * 5)
+        if i % 3 == 0:
+            section = section.replace('循环 = 是', '重复 = 按住时\n附加按键 = shift\n通道 = c1\n优先级 = 2')
+        sections.append(section)
+    parser = MacroParser()
+    start = time.perf_counter()
+    macros = parser.parse_text_format('\n'.join(sections))
+    parse_ms = (time.perf_counter() - start) * 1000
+
+    # 内存：只统计宏和动作容器本身（编译产物两种表示共用）
+    def footprint(build: Callable[[Macro], Any]) -> Tuple[Any, int]:
+        tracemalloc.start()
+        built = [build(macro) for macro in macros]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return built, size
+
+    dicts, dict_bytes = footprint(legacy_macro_dict)
+    models, model_bytes = footprint(rebuild_macro)
+    action_count = sum(len(macro.actions) for macro in macros)
+
+    # 访问开销：触发时读取的字段 / 遍历动作
+    rounds = 20
+
+    def trigger_dicts() -> None:
+        for d in dicts:
+            (d.get('repeat_mode', 'once'), d.get('additional_keys', []), d.get('trigger_key'), d['name'],
+             d.get('channel'), d.get('buffer_policy', 'auto'), d.get('priority', 0))
+
+    def trigger_models() -> None:
+        for m in models:
+            (m.repeat_mode, m.additional_keys, m.trigger_key, m.name, m.channel, m.buffer_policy, m.priority)
+
+    def walk_dicts() -> None:
+        for d in dicts:
+            for a in d['actions']:
+                (a['type'], a.get('key'), a.get('duration', 0.0))
+
+    def walk_models() -> None:
+        for m in models:
+            for a in m.actions:
+                (a.op, a.key, a.duration)
+
+    def per_item_ns(func: Callable[[], None], items: int) -> float:
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best / items * 1e9
+
+    # 校验与不可变
+    def rejects(func: Callable[[], Any], error: type = ValueError) -> bool:
+        try:
+            func()
+        except error:
+            return True
+        return False
+
+    messages: List[str] = []
+    real_warning = Logger.__dict__['warning']
+    Logger.warning = staticmethod(lambda msg, *args, **kwargs: messages.append(msg))
+    try:
+        invalid = parser.parse_text_format('[坏]\n触发键 = 1\n动作 =\n按下 q\n等待 -5ms\n'
+                                           '[好]\n触发键 = 2\n动作 =\n按下 w\n')
+        invalid_warnings = len(messages)
+        zero = parser.parse_text_format('[零]\n触发键 = 3\n重复 = 0\n动作 =\n按下 e\n')
+    finally:
+        Logger.warning = real_warning
+
+    sample = macros[0]
+    restored = pickle.loads(pickle.dumps(sample))
+    return {
+        'macros': count,
+        'actions': action_count,
+        'parse_ms': parse_ms,
+        'memory_kb': {'dicts': dict_bytes / 1024, 'model': model_bytes / 1024,
+                      'ratio': dict_bytes / model_bytes},
+        'trigger_fields_ns_per_macro': {'dicts': per_item_ns(trigger_dicts, count),
+                                        'model': per_item_ns(trigger_models, count)},
+        'action_fields_ns_per_action': {'dicts': per_item_ns(walk_dicts, action_count),
+                                        'model': per_item_ns(walk_models, action_count)},
+        'checks': {
+            'slots_only': not hasattr(sample, '__dict__') and not hasattr(sample.actions[0], '__dict__'),
+            'immutable': (rejects(lambda: setattr(sample, 'priority', 9), AttributeError) and
+                          rejects(lambda: setattr(sample.actions[0], 'key', 'x'), AttributeError)),
+            'rejects_invalid': (rejects(lambda: Macro('x', repeat_mode='sometimes')) and
+                                rejects(lambda: Macro('x', buffer_policy='later')) and
+                                rejects(lambda: Action(OpCode.PRESS)) and
+                                rejects(lambda: Action(OpCode.DELAY, duration=-1))),
+            'invalid_skipped': [m.name for m in invalid] == ['好'] and invalid_warnings == 1,
+            # 重复 = 0 不丢弃宏：按 1 次执行并警告
+            'zero_repeat_clamped': ([(m.name, m.repeat_count, m.trigger_key) for m in zero] == [('零', 1, '3')]
+                                    and len(messages) == 2),
+            'pickle_roundtrip': restored.content == sample.content and
+                                restored.program.disassemble() == sample.program.disassemble(),
+            'rebuilt_equal': all(a.content == b.content for a, b in zip(macros, models)),
+        },
+    }
+
+
+def run_legacy_loop(duration: float, delay: float) -> int:
+    """旧的定时方式：按键后固定睡眠，延迟按 50ms 分块累加睡眠时间"""
+    cycles = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        InputStub.inject()
+        time.sleep(KEY_PRESS_INTERVAL)
+        elapsed = 0.0
+        while elapsed < delay:
+            chunk = min(0.05, delay - elapsed)
+            time.sleep(chunk)
+            elapsed += chunk
+        cycles += 1
+    return cycles
+
+
+def bench_timing() -> Dict[str, Any]:
+    """25ms 循环宏的漂移与抖动：绝对截止时间调度 vs 累加睡眠"""
+    duration, delay = 3.0, 0.025
+    expected = int(duration / (delay + KEY_PRESS_INTERVAL))
+
+    parser = MacroParser()
+    engine = parser.engine
+    macro_def = parser.parse_text_format(generate_rotation('timing', '1', 1, int(delay * 1000)))[0]
+
+    injected = InputStub.injected
+    worker = threading.Thread(target=engine.execute_macro, args=(macro_def, 'loop'))
+    worker.start()
+    time.sleep(duration)
+    engine.stop_macro()
+    worker.join()
+    scheduled_cycles = InputStub.injected - injected
+
+    return {
+        'expected_cycles': expected,
+        'scheduled_cycles': scheduled_cycles,
+        'legacy_cycles': run_legacy_loop(duration, delay),
+        'stats': engine.timing_stats['timing'].to_dict(),
+    }
+
+
+def burst_latency(trigger: Callable[[], None], count: int, spacing: float) -> Dict[str, Any]:
+    """以随机间隔（平均 spacing）连续触发，统计每次触发到下一次按键注入的延迟
+
+    间隔使用固定种子随机化，避免触发时刻与调度器的睡眠步长同相位而得到偏乐观的结果。
+    """
+    rng = random.Random(1)
+    InputStub.timestamps = []
+    triggers = []
+    for _ in range(count):
+        triggers.append(time.perf_counter())
+        trigger()
+        time.sleep(spacing * rng.uniform(0.5, 1.5))
+    time.sleep(0.2)
+    stamps, InputStub.timestamps = InputStub.timestamps, None
+
+    latencies = []
+    for t in triggers:
+        index = bisect.bisect_left(stamps, t)
+        if index < len(stamps):
+            latencies.append(stamps[index] - t)
+    result = percentiles(latencies)
+    result['injected'] = len(stamps)
+    return result
+
+
+@config_override(INPUT_BUFFER_ENABLED=False)
+def bench_trigger() -> Dict[str, Any]:
+    """触发到首个按键注入的延迟：每次触发新建线程 vs 常驻执行线程 vs asyncio 执行器"""
+    path = write_config('[单键]\n触发键 = 1\n动作 =\n  按下 q\n')
+    try:
+        runner = MacroRunner(path)
+        async_runner = MacroRunner(path, executor='asyncio')
+    finally:
+        remove_config(path)
+    macro_def = runner.macros[0]
+    engine = runner.engine
+    count, spacing = 300, 0.002
+    current: List[Optional[threading.Thread]] = [None]
+
+    def spawn_thread() -> None:
+        # 旧路径：停止并 join 当前线程，再为本次触发新建线程
+        if engine.running:
+            engine.stop_macro()
+            if current[0]:
+                current[0].join(timeout=Config.THREAD_JOIN_TIMEOUT)
+        current[0] = threading.Thread(target=engine.execute_macro, args=(macro_def,), daemon=True)
+        current[0].start()
+
+    results = {}
+    # idle: 上一个宏已结束；preempt: 上一个宏仍在按键间隔中，需要先中断
+    for scenario, interval in (('idle', 0), ('preempt', KEY_PRESS_INTERVAL)):
+        with config_override(KEY_PRESS_INTERVAL=interval):
+            results[scenario] = {
+                'thread_per_trigger': burst_latency(spawn_thread, count, spacing),
+                'executor': burst_latency(lambda: runner.start_macro(macro_def), count, spacing),
+                'asyncio': burst_latency(lambda: async_runner.start_macro(async_runner.macros[0]),
+                                         count, spacing),
+            }
+    runner.executor.shutdown()
+    async_runner.executor.shutdown()
+    return results
+
+
+# 共用同一套基准的宏执行器
+EXECUTORS = ('thread', 'asyncio')
+
+# 每种动作类型对应的循环宏（停止请求会落在该动作的等待中）
+STOP_CASES = {
+    'press': '按下 q',
+    'delay': '按下 q\n等待 500ms',
+    'hold': 'hold q 500ms',
+    'click': '左键\n等待 5ms',
+    'doubleclick': '双击左键\n等待 5ms',
+    'keydown_keyup': '按住 q\n等待 300ms\n松开 q',
+}
+
+
+def bench_stop() -> Dict[str, Any]:
+    """每种动作类型的停止延迟（取消请求 -> 宏结束），并校验不超过 Config.STOP_LATENCY_BOUND"""
+    return {executor: stop_latencies(executor) for executor in EXECUTORS}
+
+
+def stop_latencies(executor: str) -> Dict[str, Any]:
+    """在指定执行器上测量每种动作类型的停止延迟"""
+    sections = [f'[{name}]\n触发键 = {i}\n循环 = 是\n动作 =\n{body}\n'
+                for i, (name, body) in enumerate(STOP_CASES.items())]
+    path = write_config('\n'.join(sections))
+    try:
+        runner = MacroRunner(path, executor=executor)
+    finally:
+        remove_config(path)
+
+    backend = runner.engine.backend = RecordingBackend()
+    releases = (backend.UP, backend.MOUSEUP)
+    rng = random.Random(2)
+    results: Dict[str, Any] = {}
+    for macro_def in runner.macros:
+        latencies = []
+        stuck_keys = timeouts = injected_after_stop = 0
+        for _ in range(30):
+            runner.start_macro(macro_def)
+            time.sleep(rng.uniform(0.02, 0.08))
+            runner.executor.submit(runner.executor.STOP)
+            token = runner.engine.cancel_token
+            if not runner.executor.idle.wait(Config.THREAD_JOIN_TIMEOUT):
+                timeouts += 1
+                break
+            latencies.append(time.perf_counter() - token.requested_at)
+            stuck_keys += len(runner.engine.pressed_keys) + len(runner.engine.pressed_buttons)
+            # 停止请求之后只应有松开事件（最多再加上请求时正在提交的那一步）
+            injected_after_stop = max(injected_after_stop, sum(
+                1 for at, kind, _ in backend.events if at >= token.requested_at and kind not in releases))
+            backend.clear()
+        stats = percentiles(latencies)
+        stats['stuck_keys'] = stuck_keys
+        stats['injected_after_stop'] = injected_after_stop
+        stats['longest_wait_ms'] = macro_def.timing['longest_wait_ms']
+        stats['within_bound'] = bool(latencies) and max(latencies) <= Config.STOP_LATENCY_BOUND
+        stats['checks'] = {'stopped': not timeouts, 'no_stuck_keys': not stuck_keys,
+                           'nothing_injected_after_stop': injected_after_stop <= 1}
+        results[macro_def.name] = stats
+
+    runner.executor.shutdown()
+    runner.control.stop()
+    return results
+
+
+class InlineControl:
+    """旧的控制路径：命令直接在热键回调中同步执行"""
+
+    @staticmethod
+    def post(command: Callable[..., Any], *args: Any) -> None:
+        command(*args)
+
+
+def control_session(inline: bool) -> Dict[str, Any]:
+    """按下一串控制热键，记录每个热键回调的耗时（重载时需要重新解析 1500 个宏）"""
+    sections = [generate_rotation(f'宏{i}', f'k{i}', 8, 10) for i in range(1500)]
+    sections.append('[连招]\n触发键 = 1\n循环 = 是\n动作 =\n按住 shift\n按下 q\n等待 20ms\n')
+    path = write_config('\n'.join(sections))
+    fd, record_path = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        with config_override(CONFIG_CACHE_ENABLED=False):
+            runner = MacroRunner(path, record_file=record_path)
+        if inline:
+            runner.control = InlineControl()
+        runner.setup_hotkeys()
+        dispatcher = runner.dispatcher
+        at = 0.0
+        callbacks: Dict[str, float] = {}
+
+        def press(label: str, name: str, hold: float = 0.0) -> None:
+            nonlocal at
+            dispatcher.slowest_callback = 0.0
+            at += 2.0  # 超出自动重复窗口
+            dispatcher.dispatch(key_event('down', name, at))
+            time.sleep(hold)
+            dispatcher.dispatch(key_event('up', name, at))
+            callbacks[label] = max(callbacks.get(label, 0.0), dispatcher.slowest_callback * 1000)
+            time.sleep(Config.CONTROL_KEY_DEBOUNCE + 0.02)
+
+        press('trigger', '1', 0.1)
+        press('pause', 'f10')
+        press('resume', 'f10')
+        press('trigger', '1', 0.1)
+        press('reload', 'f11')
+        press('trace', 'f9')
+        press('record', 'f8')
+        press('record', 'f8')
+        press('trigger', '1', 0.1)
+        dispatcher.slowest_callback = 0.0
+        dispatcher.dispatch(key_event('down', 'esc', at + 2))
+        dispatcher.dispatch(key_event('up', 'esc', at + 2))
+        dispatcher.dispatch(key_event('down', 'esc', at + 4))
+        dispatcher.dispatch(key_event('up', 'esc', at + 4))
+        callbacks['emergency_stop'] = dispatcher.slowest_callback * 1000
+
+        # 等控制线程处理完已投递的命令
+        drained = threading.Event()
+        runner.control.post(drained.set)
+        drained.wait(10)
+        runner.executor.shutdown()
+        if not inline:
+            runner.control.stop()
+        return {
+            'callback_ms': callbacks,
+            'max_callback_ms': max(callbacks.values()),
+            'checks': {
+                'drained': drained.is_set(),
+                'stopped': not runner.engine.running,
+                'keys_released': not runner.engine.pressed_keys,
+                'not_paused': not runner.paused,
+                'recording_stopped': not runner.recorder.recording,
+                'macros_reloaded': len(runner.macros) == 1501,
+            },
+        }
+    finally:
+        remove_config(path)
+        os.remove(record_path)
+
+
+def bench_control() -> Dict[str, Any]:
+    """控制路径：暂停/重载/追踪/录制/紧急停止热键阻塞钩子线程的时间（回调中同步执行 vs 投递给控制线程）"""
+    return {'inline': control_session(True), 'posted': control_session(False)}
+
+
+def bench_channels() -> Dict[str, Any]:
+    """执行通道：数十条循环时间线在同一个执行线程上同时运行；按住时宏与循环宏并行；独占宏"""
+    return {executor: channel_timelines(executor) for executor in EXECUTORS}
+
+
+def channel_timelines(executor: str) -> Dict[str, Any]:
+    """在指定执行器上运行通道压力测试"""
+    count = 48
+    periods = []
+    sections = []
+    for i in range(count):
+        delay_ms = 10 + i % 8 * 5
+        if i % 2:
+            # 按住/松开：周期等于延迟
+            body = f'按住 x{i}\n等待 {delay_ms}ms\n松开 x{i}'
+            periods.append(delay_ms / 1000)
+        else:
+            body = f'按下 x{i}\n等待 {delay_ms}ms'
+            periods.append(delay_ms / 1000 + Config.KEY_PRESS_INTERVAL)
+        sections.append(f'[通道{i}]\n触发键 = k{i}\n循环 = 是\n通道 = c{i}\n动作 =\n{body}\n')
+    sections.append('[增益]\n触发键 = k97\n循环 = 是\n通道 = buff\n动作 =\n按下 1\n等待 20ms\n')
+    sections.append('[攻击]\n触发键 = k98\n重复 = 按住时\n动作 =\n按下 2\n等待 10ms\n')
+    sections.append('[独占]\n触发键 = k99\n独占 = 是\n动作 =\n按下 z\n')
+    path = write_config('\n'.join(sections))
+    try:
+        runner = MacroRunner(path, executor=executor)
+    finally:
+        remove_config(path)
+    by_name = {macro.name: macro for macro in runner.macros}
+    macros = runner.macros[:count]
+    channels = [runner.engine.get_channel(macro.channel) for macro in macros]
+    results: Dict[str, Any] = {}
+
+    # 按住时宏与循环宏在不同通道：松开触发键只停止按住时宏
+    buff, attack = by_name['增益'], by_name['攻击']
+    runner._on_trigger_press(buff)
+    runner._on_trigger_press(attack)
+    time.sleep(0.1)
+    both_running = runner.executor.is_busy('buff') and runner.executor.is_busy(Config.DEFAULT_CHANNEL)
+    runner._on_trigger_release(attack)
+    time.sleep(0.05)
+    results['hold_with_loop'] = {
+        'both_running': both_running,
+        'hold_stopped': not runner.executor.is_busy(Config.DEFAULT_CHANNEL),
+        'loop_kept_running': runner.executor.is_busy('buff'),
+    }
+    runner.executor.submit(runner.executor.STOP, buff)
+
+    # 压力测试：所有通道同时运行，每个通道的速率由它每轮第一个注入事件的间隔中位数算出
+    # （时间线按截止时间推进，单次迟到之后的间隔会相应缩短，中位数不受偶发的调度迟到影响）
+    backend = runner.engine.backend = RecordingBackend()
+    threads_before = threading.active_count()
+    for macro in macros:
+        runner.start_macro(macro)
+    time.sleep(1.0)
+    stats = [runner.engine.timing_stats[macro.name] for macro in macros]
+    cycle_starts: Dict[str, List[float]] = {}
+    for at, kind, name in list(backend.events):
+        if kind in (backend.TAP, backend.DOWN):
+            cycle_starts.setdefault(name, []).append(at)
+    cycles = []
+    for i, period in enumerate(periods):
+        starts = cycle_starts.get(f'x{i}', [])
+        interval = statistics.median(b - a for a, b in zip(starts, starts[1:])) if len(starts) > 1 else 0.0
+        cycles.append(period / interval if interval else 0.0)
+    results['stress'] = {
+        'channels': count,
+        'running': sum(channel.running for channel in channels),
+        'extra_threads': threading.active_count() - threads_before,
+        'mean_ms': sum(stat.mean for stat in stats) / count * 1000,
+        'max_jitter_ms': max(stat.jitter for stat in stats) * 1000,
+        'max_ms': max(stat.max_late for stat in stats) * 1000,
+        'resyncs': sum(stat.resyncs for stat in stats),
+        'cycles_ratio_min': min(cycles),
+        'cycles_ratio_max': max(cycles),
+    }
+
+    # 停止单个通道：该通道停止后不再注入，其他通道继续运行
+    latencies = []
+    injected_after_stop = 0
+    stopped = True
+    for i, (macro, channel) in enumerate(list(zip(macros, channels))[:8]):
+        token = channel.cancel_token
+        runner.executor.submit(runner.executor.STOP, macro)
+        deadline = time.perf_counter() + Config.THREAD_JOIN_TIMEOUT
+        while channel.running and time.perf_counter() < deadline:
+            time.sleep(0.0001)
+        if channel.running:
+            stopped = False
+            break
+        latencies.append(time.perf_counter() - token.requested_at)
+        injected_after_stop = max(injected_after_stop, sum(
+            1 for at, kind, name in list(backend.events)
+            if name == f'x{i}' and at >= token.requested_at and kind in (backend.TAP, backend.DOWN)))
+    quiet_from = time.perf_counter()
+    time.sleep(0.1)  # 之后的 100ms（长于最长周期）里其他通道仍在注入，已停止的通道没有
+    late = {name for at, kind, name in list(backend.events)
+            if at >= quiet_from and kind in (backend.TAP, backend.DOWN)}
+    stop_stats = percentiles(latencies)
+    stop_stats['within_bound'] = bool(latencies) and max(latencies) <= Config.STOP_LATENCY_BOUND
+    stop_stats['stopped'] = stopped
+    stop_stats['injected_after_stop'] = injected_after_stop
+    stop_stats['stopped_quiet'] = not late & {f'x{i}' for i in range(8)}
+    stop_stats['others_running'] = all(channel.running for channel in channels[8:])
+    stop_stats['others_injecting'] = {f'x{i}' for i in range(8, count)} <= late
+    results['stop_one'] = stop_stats
+
+    # 独占宏中断所有通道
+    runner.start_macro(by_name['独占'])
+    runner.executor.idle.wait(Config.THREAD_JOIN_TIMEOUT)
+    results['exclusive'] = {
+        'all_stopped': not runner.engine.running,
+        'stuck_keys': sum(len(channel.pressed_keys) + len(channel.pressed_buttons)
+                          for channel in runner.engine.channels.values()),
+    }
+    runner.executor.shutdown()
+    runner.control.stop()
+    return results
+
+
+def bench_trace() -> Dict[str, Any]:
+    """延迟追踪：关闭/开启时每个动作的开销、环形缓冲区覆盖、端到端报告与 JSON / CSV 导出"""
+    parser = MacroParser()
+    engine = parser.engine
+    macro_def = parser.parse_text_format(generate_rotation('trace', '1', 50))[0]
+    rounds = 2000
+    actions = len(macro_def.actions) * rounds
+
+    def run() -> None:
+        for _ in range(rounds):
+            engine.execute_macro(macro_def)
+
+    capacity = 4096
+    with config_override(KEY_PRESS_INTERVAL=0):
+        engine.tracer = None
+        results: Dict[str, Any] = {'disabled': measure(run, actions)}
+        engine.tracer = LatencyTracer(capacity)
+        results['enabled'] = measure(run, actions)
+    results['overhead_ns_per_action'] = (results['enabled']['ns_per_action'] -
+                                         results['disabled']['ns_per_action'])
+    results['ring'] = {'capacity': capacity, 'events_kept': len(engine.tracer.events())}
+
+    # 端到端：触发 -> 执行 -> 停止
+    path = write_config('[连招]\n触发键 = 1\n循环 = 是\n动作 =\n按下 q\n等待 20ms\n')
+    try:
+        runner = MacroRunner(path, trace=True)
+    finally:
+        remove_config(path)
+    macro = runner.macros[0]
+    for _ in range(10):
+        runner._on_trigger_press(macro)
+        time.sleep(0.1)
+        runner._on_trigger_release(macro)
+        runner.executor.stop(timeout=Config.THREAD_JOIN_TIMEOUT)
+    runner.executor.shutdown()
+    tracer = runner.engine.tracer
+    results['report'] = tracer.report()['连招']
+
+    exported = {}
+    for ext in ('json', 'csv'):
+        fd, export_path = tempfile.mkstemp(suffix=f'.{ext}')
+        os.close(fd)
+        try:
+            tracer.export(export_path)
+            with open(export_path, encoding='utf-8', newline='') as f:
+                if ext == 'json':
+                    exported[ext] = list(json.load(f)['macros']) == ['连招']
+                else:
+                    exported[ext] = len(list(csv.reader(f))) == 4  # 表头 + 3 个指标
+        finally:
+            os.remove(export_path)
+    results['export_ok'] = exported
+    return results
+
+
+def synthetic_session(rounds: int, jitter: float, seed: int = 7) -> List[Tuple[float, int, str]]:
+    """合成录制事件：按下 1~4 轮换 + 按住 shift（带系统自动重复）+ ctrl 组合键 + 左键，每轮之后空闲 5 秒
+
+    名义时间线（不含抖动）：轮换按键每 200ms 按下一次、按住 40ms；shift 按住 400ms。
+    """
+    rng = random.Random(seed)
+    events: List[Tuple[float, int, str]] = []
+    t = 0.0
+
+    def at(offset: float) -> float:
+        return t + offset + rng.uniform(-jitter, jitter)
+
+    for _ in range(rounds):
+        for i, key in enumerate('1234'):
+            down = at(i * 0.2)
+            events += [(down, InputRecorder.KEY_DOWN, key), (down + 0.04, InputRecorder.KEY_UP, key)]
+        events += [(t + 0.8, InputRecorder.KEY_DOWN, 'shift'), (t + 1.0, InputRecorder.KEY_DOWN, 'shift'),
+                   (t + 1.2, InputRecorder.KEY_UP, 'shift')]
+        events += [(t + 1.4, InputRecorder.KEY_DOWN, 'right ctrl'), (t + 1.45, InputRecorder.KEY_DOWN, 'c'),
+                   (t + 1.48, InputRecorder.KEY_UP, 'c'), (t + 1.5, InputRecorder.KEY_UP, 'right ctrl')]
+        events += [(t + 1.7, InputRecorder.BUTTON_DOWN, 'left'), (t + 1.75, InputRecorder.BUTTON_UP, 'left')]
+        t += 1.75 + 5.0
+    return events
+
+
+def bench_record() -> Dict[str, Any]:
+    """输入录制：钩子回调每个事件的开销、缓冲区写满后的行为、合成会话 -> 文本 -> 解析的往返"""
+    capacity = 1 << 16
+    recorder = InputRecorder(capacity, ignore_keys=[Config.HOTKEY_RECORD])
+    names = [chr(ord('a') + i % 26) for i in range(capacity)]
+    key_events = [key_event('down' if i % 2 == 0 else 'up', name) for i, name in enumerate(names)]
+    button_events = [types.SimpleNamespace(event_type='down' if i % 2 == 0 else 'up', button='left')
+                     for i in range(capacity // 2)]
+    on_key, on_mouse = recorder.on_key, recorder.on_mouse
+
+    start = time.perf_counter()
+    for event in key_events:
+        on_key(event)
+    key_elapsed = time.perf_counter() - start
+    recorder.clear()
+    start = time.perf_counter()
+    for event in button_events:
+        on_mouse(event)
+    mouse_elapsed = time.perf_counter() - start
+    for event in key_events:  # 缓冲区已写入一半，剩余事件写满后丢弃
+        on_key(event)
+    results: Dict[str, Any] = {
+        'ns_per_key_event': key_elapsed / len(key_events) * 1e9,
+        'ns_per_mouse_event': mouse_elapsed / len(button_events) * 1e9,
+        'full_buffer_kept': len(recorder.events()) == capacity,
+    }
+
+    # 往返：带 ±3ms 抖动的合成会话转换为文本，再用解析器读回
+    rounds = 20
+    recorder = InputRecorder(4096)
+    recorder.feed(synthetic_session(rounds, 0.003))
+    start = time.perf_counter()
+    text, stats = recorder.to_text('录制', 'F1')
+    results['to_text_ms'] = (time.perf_counter() - start) * 1000
+    results['stats'] = stats
+    macro_def = MacroParser().parse_text_format(text)[0]
+    actions = macro_def.actions
+    counts: Dict[str, int] = {}
+    for action in actions:
+        counts[action.type] = counts.get(action.type, 0) + 1
+    delays = [action.duration for action in actions if action.type == 'delay']
+    quantum_ms = round(Config.RECORD_QUANTUM * 1000)
+    results['parsed'] = counts
+    results['checks'] = {
+        'trigger': macro_def.trigger_key == 'f1',
+        'presses': counts.get('press') == rounds * 5,                      # 1~4 + c
+        'holds': counts.get('hold') == rounds,                             # shift（忽略自动重复）
+        'keydown_keyup': counts.get('keydown') == counts.get('keyup') == rounds,  # ctrl 包住 c
+        'clicks': counts.get('click') == rounds,
+        'quantized': all(round(d * 1000) % quantum_ms == 0 for d in delays),
+        'no_zero_waits': all(d > 0 for d in delays),
+        'idle_trimmed': max(delays) <= Config.RECORD_IDLE_GAP + 1e-9,
+        'rotation_gap': all(abs(d - 0.19) <= 0.011 for d in delays[:3]),  # 200ms - 按键间隔
+    }
+    return results
+
+
+class VirtualClock:
+    """手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def bench_buffer() -> Dict[str, Any]:
+    """输入缓冲调度：admit / pop 的开销（行为测试见 tests/test_scheduler.py）"""
+    clock = VirtualClock()
+    scheduler = InputScheduler(Config.INPUT_BUFFER_SIZE, clock)
+    macros = [Macro(f'm{i}', buffer_policy='queue', priority=i % 3) for i in range(8)]
+    rounds = 20000
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        scheduler.admit(macros[i % 8], busy=True)
+        clock.advance(0.001)
+        if i % 2:
+            scheduler.pop(Config.DEFAULT_CHANNEL)
+    elapsed = time.perf_counter() - start
+    return {
+        'ns_per_request': elapsed / rounds * 1e9,
+        'stats': dict(scheduler.stats),
+    }
+
+
+@config_override(KEY_PRESS_INTERVAL=0)
+def bench_held() -> Dict[str, Any]:
+    """按住状态：钩子线程不停按下/松开另一个触发键时，执行线程按住检查的单次耗时（锁 + 集合 vs 无锁字节数组）
+
+    无锁的收益在尾延迟（p99 / max），总耗时只作参考，两种方式基本相同。
+    """
+    parser = MacroParser()
+    engine = parser.engine
+    macro_def = parser.parse_text_format(generate_rotation('按住', '1', 50))[0]
+    rounds = 400
+    checks_per_round = 1 + sum(1 for op in macro_def.program.ops if op != OpCode.DELAY)
+    checks = rounds * checks_per_round
+
+    # 旧方式
+    lock = threading.Lock()
+    held_set = {'1'}
+
+    def legacy_press(key: str) -> None:
+        with lock:
+            held_set.add(key)
+
+    def legacy_release(key: str) -> None:
+        with lock:
+            held_set.discard(key)
+
+    # 新方式
+    held = HeldKeyState()
+    trigger_id, other_id = held.key_id('1'), held.key_id('2')
+    held.press(trigger_id)
+    states = held.states
+
+    samples: List[float] = []
+    clock = time.perf_counter
+
+    def make_checker(check: Callable[[], bool]) -> Callable[[], bool]:
+        remaining = [checks]
+        samples.clear()
+
+        def checker() -> bool:
+            start = clock()
+            held_now = check()
+            samples.append(clock() - start)
+            remaining[0] -= 1
+            return held_now and remaining[0] > 0
+        return checker
+
+    def legacy_check() -> bool:
+        with lock:
+            return '1' in held_set
+
+    def lockfree_check() -> bool:
+        return states[trigger_id] != 0
+
+    def run(check: Callable[[], bool], hammer: Optional[Callable[[threading.Event], int]]) -> Dict[str, float]:
+        done = threading.Event()
+        toggles = [0]
+        thread = None
+        if hammer is not None:
+            thread = threading.Thread(target=lambda: toggles.__setitem__(0, hammer(done)), daemon=True)
+            thread.start()
+        try:
+            result = measure(lambda: engine.execute_macro(macro_def, 'hold', key_state_checker=make_checker(check)),
+                             checks)
+        finally:
+            done.set()
+            if thread is not None:
+                thread.join()
+        result['hook_toggles'] = toggles[0]
+        result['check_us'] = percentiles(samples, 1e6)
+        return result
+
+    def legacy_hammer(done: threading.Event) -> int:
+        count = 0
+        while not done.is_set():
+            legacy_press('2')
+            legacy_release('2')
+            count += 1
+        return count
+
+    def lockfree_hammer(done: threading.Event) -> int:
+        count = 0
+        while not done.is_set():
+            held.press(other_id)
+            held.release(other_id)
+            count += 1
+        return count
+
+    results: Dict[str, Any] = {
+        'legacy_idle': run(legacy_check, None),
+        'legacy_contended': run(legacy_check, legacy_hammer),
+        'lockfree_idle': run(lockfree_check, None),
+        'lockfree_contended': run(lockfree_check, lockfree_hammer),
+    }
+    legacy_us, lockfree_us = results['legacy_contended']['check_us'], results['lockfree_contended']['check_us']
+    for q in ('p99', 'max'):
+        results[f'contended_{q}_ratio'] = legacy_us[q] / lockfree_us[q]
+    results['trigger_still_held'] = held.is_held(trigger_id) and not held.is_held(other_id)
+    return results
+
+
+def bench_resolve() -> Dict[str, Any]:
+    """按键名解析：每次按键都由 keyboard 库解析按键名字符串 vs 加载时解析一次、注入时查缓存"""
+    import keyboard
+    names = ['q', 'keypad 1', 'ctrl+1', 'shift', 'page up', 'f5']
+    rounds = 20000
+    presses = rounds * len(names)
+
+    def legacy() -> None:
+        for _ in range(rounds):
+            for name in names:
+                keyboard.press_and_release(name)
+
+    backend = KeyboardMouseBackend()
+
+    def resolved() -> None:
+        tap = backend.tap
+        for _ in range(rounds):
+            for name in names:
+                tap(name)
+
+    results: Dict[str, Any] = {
+        'legacy': measure(legacy, presses),
+        'resolved': measure(resolved, presses),
+    }
+    results['speedup'] = results['legacy']['seconds'] / results['resolved']['seconds']
+
+    # 加载时报告未知按键；重载后不再查找已解析的按键
+    InputStub.unmapped.add('nosuchkey')
+    config = ('[连招]\n触发键 = 1\n附加按键 = shift\n动作 =\n  按下 q  按下 nosuchkey\n'
+              '  按下 小键盘1\n  hold ctrl+1 50ms\n')
+    path = write_config(config)
+    messages: List[str] = []
+    real_warning = Logger.__dict__['warning']
+    Logger.warning = staticmethod(lambda msg, *args, **kwargs: messages.append(msg))
+    try:
+        runner = MacroRunner(path, watch_config=False)
+        lookups = InputStub.lookups
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('[新宏]\n触发键 = 2\n动作 =\n  按下 q\n')
+        runner.reload_config()
+        reload_lookups = InputStub.lookups - lookups
+    finally:
+        Logger.warning = real_warning
+        InputStub.unmapped.discard('nosuchkey')
+        remove_config(path)
+    runner.executor.shutdown()
+
+    InputStub.injected = 0
+    runner.engine.backend.tap('nosuchkey')
+    results['checks'] = {
+        'unknown_reported': sum('nosuchkey' in m for m in messages) >= 1,
+        'known_not_reported': not any("'q'" in m or 'keypad 1' in m for m in messages),
+        'unknown_skipped': InputStub.injected == 0,
+        'reload_lookups': reload_lookups,  # 重载时新查找的按键数（已解析的按键直接命中缓存）
+        'combo_codes': len(KeyResolver().resolve('ctrl+1')) == 2,
+    }
+    return results
+
+
+def bench_focus() -> Dict[str, Any]:
+    """窗口焦点：每个动作轮询前台窗口 vs 读取跟踪线程缓存；焦点丢失到宏停止的延迟"""
+    source = FakeWindowSource('Diablo IV')
+    monitor = WindowMonitor(['Diablo IV', '暗黑破坏神IV'], source)
+    parser = MacroParser(monitor)
+    engine = parser.engine
+    monitor.add_focus_lost_listener(engine.on_focus_lost)
+    macro_def = parser.parse_text_format(generate_rotation('focus', '1', 50, 200))[0]
+
+    # 每个动作的焦点检查开销（轮询模式相当于每次都走一遍 refresh）
+    rounds = 20000
+    calls = source.calls
+    poll = measure(lambda: [monitor.refresh() for _ in range(rounds)], rounds)
+    cached = measure(lambda: [monitor.target_active for _ in range(rounds)], rounds)
+    source_calls = source.calls - calls
+
+    # 焦点丢失到宏停止的延迟
+    latencies = []
+    rng = random.Random(3)
+    for _ in range(20):
+        source.title = 'Diablo IV'
+        monitor.refresh()
+        worker = threading.Thread(target=engine.execute_macro, args=(macro_def, 'loop'))
+        worker.start()
+        time.sleep(rng.uniform(0.01, 0.05))
+        lost_at = time.perf_counter()
+        source.title = '桌面'
+        worker.join()
+        latencies.append(time.perf_counter() - lost_at)
+    monitor.stop()
+
+    return {
+        'poll_ns_per_check': poll['ns_per_action'],
+        'cached_ns_per_check': cached['ns_per_action'],
+        'source_calls_while_polling': source_calls,
+        'focus_lost_to_stop': percentiles(latencies),
+        'bound_ms': Config.WINDOW_FOCUS_CHECK_INTERVAL * 1000,
+    }
+
+
+def thread_switches(thread: threading.Thread) -> Optional[int]:
+    """线程的上下文切换次数（主动 + 被动，即被唤醒的次数）；没有 /proc 时返回 None"""
+    try:
+        with open(f'/proc/self/task/{thread.native_id}/status', encoding='ascii') as f:
+            fields = dict(line.split(':', 1) for line in f if 'ctxt_switches' in line)
+    except OSError:
+        return None
+    return int(fields['voluntary_ctxt_switches']) + int(fields['nonvoluntary_ctxt_switches'])
+
+
+def bench_idle() -> Dict[str, Any]:
+    """空闲：60 秒内没有任何输入时各后台线程每秒的唤醒次数（旧的 sleep 主循环 + 常驻焦点轮询 vs 阻塞等待）"""
+    period = 60.0
+    path = write_config('[连招]\n触发键 = 1\n动作 =\n按下 q\n等待 50ms\n')
+    sources: Dict[str, FakeWindowSource] = {}
+    runners: Dict[str, MacroRunner] = {}
+    mains: Dict[str, threading.Thread] = {}
+    try:
+        for executor in EXECUTORS:
+            sources[executor] = FakeWindowSource('Diablo IV')
+            runner = runners[executor] = MacroRunner(path, ['Diablo IV'], sources[executor],
+                                                     watch_config=False, executor=executor)
+            mains[executor] = threading.Thread(target=runner.start, name=f'main-{executor}')
+            mains[executor].start()
+    finally:
+        remove_config(path)
+
+    # 旧的空闲方式：主线程每 0.1 秒醒一次，焦点跟踪线程一直轮询
+    legacy_stop = threading.Event()
+
+    def legacy_main() -> None:
+        while not legacy_stop.is_set():
+            time.sleep(0.1)
+
+    legacy_source = FakeWindowSource('Diablo IV')
+    legacy_monitor = WindowMonitor(['Diablo IV'], legacy_source)
+    legacy_thread = threading.Thread(target=legacy_main, name='legacy-main')
+    legacy_thread.start()
+
+    # 执行一次宏：执行期间焦点跟踪恢复，结束后重新暂停
+    busy_calls = {}
+    for executor, runner in runners.items():
+        calls = sources[executor].calls
+        runner.start_macro(runner.macros[0])
+        time.sleep(0.3)
+        runner.executor.idle.wait(1.0)
+        busy_calls[executor] = sources[executor].calls - calls
+    time.sleep(0.2)
+
+    threads: Dict[str, Dict[str, threading.Thread]] = {
+        executor: {'main': mains[executor], 'executor': runner.executor.thread,
+                   'control': runner.control.thread, 'focus_tracker': runner.window_monitor._thread}
+        for executor, runner in runners.items()}
+    threads['legacy'] = {'main': legacy_thread, 'focus_tracker': legacy_monitor._thread}
+    before = {group: {name: thread_switches(t) for name, t in members.items()}
+              for group, members in threads.items()}
+    idle_calls = {executor: source.calls for executor, source in sources.items()}
+    time.sleep(period)
+    after = {group: {name: thread_switches(t) for name, t in members.items()}
+             for group, members in threads.items()}
+    idle_calls = {executor: sources[executor].calls - calls for executor, calls in idle_calls.items()}
+
+    for runner in runners.values():
+        runner.stop()
+    legacy_stop.set()
+    legacy_monitor.stop()
+    for thread in list(mains.values()) + [legacy_thread]:
+        thread.join(5)
+
+    results: Dict[str, Any] = {'period_s': period}
+    for group, members in threads.items():
+        if before[group]['main'] is None:
+            results[group] = 'no /proc (wakeups not measured)'
+            continue
+        per_second = {name: (after[group][name] - before[group][name]) / period for name in members}
+        per_second['total'] = sum(per_second.values())
+        results[group] = {'wakeups_per_s': per_second}
+    results['checks'] = {
+        'tracker_polled_while_busy': all(calls > 0 for calls in busy_calls.values()),
+        'tracker_paused_when_idle': all(calls == 0 for calls in idle_calls.values()),
+        'stopped_from_other_thread': all(runner.stopped.is_set() and not mains[executor].is_alive()
+                                         for executor, runner in runners.items()),
+    }
+    return results
+
+
+@config_override(KEY_PRESS_INTERVAL=0)
+def bench_backend() -> Dict[str, Any]:
+    """输入后端：逐个注入 vs 批量注入（多键按下 + 附加按键按下/松开）"""
+    text = ('[批量]\n触发键 = 1\n重置按键 = 是\n动作 =\n'
+            '  按下 q,w,e,r\n  按下 a、s、d、f\n  左键\n')
+    additional_keys = ['shift', 'ctrl', 'alt']
+    rounds = 5000
+    results: Dict[str, Any] = {}
+
+    for name, backend in (('keyboard', KeyboardMouseBackend()), ('batched', BatchedBackend()),
+                          ('recording', RecordingBackend())):
+        parser = MacroParser()
+        parser.engine.backend = backend
+        macro_def = parser.parse_text_format(text)[0]
+        program = macro_def.program
+        events = sum(len(g) for g in program.groups) + 1 + 2 * len(additional_keys)
+
+        def cycle() -> None:
+            for _ in range(rounds):
+                backend.press_keys(additional_keys)
+                parser.engine.run_program(program)
+                backend.release_keys(additional_keys)
+
+        calls = InputStub.injected
+        result = measure(cycle, events * rounds)
+        result['library_calls_per_cycle'] = (InputStub.injected - calls) / rounds
+        result['events_per_cycle'] = events
+        if isinstance(backend, RecordingBackend):
+            result['submits_per_cycle'] = len(backend.batches) / rounds
+        results[name] = result
+
+    return results
+
+
+def bench_cache() -> Dict[str, Any]:
+    """配置缓存：冷启动（解析 + 写缓存）vs 热启动（读缓存），损坏回退、设置变化失效、解析期间写入不缓存、警告重放"""
+    macro_count, presses = 600, 10
+    content = ''.join(generate_rotation(f'宏{i}', f'f{i % 12 + 1}', presses, 50)
+                      for i in range(macro_count))
+    path = write_config(content)
+    cache_path = ConfigCache(path).path
+    parser = MacroParser()
+    rounds = 5
+
+    def timed(use_cache: bool, clear: bool) -> float:
+        best = float('inf')
+        for _ in range(rounds):
+            if clear and os.path.exists(cache_path):
+                os.remove(cache_path)
+            start = time.perf_counter()
+            parser.load_file(path, use_cache=use_cache)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    try:
+        no_cache = timed(False, False)
+        cold = timed(True, True)
+        warm = timed(True, False)
+
+        parsed = parser.load_file(path, use_cache=False)
+        cached = parser.load_file(path)
+        identical = (len(parsed) == len(cached) and all(
+            a.trigger_key == b.trigger_key and
+            a.program.disassemble() == b.program.disassemble()
+            for a, b in zip(parsed, cached)))
+
+        # 截断缓存文件，应回退到完整解析并重写缓存
+        with open(cache_path, 'r+b') as f:
+            f.truncate(os.path.getsize(cache_path) // 2)
+        recovered = len(parser.load_file(path)) == macro_count
+        rewritten = ConfigCache(path).load(ConfigCache.make_key(content.encode('utf-8'))) is not None
+
+        # 缓存内容取决于解析、优化和定时分析读取的设置，修改任一项后键随之变化
+        key = ConfigCache.file_key(path)
+        settings_invalidate = {}
+        for name in ConfigCache.SETTINGS:
+            saved = getattr(Config, name)
+            with config_override(**{name: saved + 'x' if isinstance(saved, str) else saved * 2 + 1}):
+                settings_invalidate[name] = ConfigCache.file_key(path) != key
+
+        # 解析期间文件被改写：不能把新内容以任何键写入缓存
+        os.remove(cache_path)
+        stat = os.stat(path)
+        macros = parser.iter_file(path)
+        next(macros)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(generate_rotation('新宏', 'f1', 2, 10))
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        list(macros)
+        race_not_cached = not os.path.exists(cache_path)
+    finally:
+        remove_config(path)
+
+    # 解析警告随缓存保存，热启动时重新输出
+    path = write_config('[坏]\n触发键 = 1\n动作 =\n跳跃 w  按下 q\n[零]\n触发键 = 2\n重复 = 0\n动作 =\n按下 e\n')
+    outputs = []
+    try:
+        for _ in range(2):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                parser.load_file(path, use_cache=True)
+            outputs.append(output.getvalue())
+        warm_hit = os.path.exists(ConfigCache(path).path)
+    finally:
+        remove_config(path)
+
+    return {
+        'lines': content.count('\n'),
+        'no_cache_ms': no_cache * 1000,
+        'cold_ms': cold * 1000,
+        'warm_ms': warm * 1000,
+        'speedup': no_cache / warm,
+        'checks': {
+            'identical': identical,
+            'corrupt_recovered': recovered and rewritten,
+            'settings_invalidate': all(settings_invalidate.values()),
+            'modified_during_parse_not_cached': race_not_cached,
+            'warnings_replayed': warm_hit and outputs[0].count('警告') == 2 and outputs[1] == outputs[0],
+        },
+    }
+
+
+def bench_reload() -> Dict[str, Any]:
+    """重载：全部重新绑定 vs 增量重载（修改一个宏的延迟），以及文件监视的防抖合并"""
+    macro_count = 200
+    sections = [generate_rotation(f'宏{i}', f'k{i}', 4, 50) for i in range(macro_count)]
+    path = write_config(''.join(sections))
+    results: Dict[str, Any] = {}
+    try:
+        runner = MacroRunner(path, watch_config=False)
+        runner.setup_hotkeys()
+        middle = macro_count // 2
+
+        # 统计分发表的绑定/解绑次数
+        counts = {'bind': 0, 'unbind': 0}
+        bind, unbind = runner.dispatcher.bind, runner.dispatcher.unbind
+
+        def counting_bind(*args: Any) -> Any:
+            counts['bind'] += 1
+            return bind(*args)
+
+        def counting_unbind(keys: Any) -> None:
+            counts['unbind'] += 1
+            unbind(keys)
+
+        runner.dispatcher.bind, runner.dispatcher.unbind = counting_bind, counting_unbind
+
+        def edit(index: int, delay_ms: int) -> None:
+            sections[index] = generate_rotation(f'宏{index}', f'k{index}', 4, delay_ms)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(''.join(sections))
+
+        # 旧路径：重新解析并重新绑定所有热键（两条路径的解析相同，分开计时）
+        edit(middle, 80)
+        bound = counts['bind']
+        start = time.perf_counter()
+        macros = runner.parser.load_file(path)
+        parsed = time.perf_counter()
+        runner.macros = macros
+        runner._build_hotkey_map()
+        runner.setup_hotkeys()
+        done = time.perf_counter()
+        results['full'] = {'ms': (done - start) * 1000, 'parse_ms': (parsed - start) * 1000,
+                           'rebind_ms': (done - parsed) * 1000, 'hotkeys_bound': counts['bind'] - bound}
+
+        # 增量：修改中间一个宏的延迟，正在运行的循环不应受影响
+        runner.start_macro(runner.macros[0])
+        time.sleep(0.05)
+        running = runner.engine.channel.macro
+        token = runner.engine.cancel_token
+        edit(middle, 90)
+        bound, unbound = counts['bind'], counts['unbind']
+        start = time.perf_counter()
+        macros = runner.parser.load_file(path)
+        parsed = time.perf_counter()
+        diff = runner._apply_macros(macros)
+        done = time.perf_counter()
+        results['incremental'] = {
+            'ms': (done - start) * 1000,
+            'parse_ms': (parsed - start) * 1000,
+            'apply_ms': (done - parsed) * 1000,
+            'diff': dict(zip(('added', 'changed', 'removed', 'unchanged'), diff)),
+            'hotkeys_bound': counts['bind'] - bound,
+            'hotkeys_unbound': counts['unbind'] - unbound,
+            'loop_kept_running': (running is not None and not token.is_set() and
+                                  runner.engine.channel.macro is running),
+        }
+
+        # 修改正在运行的宏：应被停止
+        edit(0, 80)
+        runner.reload_config()
+        results['incremental']['changed_loop_stopped'] = token.is_set()
+        runner.executor.shutdown()
+        runner.control.stop()
+        results['checks'] = {
+            'apply_cheaper_than_rebind': results['incremental']['apply_ms'] < results['full']['rebind_ms'],
+            'only_changed_rebound': (results['incremental']['hotkeys_bound'],
+                                     results['incremental']['hotkeys_unbound']) == (1, 1),
+            'loop_kept_running': results['incremental']['loop_kept_running'],
+            'changed_loop_stopped': results['incremental']['changed_loop_stopped'],
+        }
+
+        # 文件监视：0.4 秒内 5 次写入只触发一次重载（虚拟时钟）
+        now = [0.0]
+        fired: List[float] = []
+        watcher = ConfigWatcher(path, lambda: fired.append(now[0]), interval=0,
+                                debounce=0.5, clock=lambda: now[0])
+        mtime = os.stat(path).st_mtime_ns
+        for i in range(5):
+            now[0] = i * 0.1
+            os.utime(path, ns=(mtime + (i + 1) * 10 ** 6, mtime + (i + 1) * 10 ** 6))
+            watcher.poll()
+        for t in (0.6, 0.95, 1.2, 2.0):
+            now[0] = t
+            watcher.poll()
+        results['watcher'] = {'writes': 5, 'reloads': len(fired),
+                              'reload_at_s': fired[0] if fired else None}
+    finally:
+        remove_config(path)
+    return results
+
+
+def legacy_translate(text: str) -> str:
+    """旧的翻译：依次查中文映射和英文同义词两张表"""
+    result = LanguageMapping.ZH_CN.get(text, text)
+    return LanguageMapping.EN_SYNONYMS.get(result, result)
+
+
+def legacy_parse_action_line(parser: MacroParser, line: str) -> List[Dict[str, Any]]:
+    """旧的动作行解析：每个关键字都重新扫描并翻译后续所有词（与原 _parse_action_line 一致）"""
+    parts = line.split('#')[0].split()
+    actions: List[Dict[str, Any]] = []
+    i = 0
+    while i < len(parts):
+        action_parser = parser._action_parsers.get(legacy_translate(parts[i]))
+        if action_parser:
+            next_action_idx = None
+            for j in range(i + 1, len(parts)):
+                if legacy_translate(parts[j]) in parser._action_parsers:
+                    next_action_idx = j
+                    break
+            result = action_parser(parts[i:next_action_idx] if next_action_idx else parts[i:])
+            if result:
+                actions.extend(result if isinstance(result, list) else [result])
+            i = next_action_idx if next_action_idx else len(parts)
+        else:
+            i += 1
+    return actions
+
+
+def generate_long_line(commands: int) -> str:
+    """生成一行包含大量指令的循环"""
+    pattern = ['按下 q', '等待 5ms', '左键', '按住 shift', '按下 a,s,d', 'wait 10ms', '松开 shift']
+    return '  '.join(pattern[i % len(pattern)] for i in range(commands))
+
+
+def bench_parse() -> Dict[str, Any]:
+    """动作行解析：旧的逐关键字重扫 vs 单遍词法分析（万行配置 + 超长单行循环）"""
+    lines = []
+    for i in range(1000):
+        lines += [f'[宏{i}]', f'触发键 = f{i % 12 + 1}', '循环 = 是', '动作 =']
+        lines += [f'  按下 {k}  等待 5ms  左键  # 第 {k} 步' for k in 'qwertyui']
+        lines += ['  按下 1、2、3  wait 20ms', '  按住 shift', '  松开 shift']
+    content = '\n'.join(lines)
+    action_lines = [line for line in lines
+                    if line.strip() and not line.startswith('[') and '=' not in line]
+
+    parser = MacroParser()
+    results: Dict[str, Any] = {'lines': len(lines)}
+
+    def compare(sample: List[str], rounds: int) -> Dict[str, Any]:
+        # 两种实现的 group 编号方式相同，每次解析前重置计数器
+        def parse_both(line: str) -> bool:
+            parser._press_group_seq = 0
+            legacy = legacy_parse_action_line(parser, line)
+            parser._press_group_seq = 0
+            return legacy == parser._parse_action_line(line)
+
+        identical = all(parse_both(line) for line in sample)
+        timings = {}
+        for name, func in (('legacy', lambda line: legacy_parse_action_line(parser, line)),
+                           ('lexer', parser._parse_action_line)):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for line in sample:
+                    func(line)
+            timings[f'{name}_ms'] = (time.perf_counter() - start) * 1000 / rounds
+        timings['speedup'] = timings['legacy_ms'] / timings['lexer_ms']
+        timings['identical'] = identical
+        return timings
+
+    results['config_action_lines'] = compare(action_lines, 3)
+    start = time.perf_counter()
+    parser.parse_text_format(content)
+    results['config_full_parse_ms'] = (time.perf_counter() - start) * 1000
+
+    for commands in (500, 2000, 8000):
+        results[f'single_line_{commands}'] = compare([generate_long_line(commands)], 1)
+
+    # 注释只在动作行和配置值之后生效：配置值本身可以是 #
+    hash_key, commented = parser.parse_text_format(
+        '[井号]\n触发键 = #\n动作 =\n按下 q\n'
+        '[注释]  # 段注释\n触发键 = f1  # 注释\n循环 = 是 # 注释\n动作 =  # 注释\n按下 w  # a=b\n')
+    results['checks'] = {
+        'hash_config_value': hash_key.trigger_key == '#',
+        'trailing_comments': ((commented.name, commented.trigger_key, commented.repeat_mode) ==
+                              ('注释', 'f1', 'loop') and [a.key for a in commented.actions] == ['w']),
+    }
+    return results
+
+
+def bench_throughput() -> Dict[str, Any]:
+    """生成配置的解析吞吐量：文本格式（行/秒、宏/秒）与 XML 导出格式（事件/秒、宏/秒）"""
+    results: Dict[str, Any] = {}
+    parser = MacroParser()
+    text_macros, xml_macros, xml_events = 2000, 500, 60
+    text = ''.join(generate_rotation(f'宏{i}', f'k{i}', 12, 20) for i in range(text_macros))
+    cases = (('text', text, text.count('\n'), 'lines'),
+             ('xml', generate_xml_export(xml_macros, xml_events), xml_macros * xml_events, 'events'))
+    for name, content, units, unit_name in cases:
+        path = write_config(content)
+        try:
+            start = time.perf_counter()
+            count = sum(1 for _ in parser.iter_file(path, use_cache=False))
+            elapsed = time.perf_counter() - start
+        finally:
+            remove_config(path)
+        results[name] = {
+            'ms': elapsed * 1000,
+            f'{unit_name}_per_sec': units / elapsed,
+            'macros_per_sec': count / elapsed,
+            'macros': count,
+        }
+    return results
+
+
+def bench_stream() -> Dict[str, Any]:
+    """流式解析：整体读取再解析 vs 逐行解析（峰值内存、首个宏可用时间、总时间）"""
+    macro_count = 5000
+    path = write_config(''.join(generate_rotation(f'宏{i}', f'k{i}', 12, 20)
+                                for i in range(macro_count)))
+    parser = MacroParser()
+    results: Dict[str, Any] = {'file_kb': os.path.getsize(path) / 1024, 'macros': macro_count}
+
+    def whole_file() -> Any:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from parser.parse_text_format(f.read())
+
+    def streaming() -> Any:
+        return parser.iter_file(path, use_cache=False)
+
+    try:
+        for name, source in (('whole_file', whole_file), ('streaming', streaming)):
+            # 计时（不开启 tracemalloc）
+            start = time.perf_counter()
+            first = None
+            count = 0
+            for _ in source():
+                if first is None:
+                    first = time.perf_counter() - start
+                count += 1
+            total = time.perf_counter() - start
+
+            # 峰值内存：逐个丢弃产出的宏，只统计解析过程本身的占用
+            tracemalloc.start()
+            for _ in source():
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = {'first_macro_ms': first * 1000, 'total_ms': total * 1000,
+                             'peak_kb': peak / 1024, 'macros': count}
+
+        # 边解析边注册热键：第一个触发键可用的时间
+        runner = MacroRunner(path, watch_config=False, defer_load=True)
+        hooked: List[float] = []
+        hook_trigger = runner._hook_trigger
+        runner._hook_trigger = lambda key, macro: (hooked.append(time.perf_counter()),
+                                                   hook_trigger(key, macro))
+        start = time.perf_counter()
+        runner.setup_hotkeys()
+        runner.load_config(register_hotkeys=True)
+        results['progressive_hotkeys'] = {'first_hotkey_ms': (hooked[0] - start) * 1000,
+                                          'all_hotkeys_ms': (hooked[-1] - start) * 1000,
+                                          'hotkeys': len(runner.trigger_hooks)}
+        runner.executor.shutdown()
+    finally:
+        remove_config(path)
+    return results
+
+
+def generate_xml_export(macro_count: int, events: int) -> str:
+    """生成鼠标/键盘驱动导出格式的 XML 宏库"""
+    codes = sorted(MacroEngine.SCAN_CODE_MAP)
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n<Root><MacroList>\n']
+    for i in range(macro_count):
+        syntax = []
+        for j in range(events):
+            if j % 10 == 9:
+                syntax += ['LeftDown 1', 'Delay 15 ms', 'LeftUp 1']
+            else:
+                code = codes[(i * events + j) % len(codes)]
+                syntax += [f'KeyDown {code} 1', 'Delay 10 ms', f'KeyUp {code} 1']
+        parts.append(f'<DefaultMacro><Major>宏{i}</Major><Description>导出 {i}</Description>'
+                     f'<KeyDown><Syntax>\n' + '\n'.join(syntax) + '\n</Syntax></KeyDown>'
+                     f'<RepeatType>{i % 3}</RepeatType></DefaultMacro>\n')
+    parts.append('</MacroList></Root>\n')
+    return ''.join(parts)
+
+
+def bench_xml() -> Dict[str, Any]:
+    """XML 导入：整棵树解析 vs iterparse 增量解析（峰值内存、首个宏、扫描码覆盖、鼠标按下/松开）"""
+    content = generate_xml_export(2000, 60)
+    path = write_config(content)
+    parser = MacroParser()
+    results: Dict[str, Any] = {'file_kb': os.path.getsize(path) / 1024}
+
+    def whole_tree() -> Any:
+        # 旧路径：整个文档载入内存后 findall
+        with open(path, 'r', encoding='utf-8') as f:
+            root = ET.fromstring(f.read())
+        for elem in root.findall('.//DefaultMacro'):
+            yield parser._build_xml_macro(elem, set())
+
+    def streaming() -> Any:
+        return parser.iter_xml_format(path)
+
+    try:
+        for name, source in (('whole_tree', whole_tree), ('iterparse', streaming)):
+            start = time.perf_counter()
+            first = None
+            macros = []
+            for macro in source():
+                if first is None:
+                    first = time.perf_counter() - start
+                macros.append(macro)
+            total = time.perf_counter() - start
+
+            tracemalloc.start()
+            for _ in source():
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = {'first_macro_ms': first * 1000, 'total_ms': total * 1000,
+                             'peak_kb': peak / 1024, 'macros': len(macros)}
+
+        # 扫描码覆盖：旧表只有 8 个扫描码，其余 KeyDown/KeyUp 被丢弃
+        legacy_codes = {30, 31, 32, 33, 17, 44, 45, 46}
+        key_events = [int(line.split()[1]) for line in content.split('\n')
+                      if line.startswith(('KeyDown', 'KeyUp'))]
+        actions = [a for m in macros for a in m.actions]
+        results['key_events'] = len(key_events)
+        results['legacy_recognized'] = sum(1 for code in key_events if code in legacy_codes)
+        results['recognized'] = sum(1 for a in actions if a.type in ('keydown', 'keyup'))
+        results['mouse_down_up_balanced'] = (
+            sum(1 for a in actions if a.type == 'mousedown') ==
+            sum(1 for a in actions if a.type == 'mouseup') > 0)
+
+        # 执行一个导入的宏：鼠标按钮按下后必须松开，停止时不能残留
+        engine = MacroEngine(backend=RecordingBackend())
+        with config_override(KEY_PRESS_INTERVAL=0):
+            engine.execute_macro(engine.build_macro({'name': macros[0].name, 'actions': macros[0].actions[:40]}))
+        results['stuck_buttons'] = len(engine.pressed_buttons)
+    finally:
+        remove_config(path)
+    return results
+
+
+def key_event(event_type: str, name: str, at: float = 0.0) -> Any:
+    """构造 keyboard 钩子事件"""
+    return types.SimpleNamespace(event_type=event_type, name=name, time=at,
+                                 scan_code=InputStub.key_to_scan_codes(name)[0])
+
+
+def dispatch_checks() -> Dict[str, bool]:
+    """组合键状态机的行为检查"""
+    fired: List[str] = []
+    dispatcher = HotkeyDispatcher()
+    dispatcher.bind('f', lambda: fired.append('f'))
+    dispatcher.bind('ctrl+shift+f', lambda: fired.append('ctrl+shift+f'))
+    dispatcher.bind('g', lambda: fired.append('g down'), lambda: fired.append('g up'))
+
+    def feed(*events: Tuple[str, str, float]) -> List[str]:
+        fired.clear()
+        for event_type, name, at in events:
+            dispatcher.dispatch(key_event(event_type, name, at))
+        return fired[:]
+
+    return {
+        'plain_key': feed(('down', 'f', 0), ('up', 'f', 0)) == ['f'],
+        'plain_key_with_other_modifier': feed(('down', 'ctrl', 0), ('down', 'f', 0), ('up', 'f', 0),
+                                              ('up', 'ctrl', 0)) == ['f'],
+        'chord_exact_match': feed(('down', 'left ctrl', 0), ('down', 'shift', 0), ('down', 'f', 0),
+                                  ('up', 'ctrl', 0), ('up', 'shift', 0), ('up', 'f', 0))
+        == ['ctrl+shift+f'],
+        'release_routed_after_modifiers': feed(('down', 'ctrl', 0), ('down', 'g', 0), ('up', 'ctrl', 0),
+                                               ('up', 'g', 0)) == ['g down', 'g up'],
+        'autorepeat_suppressed': feed(('down', 'g', 0), ('down', 'g', 0.5), ('down', 'g', 0.53),
+                                      ('up', 'g', 0.6)) == ['g down', 'g up'],
+        'lost_release_recovers': feed(('down', 'g', 10), ('down', 'g', 12)) == ['g down', 'g down'],
+        'unbound_key_ignored': (feed(('up', 'g', 13), ('down', 'h', 13), ('up', 'h', 13)) == ['g up'] and
+                                not dispatcher._active),
+    }
+
+
+def bench_dispatch() -> Dict[str, Any]:
+    """热键分发：每个事件的分发开销（10 / 100 / 1000 个触发键，不慢于每键一个钩子）与组合键状态机检查"""
+    rng = random.Random(3)
+    results: Dict[str, Any] = {'checks': dispatch_checks()}
+    event_count = 200000
+
+    for triggers in (10, 100, 1000):
+        names = [f'k{i}' for i in range(triggers)]
+        hotkeys = [('ctrl+' if i % 3 == 0 else '') + name for i, name in enumerate(names)]
+        hits = [0]
+
+        def hit() -> None:
+            hits[0] += 1
+
+        dispatcher = HotkeyDispatcher()
+        for hotkey in hotkeys:
+            dispatcher.bind(hotkey, hit)
+
+        # keyboard 库的 on_press_key：按扫描码分组的回调列表，每个回调自己过滤事件类型
+        legacy: Dict[int, List[Callable[[Any], None]]] = {}
+        for name in names:
+            code = InputStub.key_to_scan_codes(name)[0]
+            legacy.setdefault(code, []).append(lambda e: e.event_type == 'down' and hit())
+
+        # 事件流：已绑定的键、未绑定的键、偶尔按住 ctrl
+        events = []
+        pool = names + [f'u{i}' for i in range(50)]
+        while len(events) < event_count:
+            name = rng.choice(pool)
+            chord = rng.random() < 0.2
+            if chord:
+                events.append(key_event('down', 'ctrl'))
+            events += [key_event('down', name), key_event('up', name)]
+            if chord:
+                events.append(key_event('up', 'ctrl'))
+
+        # 两条路径交替运行三次，各取最快的一次
+        timings = {}
+        for _ in range(3):
+            for label, handle in (('legacy_per_key_hooks',
+                                   lambda e: [h(e) for h in legacy.get(e.scan_code, ())]),
+                                  ('dispatcher', dispatcher.dispatch)):
+                start = time.perf_counter()
+                for event in events:
+                    handle(event)
+                elapsed = (time.perf_counter() - start) * 1e9 / len(events)
+                metric = f'{label}_ns_per_event'
+                timings[metric] = min(timings.get(metric, elapsed), elapsed)
+        timings['bindings'] = len(dispatcher.table)
+        results[f'triggers_{triggers}'] = timings
+        results['checks'][f'not_slower_{triggers}'] = (timings['dispatcher_ns_per_event'] <=
+                                                        timings['legacy_per_key_hooks_ns_per_event'])
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    'vm': bench_vm,
+    'engine': bench_engine,
+    'optimize': bench_optimize,
+    'analyze': bench_analyze,
+    'model': bench_model,
+    'timing': bench_timing,
+    'trigger': bench_trigger,
+    'stop': bench_stop,
+    'control': bench_control,
+    'channels': bench_channels,
+    'trace': bench_trace,
+    'buffer': bench_buffer,
+    'held': bench_held,
+    'resolve': bench_resolve,
+    'record': bench_record,
+    'focus': bench_focus,
+    'idle': bench_idle,
+    'backend': bench_backend,
+    'cache': bench_cache,
+    'reload': bench_reload,
+    'parse': bench_parse,
+    'throughput': bench_throughput,
+    'stream': bench_stream,
+    'xml': bench_xml,
+    'dispatch': bench_dispatch,
+}
+
+
+def print_results(results: Dict[str, Any], indent: str = '  ') -> None:
+    """打印基准结果"""
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f"{indent}{key}:")
+            print_results(value, indent + '  ')
+        elif isinstance(value, float):
+            print(f"{indent}{key}: {value:,.3f}")
+        else:
+            print(f"{indent}{key}: {value}")
+
+
+# ========================================
+# 机器可读结果与基线比较
+# ========================================
+HIGHER_IS_BETTER = re.compile(r'(_per_sec|speedup)$')
+LOWER_IS_BETTER = re.compile(r'(^|_)(ms|kb|seconds|p50|p95|p99|max|stuck_keys)$|^ns_per')
+NOISY_METRICS = re.compile(r'(^|_)(p99|max)(_ms)?$')  # 尾部延迟在共享机器上波动很大，默认不比较
+MIN_DELTA = 0.05  # 小于此绝对差值的变化视为噪声（毫秒级指标约 50 微秒）
+
+
+def flatten(results: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    """把嵌套结果展开为 a.b.c 形式的扁平字典"""
+    flat: Dict[str, Any] = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        else:
+            flat[path] = value
+    return flat
+
+
+def failed_checks(results: Dict[str, Any]) -> List[str]:
+    """返回结果中 checks 下为 False 的检查项"""
+    return [path for path, value in flatten(results).items()
+            if value is False and 'checks' in path.split('.')]
+
+
+def find_regressions(current: Dict[str, Any], baseline: Dict[str, Any],
+                     tolerance: float, strict: bool = False) -> List[str]:
+    """与基线比较，返回退化的指标说明
+
+    布尔指标由 True 变为 False 即为退化；数值指标按名称判断方向
+    （*_per_sec / speedup 越大越好，耗时、延迟、内存越小越好），
+    变差超过 tolerance（相对值）且超过 MIN_DELTA 时为退化。
+    """
+    flat_current, flat_baseline = flatten(current), flatten(baseline)
+    regressions = []
+    for path, base in flat_baseline.items():
+        value = flat_current.get(path)
+        if value is None:
+            continue
+        metric = path.rsplit('.', 1)[-1]
+        if isinstance(base, bool):
+            if base and value is False:
+                regressions.append(f'{path}: {base} -> {value}')
+            continue
+        if not isinstance(base, (int, float)) or not isinstance(value, (int, float)):
+            continue
+        if not strict and NOISY_METRICS.search(metric):
+            continue
+        if HIGHER_IS_BETTER.search(metric):
+            worse = base - value
+        elif LOWER_IS_BETTER.search(metric):
+            worse = value - base
+        else:
+            continue
+        if worse > MIN_DELTA and worse > tolerance * abs(base):
+            regressions.append(f'{path}: {base:,.3f} -> {value:,.3f}（退化 {worse / abs(base):.0%}）'
+                               if base else f'{path}: {base} -> {value}')
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    """主函数"""
+    arg_parser = argparse.ArgumentParser(description='Diablo 4 宏程序性能基准')
+    arg_parser.add_argument('names', nargs='*', metavar='NAME',
+                            help=f"基准项（默认全部）: {', '.join(BENCHMARKS)}")
+    arg_parser.add_argument('--json', metavar='FILE', help='把结果写入 JSON 文件')
+    arg_parser.add_argument('--baseline', metavar='FILE', help='与保存的基线结果比较')
+    arg_parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='允许的相对退化（默认 0.25）')
+    arg_parser.add_argument('--strict', action='store_true', help='同时比较 p99 / max 等尾部指标')
+    args = arg_parser.parse_args(argv)
+
+    random.seed(0)
+    results: Dict[str, Any] = {}
+    for name in args.names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            print(f"未知的基准项: {name}（可选: {', '.join(BENCHMARKS)}）")
+            continue
+        print(f"[{name}] {BENCHMARKS[name].__doc__}")
+        results[name] = BENCHMARKS[name]()
+        print_results(results[name])
+
+    if args.json:
+        document = {
+            'meta': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'results': results,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+    status = 0
+    failed = failed_checks(results)
+    if failed:
+        print(f"{len(failed)} 项检查未通过:")
+        for path in failed:
+            print(f"  {path}")
+        status = 1
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = find_regressions(results, {name: baseline[name] for name in results
+                                                 if name in baseline},
+                                       args.tolerance, args.strict)
+        if regressions:
+            print(f"相对基线退化 {len(regressions)} 项（容差 {args.tolerance:.0%}）:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"与基线相比没有超过 {args.tolerance:.0%} 的退化")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+测试配置 - 与性能基准共用 keyboard / mouse 桩模块，不会注入真实按键
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'source'))
+
+import macro_bench  # noqa: E402,F401  导入时安装桩模块并导入 macro
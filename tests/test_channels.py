@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""执行通道：数十条循环时间线同时运行，速率误差、单通道停止和按键释放"""
+
+import pytest
+
+from macro_bench import EXECUTORS, channel_timelines
+
+RATE_TOLERANCE = 0.02
+
+
+@pytest.fixture(scope='module', params=EXECUTORS)
+def results(request):
+    return channel_timelines(request.param)
+
+
+def test_hold_macro_runs_beside_loop(results):
+    hold = results['hold_with_loop']
+    assert hold['both_running']
+    assert hold['hold_stopped']
+    assert hold['loop_kept_running']
+
+
+def test_every_channel_keeps_its_rate(results):
+    stress = results['stress']
+    assert stress['running'] == stress['channels']
+    assert stress['extra_threads'] == 0
+    assert 1 - RATE_TOLERANCE <= stress['cycles_ratio_min']
+    assert stress['cycles_ratio_max'] <= 1 + RATE_TOLERANCE
+
+
+def test_stopping_one_channel_leaves_others_running(results):
+    # 只检查顺序：停止的通道之后不再注入（请求时正在提交的一步除外），其他通道照常注入
+    stop_one = results['stop_one']
+    assert stop_one['stopped']
+    assert stop_one['injected_after_stop'] <= 1
+    assert stop_one['stopped_quiet']
+    assert stop_one['others_running']
+    assert stop_one['others_injecting']
+
+
+def test_exclusive_macro_stops_all_without_stuck_keys(results):
+    exclusive = results['exclusive']
+    assert exclusive['all_stopped']
+    assert exclusive['stuck_keys'] == 0
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""窗口焦点：用假的前台窗口来源驱动焦点跟踪，失去焦点后宏及时停止并由执行线程释放按键"""
+
+import threading
+import time
+
+import pytest
+
+from macro import Config, MacroRunner, RecordingBackend
+from macro_bench import EXECUTORS, FakeWindowSource, remove_config, write_config
+
+CONFIG = ('[连招]\n触发键 = 1\n循环 = 是\n动作 =\n按住 x\n等待 200ms\n松开 x\n'
+          '[连点]\n触发键 = 2\n循环 = 是\n跳过窗口检测 = 是\n动作 =\n左键\n等待 20ms\n')
+
+
+class ThreadRecordingBackend(RecordingBackend):
+    """同时记录每批事件是在哪个线程上提交的"""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def submit(self, events):
+        self.threads.extend(threading.current_thread().name for _ in events)
+        super().submit(events)
+
+
+@pytest.fixture(params=EXECUTORS)
+def session(request):
+    source = FakeWindowSource('Diablo IV')
+    path = write_config(CONFIG)
+    try:
+        runner = MacroRunner(path, ['Diablo IV'], source, watch_config=False, executor=request.param)
+    finally:
+        remove_config(path)
+    backend = runner.engine.backend = ThreadRecordingBackend()
+    yield runner, source, backend
+    runner.executor.shutdown()
+    runner.window_monitor.stop()
+    runner.control.stop()
+
+
+def by_name(runner, name):
+    return next(macro for macro in runner.macros if macro.name == name)
+
+
+def test_focus_loss_stops_macro(session):
+    runner, source, backend = session
+    runner.start_macro(by_name(runner, '连招'))
+    time.sleep(0.05)
+    assert runner.engine.pressed_keys == ['x']
+
+    lost_at = time.perf_counter()
+    source.title = '桌面'
+    assert runner.executor.idle.wait(1.0)
+    latency = time.perf_counter() - lost_at
+    assert latency <= Config.WINDOW_FOCUS_CHECK_INTERVAL + Config.STOP_LATENCY_BOUND
+    assert runner.engine.pressed_keys == []
+
+
+def test_focus_loss_releases_keys_once_on_executor_thread(session):
+    runner, source, backend = session
+    runner.start_macro(by_name(runner, '连招'))
+    time.sleep(0.05)
+    first = len(backend.events)
+    source.title = '桌面'
+    assert runner.executor.idle.wait(1.0)
+
+    released = [(name, thread) for (_, kind, name), thread
+                in zip(backend.events[first:], backend.threads[first:]) if kind == backend.UP]
+    assert [name for name, _ in released].count('x') == 1
+    assert set(Config.FORCE_RELEASE_MODIFIER_KEYS) <= {name for name, _ in released}
+    assert all(thread not in ('WindowMonitor', 'MainThread') for _, thread in released)
+
+
+def test_skip_window_check_macro_ignores_focus_loss(session):
+    runner, source, backend = session
+    runner.start_macro(by_name(runner, '连点'))
+    time.sleep(0.05)
+    source.title = '桌面'
+    time.sleep(Config.WINDOW_FOCUS_CHECK_INTERVAL * 2)
+    assert runner.engine.running
+    runner.executor.submit(runner.executor.STOP)
+    assert runner.executor.idle.wait(1.0)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""报告输出：F9 打印调度器统计的每个宏的漂移和抖动"""
+
+import pytest
+
+from macro import MacroRunner, RecordingBackend
+from macro_bench import FakeWindowSource, remove_config, write_config
+
+CONFIG = '[连招]\n触发键 = 1\n动作 =\n按下 q\n等待 5ms\n按下 w\n'
+
+
+@pytest.fixture
+def runner():
+    path = write_config(CONFIG)
+    try:
+        runner = MacroRunner(path, ['Diablo IV'], FakeWindowSource('Diablo IV'), watch_config=False)
+    finally:
+        remove_config(path)
+    runner.engine.backend = RecordingBackend()
+    yield runner
+    runner.executor.shutdown()
+    runner.window_monitor.stop()
+    runner.control.stop()
+
+
+def test_trace_report_shows_drift_and_jitter(runner, capsys):
+    runner.dump_trace()
+    assert '定时统计' not in capsys.readouterr().out  # 还没有执行过宏
+
+    runner.engine.execute_macro(runner.macros[0])
+    runner.dump_trace()
+    out = capsys.readouterr().out
+    assert '定时统计' in out
+    row = next(line for line in out.splitlines() if line.strip().startswith('连招:'))
+    assert '抖动' in row and '次等待' in row
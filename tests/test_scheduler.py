@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""输入缓冲调度器：虚拟时钟驱动的确定性测试"""
+
+import pytest
+
+from macro import Config, InputScheduler, Macro, MacroParser
+from macro_bench import VirtualClock
+
+MAIN = Config.DEFAULT_CHANNEL
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+def queued(name, **options):
+    return Macro(name, buffer_policy='queue', **options)
+
+
+def names(scheduler):
+    return [entry[3].name for entry in scheduler.entries]
+
+
+def test_auto_policy_queues_only_rapid_presses(clock):
+    scheduler = InputScheduler(3, clock)
+    a = Macro('a')
+    assert scheduler.admit(a, busy=True) == InputScheduler.START
+    clock.advance(0.1)
+    assert scheduler.admit(a, busy=True) == InputScheduler.QUEUED
+    clock.advance(Config.RAPID_PRESS_THRESHOLD)
+    assert scheduler.admit(a, busy=True) == InputScheduler.START
+
+    held = Macro('held', repeat_mode='hold')
+    scheduler.admit(held, busy=True)
+    clock.advance(0.01)
+    assert scheduler.admit(held, busy=True) == InputScheduler.START
+
+
+def test_idle_channel_starts_immediately(clock):
+    assert InputScheduler(3, clock).admit(queued('q'), busy=False) == InputScheduler.START
+
+
+def test_duplicate_requests_coalesce(clock):
+    scheduler = InputScheduler(3, clock)
+    b = queued('b', buffer_expiry=0.3)
+    for _ in range(5):
+        assert scheduler.admit(b, busy=True) == InputScheduler.QUEUED
+        clock.advance(0.2)
+    assert len(scheduler) == 1
+    assert scheduler.stats['coalesced'] == 4
+
+
+def test_coalescing_refreshes_expiry(clock):
+    scheduler = InputScheduler(3, clock)
+    b = queued('b', buffer_expiry=0.3)
+    scheduler.admit(b, busy=True)
+    clock.advance(0.2)
+    scheduler.admit(b, busy=True)
+    clock.advance(0.2)  # 距第一次按下 0.4 秒，距最后一次 0.2 秒
+    assert scheduler.pop(MAIN) is b
+    assert scheduler.stats['expired'] == 0
+
+
+def test_expired_request_is_dropped(clock):
+    scheduler = InputScheduler(3, clock)
+    scheduler.admit(queued('b', buffer_expiry=0.3), busy=True)
+    clock.advance(0.31)
+    assert scheduler.pop(MAIN) is None
+    assert scheduler.stats['expired'] == 1
+
+
+def test_full_queue_evicts_oldest_lowest_priority(clock):
+    scheduler = InputScheduler(3, clock)
+    first, second, third = queued('first', priority=1), queued('second'), queued('third')
+    for macro in (first, second, third):
+        scheduler.admit(macro, busy=True)
+    assert scheduler.admit(queued('new'), busy=True) == InputScheduler.QUEUED
+    assert names(scheduler) == ['first', 'third', 'new']
+    assert scheduler.stats['evicted'] == 1
+
+
+def test_full_queue_rejects_only_when_every_entry_outranks(clock):
+    scheduler = InputScheduler(3, clock)
+    for name, priority in (('a', 2), ('b', 0), ('c', 2)):
+        scheduler.admit(queued(name, priority=priority), busy=True)
+
+    # 有一条优先级相同的请求：淘汰它
+    assert scheduler.admit(queued('same', priority=0), busy=True) == InputScheduler.QUEUED
+    assert names(scheduler) == ['a', 'c', 'same']
+
+    # 每一条都比新请求优先级高：拒绝
+    assert scheduler.admit(queued('lower', priority=-1), busy=True) == InputScheduler.DROPPED
+    assert names(scheduler) == ['a', 'c', 'same']
+    assert scheduler.stats['rejected'] == 1
+
+
+def test_full_queue_expires_before_evicting(clock):
+    scheduler = InputScheduler(3, clock)
+    for i in range(3):
+        scheduler.admit(queued(f'f{i}'), busy=True)
+    clock.advance(Config.INPUT_BUFFER_EXPIRY + 0.01)
+    assert scheduler.admit(queued('lowest', priority=-1), busy=True) == InputScheduler.QUEUED
+    assert names(scheduler) == ['lowest']
+    assert scheduler.stats['evicted'] == 0
+
+
+def test_pop_orders_by_priority_then_fifo(clock):
+    scheduler = InputScheduler(8, clock)
+    low, high, mid1, mid2 = (queued(name, priority=priority)
+                             for name, priority in (('low', 0), ('high', 5), ('mid1', 1), ('mid2', 1)))
+    other = queued('other', priority=9, channel='增益')
+    for macro in (low, high, mid1, other, mid2):
+        scheduler.admit(macro, busy=True)
+    assert [scheduler.pop(MAIN) for _ in range(5)] == [high, mid1, mid2, low, None]
+    assert scheduler.pop('增益') is other
+
+
+def test_ignore_and_preempt_policies(clock):
+    scheduler = InputScheduler(3, clock)
+    assert scheduler.admit(Macro('i', buffer_policy='ignore'), busy=True) == InputScheduler.DROPPED
+    assert scheduler.admit(Macro('p', buffer_policy='preempt'), busy=True) == InputScheduler.START
+    assert len(scheduler) == 0
+
+
+def test_text_format_options():
+    parsed = MacroParser().parse_text_format(
+        '[技能]\n触发键 = 1\n优先级 = 5\n缓冲 = 排队\n缓冲时限 = 300ms\n连按阈值 = 100ms\n动作 =\n按下 q\n'
+        '[普通]\n触发键 = 2\n缓冲 = 忽略\n动作 =\n按下 w\n')
+    skill, plain = parsed
+    assert (skill.priority, skill.buffer_policy, skill.buffer_expiry, skill.rapid_threshold) == (5, 'queue', 0.3, 0.1)
+    assert plain.buffer_policy == 'ignore'
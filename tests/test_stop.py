@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""停止：每种动作类型、两种执行器，停止请求唤醒正在进行的等待，之后不再注入，且没有按键残留
+
+不断言绝对的毫秒数（共享机器上的调度抖动会让它偶尔失败）：只检查顺序，
+以及停止请求落在长等待中时，宏在等待结束前就被唤醒停止。
+"""
+
+import pytest
+
+from macro_bench import EXECUTORS, STOP_CASES, stop_latencies
+
+# 停止请求落在长等待（按住时长、等待）中的动作：停止必须唤醒等待，而不是睡满
+LONG_WAIT_CASES = ('delay', 'hold', 'keydown_keyup')
+WAKE_CHECK_MIN_WAIT_MS = 100
+
+
+@pytest.fixture(scope='module', params=EXECUTORS)
+def results(request):
+    return stop_latencies(request.param)
+
+
+def test_every_action_type_measured(results):
+    assert set(results) == set(STOP_CASES)
+
+
+@pytest.mark.parametrize('action', STOP_CASES)
+def test_stop_completes_without_stuck_keys(results, action):
+    stats = results[action]
+    assert stats['checks']['stopped'], f'{action}: 停止请求后执行器没有空闲'
+    assert stats['stuck_keys'] == 0, f"{action}: 停止后仍有 {stats['stuck_keys']} 个按键未松开"
+
+
+@pytest.mark.parametrize('action', STOP_CASES)
+def test_nothing_injected_after_stop(results, action):
+    # 停止请求时正在提交的一步可能落在请求之后，除此之外只有松开事件
+    assert results[action]['injected_after_stop'] <= 1
+
+
+@pytest.mark.parametrize('action', LONG_WAIT_CASES)
+def test_stop_wakes_pending_wait(results, action):
+    stats = results[action]
+    assert stats['checks']['stopped']
+    assert stats['longest_wait_ms'] >= WAKE_CHECK_MIN_WAIT_MS
+    assert stats['max'] < stats['longest_wait_ms'] / 2